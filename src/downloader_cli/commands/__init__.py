@@ -17,3 +17,12 @@ from . import generate_playlist  # noqa: F401
 from . import podman_run  # noqa: F401
 from . import mpv  # noqa: F401
 from . import serve_watch_playlist  # noqa: F401
+from . import benchmark  # noqa: F401
+from . import aggregate_playlist  # noqa: F401
+from . import run_jobs  # noqa: F401
+from . import checksum  # noqa: F401
+from . import admit_download  # noqa: F401
+from . import load_test  # noqa: F401
+from . import autotune_download  # noqa: F401
+from . import peer_download  # noqa: F401
+from . import append_playlist  # noqa: F401
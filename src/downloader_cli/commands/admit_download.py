@@ -0,0 +1,107 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import subprocess
+import typer
+from pathlib import Path
+from typing import IO, List, Optional, Tuple
+from .autotune_download import tuned_download
+from .ytdlp import prepare_download_command
+from ..utils.admission import (
+    DEFAULT_RESERVE,
+    DEFAULT_UNKNOWN_SIZE,
+    fetch_sizes,
+    parse_aria2_input,
+    run_with_admission,
+    write_aria2_input,
+)
+from ..utils.config import get_config_value, get_state_dir, parse_size
+
+
+def admitted_download(
+    settings: dict,
+    max_wait: Optional[float] = 3600.0,
+    poll_interval: float = 60.0,
+    output: Optional[IO] = None,
+) -> Tuple[List[dict], List[dict]]:
+    """
+    Run an aria2c download in waves that fit the free space of the target.
+    Returns the entries that could not be admitted and those of failed batches.
+    """
+    download_dir = Path(settings["download_dir"])
+    state_dir = get_state_dir(download_dir)
+    entries = parse_aria2_input(Path(settings["playlist_file"]))
+    fetch_sizes(entries)
+    known = [entry["size"] for entry in entries if entry["size"] is not None]
+    typer.echo(
+        f"Preflight: {len(entries)} URL(s), {sum(known) / 1024**3:.2f} GB known, "
+        f"{len(entries) - len(known)} of unknown size"
+    )
+
+    reserve = get_config_value("disk_reserve")
+    unknown_size = get_config_value("unknown_size_estimate")
+
+    def run_batch(batch: List[dict]) -> int:
+        batch_file = state_dir / "admitted_urls.txt"
+        write_aria2_input(batch_file, batch)
+        if settings.get("autotune"):
+            return tuned_download(
+                {**settings, "playlist_file": str(batch_file)}, output
+            )
+        cmd = prepare_download_command({**settings, "playlist_file": str(batch_file)})
+        return subprocess.run(
+            cmd, shell=True, stdout=output, stderr=subprocess.STDOUT if output else None
+        ).returncode
+
+    return run_with_admission(
+        entries,
+        download_dir,
+        run_batch,
+        reserve=parse_size(reserve) if reserve else DEFAULT_RESERVE,
+        unknown_size=parse_size(unknown_size) if unknown_size else DEFAULT_UNKNOWN_SIZE,
+        poll_interval=poll_interval,
+        max_wait=max_wait,
+    )
+
+
+def admit_download(
+    download_dir: Path = typer.Option(..., "--dir", help="Download directory"),
+    input_file: Path = typer.Option(..., "--input", "-i", help="aria2c input file"),
+    options: str = typer.Option("", "--options", help="Extra aria2c options"),
+    max_wait: float = typer.Option(
+        3600.0, "--max-wait", help="Seconds to wait for space before giving up"
+    ),
+    autotune: bool = typer.Option(
+        False, "--autotune", help="Tune connections per host from measured throughput"
+    ),
+):
+    """Download an aria2c URL list in waves that fit the free disk space."""
+    settings = {
+        "download_dir": str(download_dir),
+        "downloader": "aria2c",
+        "aria2c_settings": options,
+        "playlist_file": str(input_file),
+        "autotune": autotune,
+    }
+    left_over, failed = admitted_download(settings, max_wait=max_wait)
+    if left_over:
+        typer.echo(f"{len(left_over)} download(s) never fit into the free space:")
+        for entry in left_over:
+            typer.echo(f"  {entry['url']}")
+    if failed:
+        typer.echo(f"{len(failed)} download(s) were in batches that failed:")
+        for entry in failed:
+            typer.echo(f"  {entry['url']}")
+    if left_over or failed:
+        raise typer.Exit(code=1)
@@ -0,0 +1,117 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import logging
+import typer
+import uvicorn
+from typing import List
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+from .generate_playlist import IPWhitelistMiddleware, get_whitelisted_ips
+from ..utils.federation import PeerListingCache
+from ..utils.io_executor import IOExecutor
+from ..utils.network import get_host_ip
+
+logger = logging.getLogger(__name__)
+
+
+def render_merged_playlist(entries: List[dict]) -> str:
+    lines = ["#EXTM3U"]
+    for entry in entries:
+        lines.append(f"#EXTINF:-1,{entry['name']}")
+        lines.append(entry["url"])
+    return "\n".join(lines) + "\n"
+
+
+async def refresh_peers(app) -> None:
+    # One refresh at a time; concurrent requests wait for it and reuse it.
+    async with app.state.refresh_lock:
+        await asyncio.to_thread(app.state.peer_cache.refresh)
+
+
+async def handle_merged_playlist(request):
+    await refresh_peers(request.app)
+    cache = request.app.state.peer_cache
+    if request.app.state.rendered_generation != cache.generation:
+        request.app.state.rendered_playlist = render_merged_playlist(
+            cache.merged_entries()
+        )
+        request.app.state.rendered_generation = cache.generation
+    return PlainTextResponse(
+        request.app.state.rendered_playlist, media_type="audio/x-mpegurl"
+    )
+
+
+async def handle_merged_files(request):
+    await refresh_peers(request.app)
+    return JSONResponse({"files": request.app.state.peer_cache.merged_entries()})
+
+
+async def handle_peers(request):
+    return JSONResponse({"peers": request.app.state.peer_cache.status()})
+
+
+def create_aggregator_app(peer_cache: PeerListingCache) -> Starlette:
+    app = Starlette(
+        routes=[
+            Route("/", handle_merged_playlist),
+            Route("/playlist.m3u8", handle_merged_playlist),
+            Route("/api/files", handle_merged_files),
+            Route("/api/peers", handle_peers),
+        ],
+        middleware=[
+            Middleware(
+                IPWhitelistMiddleware,
+                io=IOExecutor(max_workers=2),
+                whitelisted_ips=get_whitelisted_ips(),
+            )
+        ],
+    )
+    app.state.peer_cache = peer_cache
+    app.state.refresh_lock = asyncio.Lock()
+    app.state.rendered_generation = -1
+    app.state.rendered_playlist = ""
+    return app
+
+
+def aggregate_playlist(
+    peers: List[str] = typer.Option(
+        ...,
+        "--peer",
+        help="Base URL of a downloader-cli server (can be specified multiple times)",
+    ),
+    ip: str = typer.Option(None, "--ip", help="IP to bind the server to (optional)"),
+    port: int = typer.Option(8100, "--port", "-p", help="Port to serve on"),
+    ttl: float = typer.Option(
+        60.0, "--ttl", help="Seconds before a peer listing is revalidated"
+    ),
+):
+    """Serve one merged, deduplicated playlist built from several servers."""
+    if ip is None:
+        ip = get_host_ip()
+
+    peer_cache = PeerListingCache(peers, ttl=ttl)
+    peer_cache.refresh(force=True)
+    for status in peer_cache.status():
+        typer.echo(
+            f"{status['peer']}: {status['files']} files"
+            + (f" ({status['error']})" if status["error"] else "")
+        )
+
+    typer.echo(f"Merged playlist: http://{ip}:{port}/playlist.m3u8")
+    typer.echo("Press CTRL+C to stop the server")
+    uvicorn.run(create_aggregator_app(peer_cache), host=ip, port=port)
@@ -0,0 +1,151 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import posixpath
+import typer
+from pathlib import Path
+from typing import List, Optional, Set, Tuple
+from urllib.parse import quote
+from .generate_playlist import IMAGE_EXTENSIONS, VIDEO_EXTENSIONS, get_file_info
+from ..utils.config import get_state_dir
+from ..utils.ignore_rules import walk
+from ..utils.media_index import MediaIndex
+from ..utils.partial_downloads import CONTROL_SUFFIX
+from ..utils.playlist_registry import MANIFEST_NAME, PlaylistRegistry
+
+
+def find_new_files(
+    download_dir: Path, root: Path, since: float, known: Set[str]
+) -> List[Path]:
+    """
+    Finished media files under `download_dir` that changed place at or after
+    `since` (renames set the ctime, so a file moved into place by the
+    downloader counts) and whose path relative to `root` is not in the media
+    index yet.
+    """
+    extensions = VIDEO_EXTENSIONS.union(IMAGE_EXTENSIONS)
+    new_files = []
+    for directory, files in walk(download_dir):
+        for name in files:
+            path = directory / name
+            if path.suffix.lower() not in extensions:
+                continue
+            if path.relative_to(root).as_posix() in known:
+                continue
+            if path.with_name(name + CONTROL_SUFFIX).exists():
+                continue
+            try:
+                if path.stat().st_ctime < since:
+                    continue
+            except OSError:
+                continue
+            new_files.append(path)
+    return sorted(new_files)
+
+
+def find_served_root(
+    download_dir: Path, playlist: Optional[str] = None
+) -> Optional[Tuple[Path, PlaylistRegistry, dict]]:
+    """
+    The served root that holds `download_dir` (itself, or an ancestor for a
+    `--new-dir` session directory), with its registry and newest playlist, or
+    the registered playlist named `playlist`. Only looks where a playlist
+    manifest exists, so nothing is created on the way up.
+    """
+    for root in (download_dir, *download_dir.parents):
+        if root == root.parent:
+            break
+        manifest = get_state_dir(root.parent, create=False) / MANIFEST_NAME
+        if not manifest.is_file():
+            continue
+        registry = PlaylistRegistry(root.parent)
+        if playlist is None:
+            entry = registry.latest_for(root)
+        else:
+            entry = next(
+                (
+                    e
+                    for e in registry.entries()
+                    if e["file"] == playlist and str(root) in e["roots"]
+                ),
+                None,
+            )
+        if entry is not None:
+            return root, registry, entry
+    return None
+
+
+def append_new_downloads(
+    download_dir: Path, since: float = 0.0, playlist: Optional[str] = None
+) -> List[dict]:
+    """
+    Probe only the files a download just created and append them to the media
+    index and the newest playlist (or `playlist`, a registered file name) of
+    the served root that holds `download_dir`. Returns the new entries.
+    """
+    download_dir = Path(download_dir).resolve()
+    served = find_served_root(download_dir, playlist)
+    root = served[0] if served is not None else download_dir
+    index = MediaIndex(root)
+    infos = []
+    for path in find_new_files(download_dir, root, since, index.paths()):
+        try:
+            infos.append(get_file_info(path, root))
+        except OSError as e:
+            typer.echo(f"Skipping {path.name}: {e}")
+    index.append(infos)
+    if not infos:
+        return infos
+    if served is None:
+        typer.echo(f"No playlist of {download_dir} to append to, indexed only")
+        return infos
+
+    _, registry, entry = served
+    entries = []
+    for info in infos:
+        # Spelled like generate_m3u8 does, "./" included, so repeats are found.
+        parent = posixpath.dirname(info["relative_path"]) or os.curdir
+        path = f"{root.name}/{parent}/{info['name']}"
+        url = f"{entry['host']}/{quote(path)}"
+        entries.append((url, f"#EXTINF:-1,{info['name']}\n{url}\n"))
+    appended = registry.append_missing(entry["file"], entries)
+    typer.echo(f"Appended {appended} file(s) to {entry['file']}")
+    return infos
+
+
+def append_playlist(
+    download_dir: Path = typer.Option(
+        ...,
+        "--dir",
+        help="Download directory",
+        exists=True,
+        file_okay=False,
+        dir_okay=True,
+        resolve_path=True,
+    ),
+    since: float = typer.Option(
+        0.0,
+        "--since",
+        help="Only files moved into place after this Unix time (default: all new)",
+    ),
+    playlist: Optional[str] = typer.Option(
+        None,
+        "--playlist",
+        help="Registered playlist to append to (default: the newest one)",
+    ),
+):
+    """Add newly downloaded files to a playlist and the media index in place."""
+    infos = append_new_downloads(download_dir, since, playlist)
+    typer.echo(f"{download_dir}: {len(infos)} new file(s) indexed")
@@ -0,0 +1,55 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import typer
+from pathlib import Path
+from typing import IO, Optional
+from .ytdlp import prepare_download_command
+from ..utils.admission import parse_aria2_input, write_aria2_input
+from ..utils.aria2_tuning import HostTuning, parse_connections, run_measured
+from ..utils.config import get_state_dir
+
+
+def tuned_download(settings: dict, output: Optional[IO] = None) -> int:
+    """
+    Run aria2c with the connection counts learned for each host, measure the
+    run and store what to try next time.
+    """
+    state_dir = get_state_dir(Path(settings["download_dir"]))
+    tuning = HostTuning()
+    entries = tuning.apply(parse_aria2_input(Path(settings["playlist_file"])))
+    tuned_file = state_dir / "tuned_urls.txt"
+    write_aria2_input(tuned_file, entries)
+
+    cmd = prepare_download_command({**settings, "playlist_file": str(tuned_file)})
+    return run_measured(
+        cmd, parse_connections(settings["aria2c_settings"]), tuning, output=output
+    )
+
+
+def autotune_download(
+    download_dir: Path = typer.Option(..., "--dir", help="Download directory"),
+    input_file: Path = typer.Option(..., "--input", "-i", help="aria2c input file"),
+    options: str = typer.Option("", "--options", help="Extra aria2c options"),
+):
+    """Download an aria2c URL list with per-host connection counts tuned per run."""
+    settings = {
+        "download_dir": str(download_dir),
+        "downloader": "aria2c",
+        "aria2c_settings": options,
+        "playlist_file": str(input_file),
+    }
+    returncode = tuned_download(settings)
+    if returncode != 0:
+        raise typer.Exit(code=returncode)
@@ -0,0 +1,85 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import typer
+from pathlib import Path
+from typing import Callable, List, Optional
+from .generate_playlist import VIDEO_EXTENSIONS
+from ..utils.ignore_rules import walk
+from ..utils.media_probe import ffprobe_duration, probe_media
+
+
+def _time_probe(files: List[Path], probe: Callable[[Path], object]) -> dict:
+    resolved = 0
+    start = time.perf_counter()
+    for file_path in files:
+        if probe(file_path) is not None:
+            resolved += 1
+    elapsed = time.perf_counter() - start
+    return {
+        "files": len(files),
+        "resolved": resolved,
+        "seconds": elapsed,
+        "files_per_second": len(files) / elapsed if elapsed else 0.0,
+    }
+
+
+def benchmark_probe(
+    directories: List[Path] = typer.Option(
+        ...,
+        "--directory",
+        "-d",
+        help="Directories containing video files (can be specified multiple times)",
+    ),
+    limit: Optional[int] = typer.Option(
+        200, "--limit", "-n", help="Maximum number of files to probe"
+    ),
+    skip_ffprobe: bool = typer.Option(
+        False, "--skip-ffprobe", help="Only measure the native header parser"
+    ),
+):
+    """Compare files per second of the native header parser against ffprobe."""
+    files = []
+    for directory in directories:
+        if limit and len(files) >= limit:
+            break
+        for dirpath, filenames in walk(directory):
+            for name in filenames:
+                if Path(name).suffix.lower() in VIDEO_EXTENSIONS:
+                    files.append(dirpath / name)
+                    if limit and len(files) >= limit:
+                        break
+            if limit and len(files) >= limit:
+                break
+
+    if not files:
+        typer.echo("No video files found.")
+        raise typer.Exit(code=1)
+
+    results = {"native": _time_probe(files, probe_media)}
+    if not skip_ffprobe:
+        results["ffprobe"] = _time_probe(files, ffprobe_duration)
+
+    for name, result in results.items():
+        typer.echo(
+            f"{name:>8}: {result['files_per_second']:10.1f} files/s "
+            f"({result['resolved']}/{result['files']} resolved in {result['seconds']:.2f}s)"
+        )
+
+    if "ffprobe" in results and results["ffprobe"]["seconds"]:
+        speedup = results["ffprobe"]["seconds"] / max(
+            results["native"]["seconds"], 1e-9
+        )
+        typer.echo(f"Native parser speedup: {speedup:.1f}x")
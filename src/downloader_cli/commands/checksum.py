@@ -0,0 +1,82 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import typer
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional
+from .generate_playlist import IMAGE_EXTENSIONS, VIDEO_EXTENSIONS
+from ..utils.checksums import ChecksumManifest, iter_media_files
+from ..utils.device_io import DeviceScheduler
+from ..utils.ignore_rules import ScanStats
+
+
+def checksum(
+    directories: List[Path] = typer.Option(
+        ...,
+        "--directory",
+        "-d",
+        help="Directories to hash (can be specified multiple times)",
+        exists=True,
+        file_okay=False,
+        dir_okay=True,
+        resolve_path=True,
+    ),
+    workers: Optional[int] = typer.Option(
+        None,
+        "--workers",
+        "-w",
+        help="Hashing threads per disk (default: device_io_workers from the config)",
+    ),
+):
+    """Hash media files into a resumable checksum manifest used for ETags."""
+    extensions = VIDEO_EXTENSIONS.union(IMAGE_EXTENSIONS)
+    # Directories on different disks are hashed in parallel, each disk with
+    # its own bounded number of readers.
+    devices = DeviceScheduler(directories, per_device=workers)
+
+    def hash_directory(directory: Path):
+        manifest = ChecksumManifest(directory)
+        scan = ScanStats()
+        files = list(iter_media_files(directory, extensions, scan))
+        typer.echo(f"{directory}: {scan.summary()}")
+        start = time.monotonic()
+        total_bytes = 0
+
+        def progress(path: Path, done: int, total: int):
+            nonlocal total_bytes
+            total_bytes += path.stat().st_size
+            typer.echo(f"[{done}/{total}] {path.relative_to(directory)}")
+
+        hashed = manifest.build(files, on_progress=progress, scheduler=devices)
+        elapsed = time.monotonic() - start
+        rate = total_bytes / 1024**2 / elapsed if elapsed else 0.0
+        typer.echo(
+            f"{directory}: hashed {hashed} of {len(files)} files "
+            f"({total_bytes / 1024**2:.1f} MB, {rate:.1f} MB/s), "
+            f"manifest at {manifest.path}"
+        )
+
+    with ThreadPoolExecutor(max_workers=len(directories)) as executor:
+        list(executor.map(hash_directory, directories))
+    devices.shutdown()
+
+    for stats in devices.stats():
+        typer.echo(
+            f"Device {stats['device']} ({', '.join(stats['roots'])}): "
+            f"{stats['operations']} files, {stats['bytes'] / 1024**2:.1f} MB, "
+            f"{stats['busy_seconds']:.1f}s busy, "
+            f"{stats['throughput_mb_s']:.1f} MB/s per reader"
+        )
@@ -13,25 +13,69 @@
 # limitations under the License.
 
 import os
+import asyncio
+import hashlib
+import mimetypes
+import stat as stat_module
 import typer
+import aiofiles
 from pathlib import Path
 import ipaddress
 import requests
 from ..utils.network import get_host_ip
 from starlette.applications import Starlette
-from starlette.responses import HTMLResponse, FileResponse, PlainTextResponse
+from starlette.responses import (
+    HTMLResponse,
+    FileResponse,
+    JSONResponse,
+    PlainTextResponse,
+    RedirectResponse,
+    Response,
+    StreamingResponse,
+)
 from starlette.routing import Route
 from starlette.middleware import Middleware
 from starlette.middleware.base import BaseHTTPMiddleware
 from urllib.parse import unquote, quote
 import uvicorn
 import html as html_module
-from typing import List
+from typing import Dict, List, Optional, Tuple
 from ..utils.config import get_config_value
-import subprocess
+from ..utils.playlist_registry import PlaylistRegistry
+from ..utils.media_probe import get_duration
+from ..utils.partial_downloads import (
+    CONTROL_SUFFIX,
+    PART_SUFFIX,
+    SIDECAR_SUFFIXES,
+    PartialDownload,
+    follow,
+    parse_range,
+)
+from ..utils.profiling import mark, stage
+from ..utils.device_io import DeviceScheduler
+from ..utils.file_index import FileIndex
+from ..utils.ignore_rules import IGNORE_FILE, ScanStats, walk
+from ..utils.io_executor import DEFAULT_WORKERS, IOExecutor
+from ..utils.search_index import SearchIndex
+from ..utils.bandwidth import TICKET_KEY, BandwidthShaper, ShapingMiddleware
+from ..utils.checksums import ChecksumStore
+from ..utils.media_index import MediaIndexFollower
+from ..utils.memory_cache import MemoryFileCache
+from ..utils.peer_cache import PeerIndex
+from ..utils.cluster import (
+    DEFAULT_CHECK_INTERVAL,
+    NODE_HEADER,
+    REDIRECTED_PARAM,
+    Cluster,
+)
+from ..utils.metrics import MetricsMiddleware, ServerMetrics
+from ..utils.playlist_render import PlaylistRenderer, base_url_from_headers
 import logging
+import time
 from datetime import datetime
+from email.utils import formatdate
 from functools import lru_cache
+from contextlib import asynccontextmanager
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
@@ -122,34 +166,34 @@ def generate_m3u8(
     playlist_content = "#EXTM3U\n"
     base_url = f"http://{'localhost' if use_localhost else ip}:{port}"
 
-    for directory in directories:
-        for root, _, files in os.walk(directory):
-            for file in files:
-                if file.lower().endswith(
-                    tuple(VIDEO_EXTENSIONS.union(IMAGE_EXTENSIONS))
-                ):
-                    relative_path = os.path.relpath(root, directory)
-                    encoded_path = quote(f"{directory.name}/{relative_path}/{file}")
-                    file_url = f"{base_url}/{encoded_path}"
-                    playlist_content += f"#EXTINF:-1,{file}\n{file_url}\n"
-
-    # Find the next available index for the playlist file
-    index = 1
-    while True:
-        playlist_path = directories[0].parent / f"playlist_{index}.m3u8"
-        if not playlist_path.exists():
-            break
-        index += 1
-
-    with open(playlist_path, "w") as f:
-        f.write(playlist_content)
-
-    return playlist_path
+    scan = ScanStats()
+    with stage("scan"):
+        for directory in directories:
+            for root, files in walk(directory, scan):
+                for file in files:
+                    if file.lower().endswith(
+                        tuple(VIDEO_EXTENSIONS.union(IMAGE_EXTENSIONS))
+                    ):
+                        relative_path = os.path.relpath(root, directory)
+                        encoded_path = quote(f"{directory.name}/{relative_path}/{file}")
+                        file_url = f"{base_url}/{encoded_path}"
+                        playlist_content += f"#EXTINF:-1,{file}\n{file_url}\n"
+
+    logger.info(f"Playlist scan: {scan.summary()}")
+
+    with stage("playlist write"):
+        registry = PlaylistRegistry(directories[0].parent)
+        return registry.register(playlist_content, directories, base_url)
 
 
 @lru_cache(maxsize=1000)
 def get_file_info(file_path: Path, directory: Path) -> dict:
     stat = file_path.stat()
+    # Running downloads are listed under the name they will end up with.
+    downloading = file_path.with_name(file_path.name + CONTROL_SUFFIX).exists()
+    if file_path.name.endswith(PART_SUFFIX):
+        file_path = file_path.with_name(file_path.name[: -len(PART_SUFFIX)])
+        downloading = True
     file_info = {
         "name": file_path.name,
         "size": stat.st_size,
@@ -158,30 +202,16 @@ def get_file_info(file_path: Path, directory: Path) -> dict:
         ),
         "extension": file_path.suffix.lower(),
         "directory": directory,
+        "relative_path": file_path.relative_to(directory).as_posix(),
     }
-
-    if file_info["extension"] in VIDEO_EXTENSIONS:
-        try:
-            result = subprocess.run(
-                [
-                    "ffprobe",
-                    "-v",
-                    "error",
-                    "-show_entries",
-                    "format=duration",
-                    "-of",
-                    "default=noprint_wrappers=1:nokey=1",
-                    str(file_path),
-                ],
-                capture_output=True,
-                text=True,
-            )
-            duration = float(result.stdout)
-            file_info["duration"] = f"{int(duration // 60)}:{int(duration % 60):02d}"
-        except subprocess.CalledProcessError:
-            file_info["duration"] = "N/A"
-        except ValueError:
+    if downloading:
+        file_info["downloading"] = True
+    elif file_info["extension"] in VIDEO_EXTENSIONS:
+        duration = get_duration(file_path)
+        if duration is None:
             file_info["duration"] = "N/A"
+        else:
+            file_info["duration"] = f"{int(duration // 60)}:{int(duration % 60):02d}"
 
     return file_info
 
@@ -189,18 +219,59 @@ def get_file_info(file_path: Path, directory: Path) -> dict:
 async def calculate_file_info(directories: List[Path]):
     file_info_list = []
     for directory in directories:
-        for file_path in directory.rglob("*"):
-            if (
-                file_path.is_file()
-                and file_path.suffix.lower() in VIDEO_EXTENSIONS.union(IMAGE_EXTENSIONS)
-            ):
-                file_info_list.append(get_file_info(file_path, directory))
+        for root, files in walk(directory):
+            for name in files:
+                file_path = root / name
+                if file_path.suffix.lower() in VIDEO_EXTENSIONS.union(IMAGE_EXTENSIONS):
+                    file_info_list.append(get_file_info(file_path, directory))
     return sorted(file_info_list, key=lambda x: x["created_at"], reverse=True)
 
 
+def collect_download_progress(
+    files: List[dict],
+) -> Dict[str, Tuple[int, Optional[int]]]:
+    """(available, total) of the listed files that are still downloading."""
+    progress = {}
+    for file in files:
+        path = file["directory"] / file["relative_path"]
+        download = PartialDownload.find(path, path.exists())
+        if download is None:
+            continue
+        available, total, finished = download.progress()
+        if not finished:
+            progress[path.as_posix()] = (available, total)
+    return progress
+
+
+def format_size(file: dict, progress: Dict[str, Tuple[int, Optional[int]]]) -> str:
+    key = (file["directory"] / file["relative_path"]).as_posix()
+    if key not in progress:
+        return f"{file['size'] // 1024 // 1024} MB"
+    available, total = progress[key]
+    if total:
+        return (
+            f"{available // 1024 // 1024} / {total // 1024 // 1024} MB "
+            f"⏬ {available * 100 // total}%"
+        )
+    return f"{available // 1024 // 1024} MB ⏬"
+
+
 async def handle_root_request(request):
-    directories = request.app.state.directories
-    files = request.app.state.file_info  # Use pre-calculated file info
+    file_index = request.app.state.file_index
+    files = file_index.sorted_entries()
+    downloading = [f for f in files if f.get("downloading")]
+    download_progress = (
+        await request.app.state.io.run(collect_download_progress, downloading)
+        if downloading
+        else {}
+    )
+    if file_index.ready:
+        progress = ""
+    else:
+        progress = (
+            f'<p class="progress">⏳ {file_index.indexed:,} / '
+            f"{file_index.total:,} indexed</p>"
+        )
 
     css = """
     <style>
@@ -271,6 +342,10 @@ async def handle_root_request(request):
         .file-link:hover {
             text-decoration: underline;
         }
+        .progress {
+            text-align: center;
+            color: #f9e2af;
+        }
     </style>
     """
 
@@ -335,9 +410,10 @@ async def handle_root_request(request):
     <body>
         <h1>🚀 File Server</h1>
         <div class="button-container">
-            <a href="/{request.app.state.playlist_file.name}" download><button class="button">⬇️ Download Playlist</button></a>
+            <a href="/playlist.m3u8" download><button class="button">⬇️ Download Playlist</button></a>
             <a href="/raw-playlist"><button class="button">👁️ View Raw Playlist</button></a>
         </div>
+        {progress}
         <table id="fileTable">
             <thead>
                 <tr>
@@ -359,7 +435,7 @@ async def handle_root_request(request):
         content += f"""
                 <tr>
                     <td><a href="{file_path}" target="_blank" class="file-link">{html_module.escape(file['name'])}</a></td>
-                    <td>{file['size'] // 1024 // 1024} MB</td>
+                    <td>{format_size(file, download_progress)}</td>
                     <td>{file['created_at']}</td>
                     <td>{file.get('duration', 'N/A')}</td>
                 </tr>
@@ -376,85 +452,560 @@ async def handle_root_request(request):
 
 
 async def handle_raw_playlist(request):
-    playlist_path = Path(request.app.state.directories[0]) / "playlist.m3u8"
-    if playlist_path.exists():
-        with open(playlist_path, "r") as f:
-            content = f.read()
-        return PlainTextResponse(content)
-    else:
+    state = request.app.state
+    try:
+        async with aiofiles.open(
+            state.playlist_file, "r", executor=state.io.executor
+        ) as f:
+            content = await f.read()
+    except FileNotFoundError:
         return PlainTextResponse("Playlist not found", status_code=404)
+    return PlainTextResponse(content)
+
+
+async def handle_playlist(request):
+    """Playlist with URLs for the host, port and proxy prefix the client used."""
+    base_url = base_url_from_headers(
+        request.headers, request.url.scheme, request.url.netloc
+    )
+    return StreamingResponse(
+        request.app.state.playlist_renderer.render(base_url),
+        media_type="audio/mpegurl",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    candidates = [c.strip() for c in header.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def locate_file(
+    directories: List[Path], file_path: str, checksums: ChecksumStore
+) -> Optional[Tuple[Path, os.stat_result, Optional[str], Optional[PartialDownload]]]:
+    """
+    Find the requested file and its known content hash, or the download that
+    is still writing it. Does all the stat calls of a request in one go, so it
+    can run in the I/O executor.
+    """
+    candidates = []
+    if file_path.startswith("playlist_") and file_path.endswith(".m3u8"):
+        candidates.append(directories[0].parent / file_path)
+    for directory in directories:
+        candidates.append(directory / file_path)
+        # Try to find the file by ignoring the directory name in the URL
+        candidates.append(directory / Path(*Path(file_path).parts[1:]))
+
+    for full_path in candidates:
+        try:
+            stat = full_path.stat()
+        except OSError:
+            stat = None
+        if stat is not None and not stat_module.S_ISREG(stat.st_mode):
+            continue
+        download = PartialDownload.find(full_path, stat is not None)
+        if download is not None:
+            return full_path, stat, None, download
+        if stat is not None:
+            return full_path, stat, checksums.lookup(full_path, stat), None
+    return None
+
+
+def serve_file(
+    request, full_path: Path, stat: os.stat_result, digest: Optional[str]
+) -> Response:
+    """FileResponse with a strong content-hash ETag when one is known."""
+    if digest is None:
+        return FileResponse(full_path, stat_result=stat)
+
+    etag = f'"{digest}"'
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    # FileResponse compares If-Range against this ETag, so a resumed download
+    # only gets a partial response when the content is still the same.
+    return FileResponse(full_path, stat_result=stat, headers={"ETag": etag})
+
+
+class BufferResponse(Response):
+    """A response whose body is sent as given, so a memoryview is not copied."""
+
+    def render(self, content) -> bytes | memoryview:
+        return b"" if content is None else content
+
+
+def serve_buffer(
+    request,
+    buffer: memoryview,
+    full_path: Path,
+    stat: os.stat_result,
+    digest: Optional[str],
+) -> Response:
+    """
+    Serve a file from the memory cache with the headers FileResponse would
+    send, answering conditional and Range requests from the buffer.
+    """
+    if digest is not None:
+        etag = f'"{digest}"'
+    else:
+        # Same weak validator as FileResponse, whichever way the file is served.
+        etag_base = f"{stat.st_mtime}-{stat.st_size}".encode()
+        etag = f'"{hashlib.md5(etag_base, usedforsecurity=False).hexdigest()}"'
+    last_modified = formatdate(stat.st_mtime, usegmt=True)
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    media_type = mimetypes.guess_type(full_path.name)[0] or "application/octet-stream"
+    headers = {"Accept-Ranges": "bytes", "ETag": etag, "Last-Modified": last_modified}
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header is None or if_range not in (None, etag, last_modified):
+        return BufferResponse(buffer, media_type=media_type, headers=headers)
+
+    size = len(buffer)
+    byte_range = parse_range(range_header, size)
+    if byte_range is None:
+        return BufferResponse(buffer, media_type=media_type, headers=headers)
+    start, end = byte_range
+    end = size - 1 if end is None else min(end, size - 1)
+    if start > end:
+        return PlainTextResponse(
+            status_code=416, headers={"Content-Range": f"bytes */{size}"}
+        )
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return BufferResponse(
+        buffer[start : end + 1],
+        status_code=206,
+        media_type=media_type,
+        headers=headers,
+    )
+
+
+async def serve_partial(request, download: PartialDownload) -> Response:
+    """
+    Stream a file that is still downloading. A plain GET follows the file
+    until the download finishes; Range requests are limited to the bytes that
+    are already there.
+    """
+    io = request.app.state.io
+    available, total, _finished = await io.run(download.progress)
+    media_type = (
+        mimetypes.guess_type(download.final_path.name)[0] or "application/octet-stream"
+    )
+    headers = {"Accept-Ranges": "bytes", "Cache-Control": "no-store"}
+    complete_length = total if total is not None else "*"
+
+    range_header = request.headers.get("range")
+    if range_header is None:
+        if total is not None:
+            headers["Content-Length"] = str(total)
+        return StreamingResponse(
+            follow(download, 0, None, io.executor),
+            media_type=media_type,
+            headers=headers,
+        )
+
+    byte_range = parse_range(range_header, total)
+    if byte_range is None or byte_range[0] >= available:
+        headers["Content-Range"] = f"bytes */{complete_length}"
+        return Response(status_code=416, headers=headers)
+    start, end = byte_range
+    end = available - 1 if end is None else min(end, available - 1)
+    if start > end:
+        headers["Content-Range"] = f"bytes */{complete_length}"
+        return Response(status_code=416, headers=headers)
+    headers["Content-Range"] = f"bytes {start}-{end}/{complete_length}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        follow(download, start, end, io.executor),
+        status_code=206,
+        media_type=media_type,
+        headers=headers,
+    )
+
+
+def cluster_redirect(request, file_path: str) -> Optional[Response]:
+    """307 to the node that owns the file, if that is not this one."""
+    cluster = request.app.state.cluster
+    if cluster is None or REDIRECTED_PARAM in request.query_params:
+        return None
+    owner = cluster.redirect_base(file_path)
+    if owner is None:
+        return None
+    cluster.redirects += 1
+    query = f"{request.url.query}&" if request.url.query else ""
+    return RedirectResponse(
+        f"{owner}{request.url.path}?{query}{REDIRECTED_PARAM}=1", status_code=307
+    )
 
 
 async def handle_file_request(request):
     file_path = unquote(request.path_params["file_path"])
-    directories = request.app.state.directories
+    redirect = cluster_redirect(request, file_path)
+    if redirect is not None:
+        return redirect
+    state = request.app.state
+    located = await state.io.run(
+        locate_file, state.directories, file_path, state.checksums
+    )
+    if located is None:
+        return PlainTextResponse("File not found", status_code=404)
+    full_path, stat, digest, download = located
+    shaper = state.shaper
+    if shaper is not None:
+        ticket = shaper.open_stream(request.client.host, "range" in request.headers)
+        if ticket is None:
+            return PlainTextResponse(
+                "Too many concurrent streams",
+                status_code=429,
+                headers={"Retry-After": "5"},
+            )
+        request.scope[TICKET_KEY] = ticket
+    if download is not None:
+        return await serve_partial(request, download)
+    memory_cache = state.memory_cache
+    if memory_cache is not None and memory_cache.eligible(stat):
+        buffer = memory_cache.get(full_path, stat)
+        if buffer is None:
+            loaded = await state.io.run(memory_cache.load, full_path)
+            if loaded is None:
+                # Gone, grown or still being written: the stat and digest
+                # located above are stale, so look the file up again.
+                located = await state.io.run(
+                    locate_file, state.directories, file_path, state.checksums
+                )
+                if located is None:
+                    return PlainTextResponse("File not found", status_code=404)
+                full_path, stat, digest, download = located
+                if download is not None:
+                    return await serve_partial(request, download)
+                return serve_file(request, full_path, stat, digest)
+            buffer, loaded_stat = loaded
+            changed = loaded_stat.st_mtime_ns != stat.st_mtime_ns
+            if changed or loaded_stat.st_size != stat.st_size:
+                # Changed since it was located; `digest` is of the old contents.
+                digest = None
+            stat = loaded_stat
+        return serve_buffer(request, buffer, full_path, stat, digest)
+    return serve_file(request, full_path, stat, digest)
 
-    if file_path.startswith("playlist_") and file_path.endswith(".m3u8"):
-        playlist_path = directories[0].parent / file_path
-        if playlist_path.is_file():
-            return FileResponse(playlist_path)
 
-    for directory in directories:
-        full_path = directory / file_path
-        if full_path.is_file():
-            return FileResponse(full_path)
+async def handle_ready(request):
+    progress = request.app.state.file_index.progress()
+    progress["scan"] = request.app.state.scan.as_dict()
+    if progress["error"] is not None:
+        return JSONResponse(progress, status_code=500)
+    return JSONResponse(progress, status_code=200 if progress["ready"] else 503)
 
-        # Try to find the file by ignoring the directory name in the URL
-        relative_path = Path(*Path(file_path).parts[1:])
-        full_path = directory / relative_path
-        if full_path.is_file():
-            return FileResponse(full_path)
 
-    return PlainTextResponse("File not found", status_code=404)
+def entry_to_json(info: dict, cluster: Optional[Cluster] = None) -> dict:
+    path = f"{info['directory'].name}/{info.get('relative_path', info['name'])}"
+    # Files owned by another node are listed with that node's absolute URL.
+    node = cluster.redirect_base(path) if cluster else None
+    return {
+        "name": info["name"],
+        "path": path,
+        "url": f"{node or ''}/{quote(path)}",
+        "size": info["size"],
+        "created_at": info["created_at"],
+        "duration": info.get("duration", "N/A"),
+        "downloading": info.get("downloading", False),
+    }
+
+
+async def handle_file_list(request):
+    """Machine-readable listing used by aggregators, revalidated via ETag."""
+    file_index = request.app.state.file_index
+    cluster = request.app.state.cluster
+    version = (
+        f"{file_index.version}.{cluster.version}" if cluster else file_index.version
+    )
+    etag = f'W/"{request.app.state.instance_id}-{version}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(
+        {
+            "ready": file_index.ready,
+            "files": [
+                entry_to_json(info, cluster) for info in file_index.sorted_entries()
+            ],
+        },
+        headers=headers,
+    )
+
+
+async def handle_search(request):
+    params = request.query_params
+    try:
+        limit = min(int(params.get("limit", 100)), 1000)
+    except ValueError:
+        return JSONResponse({"error": "limit must be an integer"}, status_code=400)
+    extensions = [e for e in params.get("ext", "").split(",") if e]
+
+    start = time.perf_counter()
+    docs = request.app.state.search_index.search(
+        params.get("q", ""),
+        prefix=params.get("mode") == "prefix",
+        extensions=extensions,
+        limit=limit,
+    )
+    took_ms = (time.perf_counter() - start) * 1000
+
+    results = [entry_to_json(doc["info"]) for doc in docs]
+    return JSONResponse(
+        {
+            "query": params.get("q", ""),
+            "count": len(results),
+            "indexed": len(request.app.state.search_index),
+            "took_ms": round(took_ms, 3),
+            "results": results,
+        }
+    )
+
+
+async def handle_cluster(request):
+    """Membership as this node sees it; probing nodes announce themselves."""
+    cluster = request.app.state.cluster
+    if cluster is None:
+        return PlainTextResponse("Not running in cluster mode", status_code=404)
+    node = request.headers.get(NODE_HEADER)
+    if node:
+        cluster.announce(node)
+    return JSONResponse(cluster.status())
+
+
+async def handle_peer_lookup(request):
+    """Which of the posted URLs and SHA-256 digests this node has finished."""
+    try:
+        body = await request.json()
+        urls = [str(url) for url in body.get("urls", [])]
+        digests = [str(digest) for digest in body.get("sha256", [])]
+    except (ValueError, AttributeError, TypeError):
+        return PlainTextResponse("Expected a JSON object", status_code=400)
+    state = request.app.state
+    return JSONResponse(await state.io.run(state.peer_index.lookup, urls, digests))
+
+
+async def handle_metrics(request):
+    return PlainTextResponse(
+        request.app.state.metrics.render(),
+        media_type="text/plain; version=0.0.4",
+    )
 
 
 class IPWhitelistMiddleware(BaseHTTPMiddleware):
+    """
+    Rejects clients outside the configured whitelist. The config file is
+    re-read in the I/O executor at most every `refresh_interval` seconds
+    instead of on every request.
+    """
+
+    def __init__(
+        self,
+        app,
+        io: IOExecutor,
+        whitelisted_ips: List[str],
+        refresh_interval: float = 30.0,
+    ):
+        super().__init__(app)
+        self.io = io
+        self.refresh_interval = refresh_interval
+        self.whitelisted_ips = whitelisted_ips
+        self.refreshed_at = time.monotonic()
+
     async def dispatch(self, request, call_next):
-        if not check_ip_whitelist(request):
+        if time.monotonic() - self.refreshed_at > self.refresh_interval:
+            self.refreshed_at = time.monotonic()
+            self.whitelisted_ips = await self.io.run(get_whitelisted_ips)
+        if not check_ip_whitelist(request, self.whitelisted_ips):
             return PlainTextResponse("Access denied", status_code=403)
         response = await call_next(request)
         return response
 
 
-def start_http_server(directories: List[Path], ip: str, port: int, playlist_path: Path):
+def create_app(
+    directories: List[Path],
+    playlist_path: Path,
+    whitelisted_ips: Optional[List[str]] = None,
+    cluster: Optional[Cluster] = None,
+    bandwidth_limits: Optional[dict] = None,
+) -> Starlette:
+    """
+    Build the file server app; the index warms up once its lifespan starts.
+    With a cluster, files owned by other nodes are redirected there.
+    `bandwidth_limits` overrides the config's limits for file streams.
+    """
     routes = [
         Route("/", handle_root_request),
         Route("/raw-playlist", handle_raw_playlist),
+        Route("/metrics", handle_metrics),
+        Route("/api/ready", handle_ready),
+        Route("/api/search", handle_search),
+        Route("/api/files", handle_file_list),
+        Route("/api/cluster", handle_cluster),
+        Route("/api/peer-lookup", handle_peer_lookup, methods=["POST"]),
+        Route("/playlist.m3u8", handle_playlist),
         Route("/{file_path:path}", handle_file_request),
     ]
 
+    metrics = ServerMetrics()
+    metrics.register_cache(
+        "file_info",
+        lambda: (get_file_info.cache_info().hits, get_file_info.cache_info().misses),
+    )
+
+    io = IOExecutor(get_config_value("server_io_workers") or DEFAULT_WORKERS)
+    stall_threshold = get_config_value("loop_stall_threshold") or 0.1
+    if whitelisted_ips is None:
+        whitelisted_ips = get_whitelisted_ips()
+
     middleware = [
-        Middleware(IPWhitelistMiddleware),
+        Middleware(IPWhitelistMiddleware, io=io, whitelisted_ips=whitelisted_ips),
+        Middleware(
+            MetricsMiddleware,
+            metrics=metrics,
+            stream_endpoints=["handle_file_request"],
+        ),
     ]
+    if bandwidth_limits is None:
+        bandwidth_limits = get_config_value("bandwidth_limits")
+    shaper = BandwidthShaper.from_config(bandwidth_limits)
+    if shaper.enabled:
+        middleware.append(Middleware(ShapingMiddleware, shaper=shaper))
+        metrics.register_collector(shaper.render_metrics)
+    else:
+        shaper = None
+    memory_cache = MemoryFileCache.from_config(get_config_value("memory_cache"))
+    if memory_cache.enabled:
+        metrics.register_cache(
+            "memory", lambda: (memory_cache.hits, memory_cache.misses)
+        )
+        metrics.register_collector(memory_cache.render_metrics)
+    else:
+        memory_cache = None
+
+    file_index = FileIndex()
+    search_index = SearchIndex()
+    file_index.subscribe(search_index.add_file_info)
+    playlist_renderer = PlaylistRenderer(
+        file_index, VIDEO_EXTENSIONS.union(IMAGE_EXTENSIONS), cluster=cluster
+    )
+    metrics.register_cache(
+        "playlist", lambda: (playlist_renderer.hits, playlist_renderer.misses)
+    )
+
+    devices = DeviceScheduler(directories)
+    metrics.register_collector(devices.render_metrics)
+
+    scan = ScanStats()
+    metrics.register_collector(scan.render_metrics)
+    if cluster is not None:
+        metrics.register_collector(cluster.render_metrics)
+        check_interval = (
+            get_config_value("cluster_check_interval") or DEFAULT_CHECK_INTERVAL
+        )
+
+    def list_directory(directory: Path):
+        _, names = next(walk(directory, scan, recursive=False))
+        return [
+            (directory / name, directory)
+            for name in names
+            if name != IGNORE_FILE and not name.endswith(SIDECAR_SUFFIXES)
+        ]
+
+    def collect_files():
+        # Roots on different disks are listed in parallel.
+        listings = [devices.submit(d, list_directory, d) for d in directories]
+        for listing in listings:
+            yield from listing.result()
+
+        # Add the retained playlists from the registry to the index
+        parent_dir = directories[0].parent
+        for playlist_file in PlaylistRegistry(parent_dir).paths():
+            if playlist_file.is_file():
+                yield playlist_file, parent_dir
+
+    media_index = MediaIndexFollower(directories)
+    index_interval = get_config_value("media_index_interval") or 2.0
+
+    async def follow_media_index():
+        # Downloads append what they created; add it without a rescan.
+        while True:
+            await asyncio.sleep(index_interval)
+            for info in await io.run(media_index.poll):
+                if file_index.add(info):
+                    logger.info(f"Indexed new download {info['name']}")
+
+    @asynccontextmanager
+    async def lifespan(app):
+        lag_monitor = asyncio.create_task(
+            metrics.monitor_loop_lag(stall_threshold=stall_threshold)
+        )
+        # Index in a worker thread so the port opens before every file is probed.
+        warm_up = asyncio.create_task(
+            asyncio.to_thread(file_index.warm_up, collect_files, get_file_info, devices)
+        )
+        index_follower = asyncio.create_task(follow_media_index())
+        membership = None
+        if cluster is not None:
+            membership = asyncio.create_task(cluster.monitor(io, check_interval))
+        mark("server ready")
+        yield
+        file_index.stop()
+        lag_monitor.cancel()
+        index_follower.cancel()
+        if membership is not None:
+            membership.cancel()
+        await asyncio.gather(warm_up, return_exceptions=True)
+        io.shutdown()
+        devices.shutdown(wait=False)
 
     app = Starlette(
         routes=routes,
         middleware=middleware,
+        lifespan=lifespan,
     )
     app.state.directories = directories
+    app.state.metrics = metrics
     app.state.playlist_file = playlist_path
+    app.state.file_index = file_index
+    app.state.search_index = search_index
+    app.state.playlist_renderer = playlist_renderer
+    app.state.checksums = ChecksumStore(directories)
+    app.state.peer_index = PeerIndex(directories, app.state.checksums, devices)
+    app.state.io = io
+    app.state.devices = devices
+    app.state.scan = scan
+    app.state.cluster = cluster
+    app.state.shaper = shaper
+    app.state.memory_cache = memory_cache
+    app.state.instance_id = f"{os.getpid():x}{int(time.time()):x}"
+    return app
 
-    # Calculate file info at startup
-    file_info = []
-    for directory in directories:
-        file_info.extend(
-            [get_file_info(f, directory) for f in directory.glob("*") if f.is_file()]
-        )
-
-    # Add all playlist files to file_info
-    parent_dir = directories[0].parent
-    for playlist_file in parent_dir.glob("playlist_*.m3u8"):
-        file_info.append(get_file_info(playlist_file, parent_dir))
 
-    file_info.sort(key=lambda x: x["created_at"], reverse=True)
-    app.state.file_info = file_info
+def start_http_server(
+    directories: List[Path],
+    ip: str,
+    port: int,
+    playlist_path: Path,
+    cluster: Optional[Cluster] = None,
+):
+    whitelisted_ips = get_whitelisted_ips()
+    app = create_app(directories, playlist_path, whitelisted_ips, cluster)
 
     logger.info(f"Serving at http://{ip}:{port}")
     logger.info(
         f"Serving files from directories: {', '.join(str(d) for d in directories)}"
     )
     logger.info(f"Playlist available at http://{ip}:{port}/{playlist_path.name}")
-    whitelisted_ips = get_whitelisted_ips()
+    logger.info(f"Per-client playlist at http://{ip}:{port}/playlist.m3u8")
+    if cluster is not None:
+        logger.info(
+            f"Cluster node {cluster.self_url}, members: "
+            f"{', '.join(sorted(cluster.members))}"
+        )
     if whitelisted_ips:
         logger.info(f"Whitelisted IPs: {', '.join(whitelisted_ips)}")
     else:
@@ -480,6 +1031,14 @@ def main(
     use_localhost: bool = typer.Option(
         False, "--localhost", help="Use localhost instead of host IP"
     ),
+    cluster_nodes: Optional[List[str]] = typer.Option(
+        None,
+        "--cluster-node",
+        help="URL of another node to shard the library with (can be repeated)",
+    ),
+    node_url: Optional[str] = typer.Option(
+        None, "--node-url", help="URL other cluster nodes reach this one at"
+    ),
 ):
     """Generate an M3U8 playlist from multiple directories and serve the files via HTTP."""
     if use_localhost:
@@ -498,8 +1057,14 @@ def main(
     typer.echo(f"Starting HTTP server at http://{ip}:{port}")
     typer.echo("Press CTRL+C to stop the server")
 
+    cluster = None
+    members = list(cluster_nodes or []) + list(get_config_value("cluster_nodes") or [])
+    if members:
+        cluster = Cluster(node_url or f"http://{ip}:{port}", members)
+        typer.echo(f"Cluster mode as {cluster.self_url}")
+
     try:
-        start_http_server(directories, ip, port, playlist_path)
+        start_http_server(directories, ip, port, playlist_path, cluster)
     except KeyboardInterrupt:
         typer.echo("Server stopped")
 
@@ -508,7 +1073,6 @@ if __name__ == "__main__":
     typer.run(main)
 
 
-def check_ip_whitelist(request):
+def check_ip_whitelist(request, whitelisted_ips: List[str]):
     client_ip = request.client.host
-    whitelisted_ips = get_whitelisted_ips()
     return not whitelisted_ips or client_ip in whitelisted_ips
@@ -0,0 +1,390 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import math
+import random
+import struct
+import tempfile
+import threading
+import time
+import typer
+import requests
+import uvicorn
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+from urllib.parse import urlsplit
+from .generate_playlist import create_app, generate_m3u8
+from ..utils.config import parse_size
+
+SCENARIOS = ("listing", "download", "range", "playlist")
+# Limits far above anything a load test reaches: shaping runs but never waits.
+NON_BINDING_LIMITS = {
+    "global_rate": "1T",
+    "client_rate": "1T",
+    "max_streams_per_client": 1_000_000,
+}
+DEFAULT_MIX = "listing=1,download=1,range=4,playlist=1"
+READ_CHUNK = 1024 * 1024
+
+
+def _box(box_type: bytes, body: bytes) -> bytes:
+    return struct.pack(">I4s", 8 + len(body), box_type) + body
+
+
+def write_synthetic_library(root: Path, files: int, file_size: int) -> Path:
+    """
+    Sparse MP4 files with a real moov/mvhd header, so indexing goes through
+    the native probe instead of ffprobe, followed by an mdat of zeros.
+    """
+    library = root / "library"
+    library.mkdir(parents=True, exist_ok=True)
+    for i in range(files):
+        mvhd = _box(
+            b"mvhd", b"\0" * 12 + struct.pack(">II", 1000, 60000 + i) + b"\0" * 80
+        )
+        header = _box(b"ftyp", b"isom\0\0\0\0") + _box(b"moov", mvhd)
+        mdat_size = max(file_size - len(header), 8)
+        with open(library / f"clip_{i:04d}.mp4", "wb") as f:
+            f.write(header + struct.pack(">I4s", mdat_size, b"mdat"))
+            f.truncate(len(header) + mdat_size)
+    return library
+
+
+def parse_limits(limits: str) -> Dict[str, str]:
+    """ "client_rate=10M,max_streams_per_client=2" -> bandwidth_limits mapping."""
+    parsed = {}
+    for part in limits.split(","):
+        key, _, value = part.partition("=")
+        if not key.strip() or not value.strip():
+            raise ValueError(f"Expected key=value in --limits, got {part!r}")
+        parsed[key.strip()] = value.strip()
+    return parsed
+
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise ValueError(f"Unknown scenario {name!r}, expected one of {SCENARIOS}")
+        weights[name] = int(weight or 1)
+    if not any(weight > 0 for weight in weights.values()):
+        raise ValueError("The mix needs at least one scenario with a positive weight")
+    return weights
+
+
+@contextmanager
+def local_server(
+    directories: List[Path], bandwidth_limits: Optional[dict] = None
+) -> Iterator[str]:
+    """Run the real app with uvicorn on a free localhost port in a thread."""
+    playlist_path = generate_m3u8(directories, "127.0.0.1", 0, True)
+    app = create_app(
+        directories,
+        playlist_path,
+        whitelisted_ips=[],
+        bandwidth_limits=bandwidth_limits,
+    )
+    server = uvicorn.Server(
+        uvicorn.Config(
+            app, host="127.0.0.1", port=0, log_level="warning", access_log=False
+        )
+    )
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("The server failed to start")
+        time.sleep(0.05)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+
+
+def wait_until_ready(base_url: str, timeout: float = 300.0) -> List[dict]:
+    """Wait for the index warm-up, then return the served media files."""
+    deadline = time.monotonic() + timeout
+    while True:
+        response = requests.get(f"{base_url}/api/ready", timeout=10)
+        if response.status_code == 200:
+            break
+        if response.status_code == 500:
+            error = response.json().get("error")
+            raise RuntimeError(f"The server failed to build its index: {error}")
+        if time.monotonic() > deadline:
+            raise RuntimeError("The server did not finish indexing in time")
+        time.sleep(0.2)
+    listing = requests.get(f"{base_url}/api/files", timeout=30).json()
+    return [f for f in listing["files"] if not f["path"].endswith(".m3u8")]
+
+
+def _request(
+    session: requests.Session,
+    base_url: str,
+    scenario: str,
+    files: List[dict],
+    range_size: int,
+    rng: random.Random,
+) -> int:
+    """Issue one request of the scenario; returns the body bytes received."""
+    headers = {}
+    expected = 200
+    if scenario == "listing":
+        url = f"{base_url}/api/files"
+    elif scenario == "playlist":
+        url = f"{base_url}/playlist.m3u8"
+    else:
+        target = rng.choice(files)
+        # Cluster nodes list files owned by other nodes with absolute URLs.
+        url = target["url"]
+        if not urlsplit(url).scheme:
+            url = f"{base_url}{url}"
+        if scenario == "range":
+            start = rng.randrange(max(target["size"] - range_size, 1))
+            headers["Range"] = f"bytes={start}-{start + range_size - 1}"
+            expected = 206
+
+    received = 0
+    with session.get(url, headers=headers, stream=True, timeout=60) as response:
+        for chunk in response.iter_content(READ_CHUNK):
+            received += len(chunk)
+        if response.status_code != expected:
+            raise RuntimeError(f"{scenario}: HTTP {response.status_code}")
+    return received
+
+
+def _client(
+    base_url: str,
+    weights: Dict[str, int],
+    files: List[dict],
+    range_size: int,
+    deadline: float,
+    seed: int,
+) -> Dict[str, dict]:
+    rng = random.Random(seed)
+    names = list(weights)
+    stats = {name: {"latencies": [], "errors": 0, "bytes": 0} for name in names}
+    with requests.Session() as session:
+        while time.monotonic() < deadline:
+            scenario = rng.choices(names, weights=[weights[n] for n in names])[0]
+            start = time.perf_counter()
+            try:
+                stats[scenario]["bytes"] += _request(
+                    session, base_url, scenario, files, range_size, rng
+                )
+            except (requests.RequestException, RuntimeError):
+                stats[scenario]["errors"] += 1
+                continue
+            stats[scenario]["latencies"].append(time.perf_counter() - start)
+    return stats
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(math.ceil(q * len(ordered)) - 1, 0)]
+
+
+def summarize(latencies: List[float], errors: int, received: int, elapsed: float):
+    requests_done = len(latencies) + errors
+    return {
+        "requests": requests_done,
+        "errors": errors,
+        "error_rate": round(errors / requests_done if requests_done else 0.0, 4),
+        "rps": round(requests_done / elapsed, 2),
+        "bytes": received,
+        "throughput_mb_s": round(received / 1024**2 / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+def drive_load(
+    base_url: str,
+    files: List[dict],
+    weights: Dict[str, int],
+    clients: int,
+    duration: float,
+    range_size: int,
+    seed: int,
+) -> dict:
+    if not files:
+        weights = {n: w for n, w in weights.items() if n in ("listing", "playlist")}
+        if not weights:
+            raise ValueError("The server lists no media files to download")
+
+    start = time.monotonic()
+    deadline = start + duration
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        futures = [
+            executor.submit(
+                _client, base_url, weights, files, range_size, deadline, seed + i
+            )
+            for i in range(clients)
+        ]
+        per_client = [future.result() for future in futures]
+    elapsed = time.monotonic() - start
+
+    scenarios = {}
+    all_latencies: List[float] = []
+    all_errors = all_bytes = 0
+    for name in weights:
+        latencies = [
+            latency for stats in per_client for latency in stats[name]["latencies"]
+        ]
+        errors = sum(stats[name]["errors"] for stats in per_client)
+        received = sum(stats[name]["bytes"] for stats in per_client)
+        scenarios[name] = summarize(latencies, errors, received, elapsed)
+        all_latencies.extend(latencies)
+        all_errors += errors
+        all_bytes += received
+
+    return {
+        "seconds": round(elapsed, 3),
+        "total": summarize(all_latencies, all_errors, all_bytes, elapsed),
+        "scenarios": scenarios,
+    }
+
+
+def shaping_overhead(unshaped: dict, shaped: dict) -> dict:
+    """Relative change of the shaped run against the unshaped one."""
+
+    def change(key: str) -> Optional[float]:
+        base = unshaped["total"][key]
+        return round((shaped["total"][key] - base) / base * 100, 2) if base else None
+
+    return {
+        "rps_change_pct": change("rps"),
+        "throughput_change_pct": change("throughput_mb_s"),
+        "p50_change_pct": change("p50_ms"),
+        "p99_change_pct": change("p99_ms"),
+    }
+
+
+def load_test(
+    url: Optional[str] = typer.Option(
+        None, "--url", help="Load a running server instead of starting one"
+    ),
+    directories: Optional[List[Path]] = typer.Option(
+        None,
+        "--directory",
+        "-d",
+        help="Serve these directories instead of a synthetic library",
+        exists=True,
+        file_okay=False,
+        resolve_path=True,
+    ),
+    clients: int = typer.Option(16, "--clients", "-c", help="Concurrent clients"),
+    duration: float = typer.Option(10.0, "--duration", "-t", help="Seconds to run"),
+    mix: str = typer.Option(
+        DEFAULT_MIX,
+        "--mix",
+        help="Scenario weights: listing, download, range, playlist",
+    ),
+    files: int = typer.Option(50, "--files", help="Files in the synthetic library"),
+    file_size: str = typer.Option("8M", "--file-size", help="Synthetic file size"),
+    range_size: str = typer.Option("1M", "--range-size", help="Bytes per Range seek"),
+    seed: int = typer.Option(0, "--seed", help="Seed for the request sequence"),
+    limits: Optional[str] = typer.Option(
+        None,
+        "--limits",
+        help="Bandwidth limits for the local server, e.g. client_rate=10M,global_rate=50M",
+    ),
+    measure_shaping: bool = typer.Option(
+        False,
+        "--measure-shaping",
+        help="Run unshaped and with non-binding limits, and report the shaping overhead",
+    ),
+    output: Optional[Path] = typer.Option(
+        None, "--output", "-o", help="Write the JSON report here instead of stdout"
+    ),
+):
+    """Measure RPS, latency and throughput of the file server under load."""
+    if url and (limits or measure_shaping):
+        typer.echo("Error: --limits and --measure-shaping need the local server")
+        raise typer.Exit(code=1)
+    try:
+        weights = parse_mix(mix)
+        bandwidth_limits = parse_limits(limits) if limits else None
+        sizes = {
+            "file_size": parse_size(file_size),
+            "range_size": parse_size(range_size),
+        }
+    except ValueError as e:
+        typer.echo(f"Error: {e}")
+        raise typer.Exit(code=1)
+    # Per-request debug logging would dominate the measurement.
+    logging.getLogger("urllib3").setLevel(logging.WARNING)
+
+    config = {
+        "clients": clients,
+        "duration": duration,
+        "mix": weights,
+        "range_size": sizes["range_size"],
+        "seed": seed,
+    }
+    if bandwidth_limits:
+        config["limits"] = bandwidth_limits
+
+    def run(server) -> dict:
+        with server as base_url:
+            served = wait_until_ready(base_url)
+            return drive_load(
+                base_url,
+                served,
+                weights,
+                clients,
+                duration,
+                sizes["range_size"],
+                seed,
+            )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if url:
+            config["target"] = url
+            report = run(nullcontext(url.rstrip("/")))
+        else:
+            if not directories:
+                directories = [
+                    write_synthetic_library(Path(tmp), files, sizes["file_size"])
+                ]
+                config["library"] = {"files": files, "file_size": sizes["file_size"]}
+            config["target"] = "in-process"
+            if measure_shaping:
+                unshaped = run(local_server(directories, bandwidth_limits={}))
+                shaped = run(local_server(directories, NON_BINDING_LIMITS))
+                report = {
+                    "unshaped": unshaped,
+                    "shaped": shaped,
+                    "shaping_overhead": shaping_overhead(unshaped, shaped),
+                }
+            else:
+                report = run(local_server(directories, bandwidth_limits))
+
+    report = {"config": config, **report}
+    content = json.dumps(report, indent=2)
+    if output:
+        output.write_text(content + "\n")
+        typer.echo(f"Report written to {output}")
+    else:
+        typer.echo(content)
@@ -12,14 +12,26 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import subprocess
+import tempfile
 import typer
 from prompt_toolkit import prompt
 from prompt_toolkit.completion import PathCompleter
 from pathlib import Path
+from ..utils.mpv_ipc import MpvSupervisor
 
 
-def mpv():
+def mpv(
+    prefetch: int = typer.Option(
+        0,
+        "--prefetch",
+        help="Stay attached over mpv's IPC socket and warm up the next N entries",
+    ),
+    prefetch_mb: int = typer.Option(
+        32, "--prefetch-mb", help="How many MB of each upcoming entry to warm up"
+    ),
+):
     """Start MPV with a specified .m3u8 file in the background."""
     playlist_path = (
         Path(
@@ -38,6 +50,10 @@ def mpv():
         typer.echo(f"Error: {playlist_path} is not a valid file.")
         raise typer.Exit(code=1)
 
+    if prefetch > 0:
+        supervise_mpv(playlist_path, prefetch, prefetch_mb * 1024 * 1024)
+        return
+
     try:
         subprocess.Popen(["mpv", str(playlist_path)], start_new_session=True)
         typer.echo(f"MPV started with playlist: {playlist_path}")
@@ -49,5 +65,42 @@ def mpv():
         raise typer.Exit(code=1)
 
 
+def supervise_mpv(playlist_path: Path, prefetch: int, head_bytes: int) -> None:
+    socket_path = Path(tempfile.gettempdir()) / f"downloader-mpv-{os.getpid()}.sock"
+    try:
+        process = subprocess.Popen(
+            ["mpv", f"--input-ipc-server={socket_path}", str(playlist_path)],
+            # CTRL+C detaches the supervisor; it must not reach mpv.
+            start_new_session=True,
+        )
+    except FileNotFoundError:
+        typer.echo("Error: MPV is not installed or not in the system PATH.")
+        raise typer.Exit(code=1)
+
+    typer.echo(f"MPV started with playlist: {playlist_path}")
+    typer.echo(f"Prefetching the next {prefetch} entries, press CTRL+C to detach.")
+    supervisor = MpvSupervisor(socket_path, prefetch, head_bytes)
+    try:
+        supervisor.connect()
+        supervisor.run()
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        typer.echo(f"Lost connection to MPV: {e}")
+    finally:
+        if process.poll() is not None and socket_path.exists():
+            socket_path.unlink()
+
+    report = supervisor.report()
+    if report["switches"]:
+        typer.echo(
+            f"Track switches: {report['switches']}, "
+            f"median {report['median_ms']:.0f} ms, "
+            f"mean {report['mean_ms']:.0f} ms, max {report['max_ms']:.0f} ms"
+        )
+    else:
+        typer.echo("No track switches were recorded.")
+
+
 if __name__ == "__main__":
     typer.run(mpv)
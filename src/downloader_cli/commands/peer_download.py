@@ -0,0 +1,161 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import subprocess
+import typer
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import IO, List, Optional
+from .admit_download import admitted_download
+from .autotune_download import tuned_download
+from .ytdlp import build_download_settings, prepare_download_command
+from ..utils.admission import parse_aria2_input, write_aria2_input
+from ..utils.config import get_config_value, get_state_dir
+from ..utils.url_expansion import UrlExpansionCache, read_url_list
+from ..utils.peer_cache import (
+    PeerCache,
+    append_journal,
+    entry_output_name,
+    record_aria2_entries,
+)
+
+FETCH_WORKERS = 4
+
+
+def ytdlp_entries(
+    playlist_file: Path, expansion_cache: Optional[UrlExpansionCache] = None
+) -> List[dict]:
+    """One entry per video of a yt-dlp URL list, playlists and channels expanded."""
+    cache = expansion_cache or UrlExpansionCache()
+    by_host = cache.expand(read_url_list(str(playlist_file)))
+    return [
+        {"url": entry["url"], "options": [], "size": None}
+        for entries in by_host.values()
+        for entry in entries
+    ]
+
+
+def fetch_from_peers(
+    entries: List[dict], download_dir: Path, cache: PeerCache, aria2c_names: bool
+) -> List[dict]:
+    """
+    Pull the entries peers have into `download_dir`; returns the rest. With
+    `aria2c_names`, files get the name aria2c would give them, otherwise the
+    name the peer's yt-dlp picked.
+    """
+    hits = cache.lookup(entries)
+    if not hits:
+        return entries
+
+    def fetch(index: int) -> bool:
+        peer, match = hits[index]
+        entry = entries[index]
+        name = entry_output_name(entry) if aria2c_names else ""
+        destination = download_dir / (name or Path(match["path"]).name)
+        if not cache.fetch(peer, match, destination):
+            return False
+        append_journal([(entry["url"], destination)])
+        typer.echo(f"From {peer}: {destination.name}")
+        return True
+
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        fetched = dict(zip(hits, executor.map(fetch, hits)))
+    total = sum(hits[i][1]["size"] for i, ok in fetched.items() if ok)
+    typer.echo(
+        f"Peers: {sum(fetched.values())} of {len(entries)} file(s) fetched over "
+        f"the LAN ({total / 1024**2:.1f} MB)"
+    )
+    return [entry for i, entry in enumerate(entries) if not fetched.get(i)]
+
+
+def peer_first_download(
+    settings: dict,
+    admission: bool = False,
+    max_wait: Optional[float] = 3600.0,
+    output: Optional[IO] = None,
+) -> int:
+    """
+    Fetch what peers already have, then download only the misses with the
+    configured downloader.
+    """
+    download_dir = Path(settings["download_dir"])
+    playlist_file = Path(settings["playlist_file"])
+    if settings["downloader"] == "aria2c" or "new_entries" in settings:
+        # aria2c lines are single files; preflight already expanded the list.
+        entries = parse_aria2_input(playlist_file)
+    else:
+        entries = ytdlp_entries(playlist_file)
+    peers = get_config_value("peer_caches") or []
+    remaining = fetch_from_peers(
+        entries, download_dir, PeerCache(peers), settings["downloader"] == "aria2c"
+    )
+    if not remaining:
+        return 0
+
+    missed_file = get_state_dir(download_dir) / "peer_missed_urls.txt"
+    write_aria2_input(missed_file, remaining)
+    settings = {**settings, "playlist_file": str(missed_file)}
+    if settings["downloader"] == "aria2c" and admission:
+        left_over, failed = admitted_download(
+            settings, max_wait=max_wait, output=output
+        )
+        returncode = 1 if left_over or failed else 0
+    elif settings.get("autotune"):
+        returncode = tuned_download(settings, output=output)
+    else:
+        cmd = prepare_download_command(settings)
+        returncode = subprocess.run(
+            cmd, shell=True, stdout=output, stderr=subprocess.STDOUT if output else None
+        ).returncode
+    # yt-dlp journals its own files; for aria2c the names are known up front.
+    if settings["downloader"] == "aria2c":
+        record_aria2_entries(download_dir, remaining)
+    return returncode
+
+
+def peer_download(
+    download_dir: Path = typer.Option(..., "--dir", help="Download directory"),
+    input_file: Path = typer.Option(..., "--input", "-i", help="URL list"),
+    downloader: str = typer.Option(
+        "yt-dlp", "--downloader", help="yt-dlp or aria2c for the misses"
+    ),
+    options: Optional[str] = typer.Option(
+        None, "--options", help="Downloader options (default: from the config)"
+    ),
+    shorten_names: bool = typer.Option(
+        False, "--shorten-names", help="Number yt-dlp files instead of using titles"
+    ),
+    admission: bool = typer.Option(
+        False, "--admission", help="Admit aria2c downloads by free disk space"
+    ),
+    autotune: bool = typer.Option(
+        False, "--autotune", help="Tune aria2c connections per host"
+    ),
+):
+    """Fetch finished copies from LAN peers, then download only what they lack."""
+    try:
+        settings = build_download_settings(
+            str(download_dir),
+            str(input_file),
+            downloader=downloader,
+            options=options,
+            shorten_names=shorten_names,
+            autotune=autotune,
+        )
+    except ValueError as e:
+        typer.echo(f"Error: {e}")
+        raise typer.Exit(code=1)
+    returncode = peer_first_download(settings, admission=admission)
+    if returncode != 0:
+        raise typer.Exit(code=returncode)
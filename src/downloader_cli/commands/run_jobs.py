@@ -0,0 +1,318 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import subprocess
+import time
+import typer
+import yaml
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from .admit_download import admitted_download
+from .append_playlist import append_new_downloads
+from .autotune_download import tuned_download
+from .peer_download import peer_first_download
+from .generate_playlist import generate_m3u8
+from .ytdlp import build_download_settings, prepare_download_command, run_preflight
+from ..utils.config import get_config_value, get_state_dir, parse_size
+from ..utils.network import get_host_ip
+
+JOB_TYPES = ("download", "playlist")
+REQUIRED_KEYS = {"download": ("path",), "playlist": ("directories",)}
+
+
+def directory_size(path: Path) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.stat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def job_errors(job: Dict[str, Any]) -> List[str]:
+    """What is wrong with one job's definition, empty if it can run."""
+    if job.get("type") not in JOB_TYPES:
+        return [f"type must be one of {JOB_TYPES}"]
+    errors = [
+        f"missing required key '{key}'"
+        for key in REQUIRED_KEYS[job["type"]]
+        if not job.get(key)
+    ]
+    if job["type"] == "playlist" and not isinstance(job.get("directories", []), list):
+        errors.append("directories must be a list")
+    if not isinstance(job["depends_on"], list):
+        errors.append("depends_on must be a list")
+    return errors
+
+
+def load_jobs(jobs_file: Path) -> Dict[str, Any]:
+    with open(jobs_file, "r") as f:
+        manifest = yaml.safe_load(f) or {}
+    if not isinstance(manifest, dict):
+        raise ValueError(f"{jobs_file}: expected a mapping with a 'jobs' list")
+
+    jobs = manifest.get("jobs") or []
+    if not isinstance(jobs, list):
+        raise ValueError(f"{jobs_file}: 'jobs' must be a list")
+    names = set()
+    errors = []
+    for index, job in enumerate(jobs):
+        if not isinstance(job, dict):
+            errors.append(f"Job #{index + 1}: expected a mapping, got {job!r}")
+            continue
+        job.setdefault("name", f"job_{index + 1}")
+        depends_on = job.get("depends_on") or []
+        job["depends_on"] = [depends_on] if isinstance(depends_on, str) else depends_on
+        errors.extend(f"Job {job['name']}: {error}" for error in job_errors(job))
+        if job["name"] in names:
+            errors.append(f"Duplicate job name: {job['name']}")
+        names.add(job["name"])
+    # Report every bad job at once rather than one per run.
+    if errors:
+        raise ValueError("invalid jobs\n  " + "\n  ".join(errors))
+
+    by_name = {job["name"]: job for job in jobs}
+    for job in jobs:
+        for dependency in job["depends_on"]:
+            if dependency not in by_name:
+                raise ValueError(f"Job {job['name']} depends on unknown {dependency}")
+
+    # Reject cycles up front, otherwise the scheduler would wait forever.
+    visiting, done = set(), set()
+
+    def visit(name: str) -> None:
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"Dependency cycle involving job {name}")
+        visiting.add(name)
+        for dependency in by_name[name]["depends_on"]:
+            visit(dependency)
+        visiting.discard(name)
+        done.add(name)
+
+    for name in by_name:
+        visit(name)
+
+    manifest["jobs"] = jobs
+    return manifest
+
+
+def run_download_job(job: Dict[str, Any], rate_limit: Optional[int]) -> Dict[str, Any]:
+    download_dir = Path(job["path"]).expanduser().resolve()
+    download_dir.mkdir(parents=True, exist_ok=True)
+    playlist_file = job.get("playlist_file") or get_config_value("playlist_file")
+    if not playlist_file or not os.path.exists(os.path.expanduser(playlist_file)):
+        raise ValueError(f"Job {job['name']}: playlist_file not found")
+
+    settings = build_download_settings(
+        str(download_dir),
+        os.path.expanduser(playlist_file),
+        downloader=job.get("downloader", "yt-dlp"),
+        options=job.get("options"),
+        shorten_names=job.get("shorten_names", False),
+        rate_limit=rate_limit,
+        preflight=job.get("preflight", False),
+        autotune=job.get("autotune", False),
+    )
+    if settings.get("preflight"):
+        settings = run_preflight(settings)
+        if not settings["new_entries"]:
+            return {"bytes": 0}
+    cmd = prepare_download_command(settings)
+
+    size_before = directory_size(download_dir)
+    started = time.time()
+    log_path = get_state_dir(download_dir) / f"job-{job['name']}.log"
+    with open(log_path, "ab") as log:
+        if job.get("peer_cache"):
+            returncode = peer_first_download(
+                settings,
+                admission=job.get("admission", False),
+                max_wait=job.get("max_wait", 3600.0),
+                output=log,
+            )
+        elif settings["downloader"] == "aria2c" and job.get("admission"):
+            left_over, failed = admitted_download(
+                settings, max_wait=job.get("max_wait", 3600.0), output=log
+            )
+            returncode = 1 if left_over or failed else 0
+        elif settings.get("autotune"):
+            returncode = tuned_download(settings, output=log)
+        else:
+            returncode = subprocess.run(
+                cmd, shell=True, stdout=log, stderr=subprocess.STDOUT
+            ).returncode
+    downloaded = max(directory_size(download_dir) - size_before, 0)
+    # Files that finished before a failure are still worth listing.
+    appended = []
+    if job.get("append_playlist", get_config_value("append_to_playlist")):
+        appended = append_new_downloads(download_dir, since=started)
+
+    if returncode != 0:
+        raise RuntimeError(
+            f"{settings['downloader']} exited with {returncode}, see {log_path}"
+        )
+    return {"bytes": downloaded, "appended": len(appended)}
+
+
+def run_playlist_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    directories = [Path(d).expanduser().resolve() for d in job["directories"]]
+    for directory in directories:
+        if not directory.is_dir():
+            raise ValueError(f"Job {job['name']}: {directory} is not a directory")
+    use_localhost = job.get("localhost", False)
+    ip = job.get("ip") or ("localhost" if use_localhost else get_host_ip())
+    playlist_path = generate_m3u8(directories, ip, job.get("port", 8000), use_localhost)
+    return {"playlist": str(playlist_path)}
+
+
+def execute_job(job: Dict[str, Any], rate_limit: Optional[int]) -> Dict[str, Any]:
+    start = time.monotonic()
+    try:
+        if job["type"] == "download":
+            result = run_download_job(job, rate_limit)
+        else:
+            result = run_playlist_job(job)
+        result["status"] = "ok"
+    except (OSError, ValueError, RuntimeError, KeyError, TypeError) as e:
+        result = {"status": "failed", "error": f"{type(e).__name__}: {e}"}
+    result["seconds"] = time.monotonic() - start
+    return result
+
+
+def schedule_jobs(
+    jobs: List[Dict[str, Any]], concurrency: int, bandwidth: Optional[int]
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Run jobs as their dependencies succeed. With a `bandwidth` budget,
+    downloads starting together split what the running ones do not hold, and
+    a finished download's share goes to the next ones, so a download running
+    alone gets it all. A download waits while less than budget/concurrency is
+    free, since a running download's rate cannot be lowered.
+    """
+    pending = {job["name"]: job for job in jobs}
+    results: Dict[str, Dict[str, Any]] = {}
+    running = {}
+    # Rate each running download was started with; their total stays in budget.
+    allocated: Dict[Any, int] = {}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while pending or running:
+            ready = []
+            for name, job in list(pending.items()):
+                states = [results.get(d, {}).get("status") for d in job["depends_on"]]
+                if any(state in ("failed", "skipped") for state in states):
+                    results[name] = {"status": "skipped", "seconds": 0.0}
+                    del pending[name]
+                    typer.echo(f"[{name}] skipped, a dependency did not succeed")
+                elif all(state == "ok" for state in states) and (
+                    len(running) + len(ready) < concurrency
+                ):
+                    ready.append(job)
+
+            share = None
+            downloads = [job for job in ready if job["type"] == "download"]
+            if bandwidth and downloads:
+                free = bandwidth - sum(allocated.values())
+                fit = min(len(downloads), free // max(bandwidth // concurrency, 1))
+                for job in downloads[fit:]:
+                    ready.remove(job)
+                share = free // fit if fit else None
+            for job in ready:
+                del pending[job["name"]]
+                rate_limit = share if job["type"] == "download" else None
+                typer.echo(
+                    f"[{job['name']}] started"
+                    + (f" at {rate_limit} B/s" if rate_limit else "")
+                )
+                future = executor.submit(execute_job, job, rate_limit)
+                running[future] = job["name"]
+                if rate_limit:
+                    allocated[future] = rate_limit
+
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                allocated.pop(future, None)
+                results[name] = future.result()
+                status = results[name]["status"]
+                detail = results[name].get("error", "")
+                typer.echo(f"[{name}] {status} {detail}".rstrip())
+
+    return results
+
+
+def print_summary(jobs: List[Dict[str, Any]], results: Dict[str, Any], wall: float):
+    typer.echo("\nSummary:")
+    total_bytes = 0
+    for job in jobs:
+        result = results[job["name"]]
+        line = f"  {job['name']:<20} {job['type']:<9} {result['status']:<8} {result['seconds']:8.1f}s"
+        if "bytes" in result:
+            total_bytes += result["bytes"]
+            rate = result["bytes"] / result["seconds"] if result["seconds"] else 0
+            line += (
+                f"  {result['bytes'] / 1024**2:10.1f} MB  {rate / 1024**2:7.2f} MB/s"
+            )
+            if result.get("appended"):
+                line += f"  +{result['appended']} in playlist"
+        elif "playlist" in result:
+            line += f"  {result['playlist']}"
+        typer.echo(line)
+    typer.echo(
+        f"Total: {total_bytes / 1024**2:.1f} MB in {wall:.1f}s "
+        f"({total_bytes / 1024**2 / wall if wall else 0:.2f} MB/s)"
+    )
+
+
+def run_jobs(
+    jobs_file: Path = typer.Argument(..., help="YAML file describing the jobs"),
+    concurrency: Optional[int] = typer.Option(
+        None, "--concurrency", "-c", help="Jobs running at once (overrides the file)"
+    ),
+    bandwidth: Optional[str] = typer.Option(
+        None,
+        "--bandwidth",
+        "-b",
+        help="Total download rate shared by all jobs, e.g. 20M (overrides the file)",
+    ),
+):
+    """Run download and playlist jobs from a YAML manifest without prompts."""
+    try:
+        manifest = load_jobs(jobs_file)
+        concurrency = max(int(concurrency or manifest.get("concurrency", 1)), 1)
+        bandwidth = bandwidth or manifest.get("bandwidth")
+        budget = parse_size(bandwidth) if bandwidth else None
+    except (OSError, ValueError, yaml.YAMLError) as e:
+        typer.echo(f"Error: {e}")
+        raise typer.Exit(code=1)
+
+    jobs = manifest["jobs"]
+    typer.echo(
+        f"Running {len(jobs)} job(s), concurrency {concurrency}"
+        + (f", {budget} B/s shared" if budget else "")
+    )
+    start = time.monotonic()
+    results = schedule_jobs(jobs, concurrency, budget)
+    print_summary(jobs, results, time.monotonic() - start)
+
+    if any(result["status"] != "ok" for result in results.values()):
+        raise typer.Exit(code=1)
@@ -5,31 +5,33 @@ from fastapi.staticfiles import StaticFiles
 import uvicorn
 from prompt_toolkit import prompt
 from prompt_toolkit.completion import PathCompleter
+from ..utils.ignore_rules import walk
 from ..utils.network import get_host_ip
+from ..utils.playlist_registry import PlaylistRegistry
 from datetime import datetime
 
 app = FastAPI()
 
 
+def find_videos(directory: Path):
+    for dirpath, filenames in walk(directory):
+        for name in filenames:
+            if name.endswith(".mp4"):
+                yield dirpath / name
+
+
 def generate_playlist(directory: Path, ip: str, port: int) -> Path:
     playlist_content = "#EXTM3U\n"
-    for file in directory.glob("**/*.mp4"):
+    for file in find_videos(directory):
         relative_path = file.relative_to(directory)
         url = f"http://{ip}:{port}/videos/{relative_path}"
         playlist_content += f"#EXTINF:-1,{file.name}\n{url}\n"
 
-    # Generate the playlist filename
     date_str = datetime.now().strftime("%d-%m-%Y")
-    index = 1
-    while True:
-        playlist_filename = f"{ip}_{date_str}_{index}.m3u8"
-        playlist_path = directory / playlist_filename
-        if not playlist_path.exists():
-            break
-        index += 1
-
-    playlist_path.write_text(playlist_content)
-    return playlist_path
+    registry = PlaylistRegistry(directory)
+    return registry.register(
+        playlist_content, [directory], f"http://{ip}:{port}", prefix=f"{ip}_{date_str}"
+    )
 
 
 def serve_watch_playlist():
@@ -58,7 +60,7 @@ def serve_watch_playlist():
 
     @app.get("/")
     async def read_root(request: Request):
-        video_files = [f for f in directory.glob("**/*.mp4")]
+        video_files = list(find_videos(directory))
         video_list = "\n".join(
             [
                 f'<li><a href="/videos/{f.relative_to(directory)}">{f.name}</a></li>'
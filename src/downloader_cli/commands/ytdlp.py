@@ -12,8 +12,21 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import shlex
 import subprocess
-from ..utils.config import get_config_value
+import time
+from pathlib import Path
+from typing import Optional
+from ..utils.config import get_config_value, get_state_dir
+from ..utils.peer_cache import ytdlp_journal_option
+from ..utils.playlist_registry import atomic_write_text
+from ..utils.url_expansion import (
+    UrlExpansionCache,
+    filter_new_entries,
+    read_download_archive,
+    read_url_list,
+)
+from ..utils.profiling import stage
 import typer
 
 
@@ -63,6 +76,12 @@ def get_download_settings(download_dir: str, playlist_file: str) -> dict:
             settings["aria2c_settings"] = aria2c_config
         else:
             settings["aria2c_settings"] = typer.prompt("Enter custom aria2c settings")
+        settings["admission"] = typer.confirm(
+            "Do you want to check file sizes against free disk space before downloading?"
+        )
+        settings["autotune"] = typer.confirm(
+            "Do you want to tune connections per host from measured throughput?"
+        )
     else:
         ytdlp_config = get_config_value("ytdlp")
         if typer.confirm(
@@ -76,11 +95,86 @@ def get_download_settings(download_dir: str, playlist_file: str) -> dict:
         settings["shorten_names"] = typer.confirm(
             "Do you want to implement name shortening?"
         )
+        settings["preflight"] = typer.confirm(
+            "Do you want to expand playlist/channel URLs first and skip entries that were already downloaded?"
+        )
+
+    if get_config_value("peer_caches"):
+        settings["peer_cache"] = typer.confirm(
+            "Do you want to fetch files that LAN peers already have from them first?"
+        )
 
     return settings
 
 
+def build_download_settings(
+    download_dir: str,
+    playlist_file: str,
+    downloader: str = "yt-dlp",
+    options: Optional[str] = None,
+    shorten_names: bool = False,
+    rate_limit: Optional[int] = None,
+    preflight: bool = False,
+    autotune: bool = False,
+) -> dict:
+    """Non-interactive counterpart of get_download_settings."""
+    if downloader not in ("yt-dlp", "aria2c"):
+        raise ValueError(f"Unknown downloader: {downloader}")
+    settings = {
+        "download_dir": download_dir,
+        "downloader": downloader,
+        "aria2c_settings": "",
+        "ytdlp_settings": "",
+        "playlist_file": playlist_file,
+        "rate_limit": rate_limit,
+    }
+    if downloader == "aria2c":
+        settings["aria2c_settings"] = (
+            options if options is not None else get_config_value("aria2c")
+        )
+        settings["autotune"] = autotune
+    else:
+        settings["ytdlp_settings"] = (
+            options if options is not None else get_config_value("ytdlp")
+        )
+        settings["shorten_names"] = shorten_names
+        settings["preflight"] = preflight
+    return settings
+
+
+def run_preflight(
+    settings: dict, expansion_cache: Optional[UrlExpansionCache] = None
+) -> dict:
+    """
+    Expand the URL list once (cached), group it by host and keep only entries
+    missing from the download archive. Returns settings pointing yt-dlp at the
+    filtered list.
+    """
+    state_dir = get_state_dir(Path(settings["download_dir"]))
+    archive_path = state_dir / "download_archive.txt"
+    cache = expansion_cache or UrlExpansionCache()
+
+    by_host = cache.expand(read_url_list(settings["playlist_file"]))
+    archive = read_download_archive(archive_path)
+    urls = []
+    for host, entries in by_host.items():
+        new_entries = filter_new_entries(entries, archive)
+        print(f"{host}: {len(new_entries)} new of {len(entries)} entries")
+        urls.extend(entry["url"] for entry in new_entries)
+    print(f"Expansion cache: {cache.hits} hits, {cache.misses} misses")
+
+    filtered_file = state_dir / "preflight_urls.txt"
+    atomic_write_text(filtered_file, "".join(f"{url}\n" for url in urls))
+    return {
+        **settings,
+        "playlist_file": str(filtered_file),
+        "ytdlp_settings": f'{settings["ytdlp_settings"]} --download-archive "{archive_path}"',
+        "new_entries": len(urls),
+    }
+
+
 def prepare_download_command(settings: dict) -> str:
+    rate_limit = settings.get("rate_limit")
     if settings["downloader"] == "yt-dlp":
         output_template = (
             "%(autonumber)s.%(ext)s"
@@ -88,11 +182,62 @@ def prepare_download_command(settings: dict) -> str:
             else "%(title)s.%(ext)s"
         )
         cmd = f"yt-dlp {settings['ytdlp_settings']} -a \"{settings['playlist_file']}\" --output \"{settings['download_dir']}/{output_template}\""
+        # Lets LAN peers find what this machine already downloaded.
+        cmd += f" {ytdlp_journal_option()}"
+        if rate_limit:
+            cmd += f" --limit-rate {rate_limit}"
     else:
         cmd = f"aria2c --dir=\"{settings['download_dir']}\" -i \"{settings['playlist_file']}\" {settings['aria2c_settings']}"
+        if rate_limit:
+            cmd += f" --max-overall-download-limit={rate_limit}"
     return cmd
 
 
+def prepare_admission_command(settings: dict) -> str:
+    """Run the aria2c list through `downloader admit-download` inside tmux."""
+    return (
+        f"downloader admit-download --dir {shlex.quote(settings['download_dir'])}"
+        f" --input {shlex.quote(settings['playlist_file'])}"
+        f" --options {shlex.quote(settings['aria2c_settings'])}"
+        + (" --autotune" if settings.get("autotune") else "")
+    )
+
+
+def prepare_autotune_command(settings: dict) -> str:
+    """Run the aria2c list through `downloader autotune-download` inside tmux."""
+    return (
+        f"downloader autotune-download --dir {shlex.quote(settings['download_dir'])}"
+        f" --input {shlex.quote(settings['playlist_file'])}"
+        f" --options {shlex.quote(settings['aria2c_settings'])}"
+    )
+
+
+def prepare_peer_command(settings: dict) -> str:
+    """Run the download through `downloader peer-download` inside tmux."""
+    options = (
+        settings["aria2c_settings"]
+        if settings["downloader"] == "aria2c"
+        else settings["ytdlp_settings"]
+    )
+    return (
+        f"downloader peer-download --dir {shlex.quote(settings['download_dir'])}"
+        f" --input {shlex.quote(settings['playlist_file'])}"
+        f" --downloader {settings['downloader']}"
+        f" --options {shlex.quote(options)}"
+        + (" --shorten-names" if settings.get("shorten_names") else "")
+        + (" --admission" if settings.get("admission") else "")
+        + (" --autotune" if settings.get("autotune") else "")
+    )
+
+
+def prepare_append_command(settings: dict, since: float) -> str:
+    """Add what the download created to the playlist once it exits."""
+    return (
+        f"downloader append-playlist --dir {shlex.quote(settings['download_dir'])}"
+        f" --since {int(since)}"
+    )
+
+
 def start_tmux_session(cmd: str) -> None:
     session_name = "download_session"
     subprocess.run(["tmux", "new-session", "-d", "-s", session_name, "bash"])
@@ -122,9 +267,27 @@ def main(download_dir: str, playlist_file: str) -> None:
         typer.echo("tmux is not installed. Please install tmux and try again.")
         raise typer.Exit(code=1)
 
-    settings = get_download_settings(download_dir, playlist_file)
-    cmd = prepare_download_command(settings)
-    start_tmux_session(cmd)
+    with stage("download settings"):
+        settings = get_download_settings(download_dir, playlist_file)
+    if settings.get("preflight"):
+        with stage("preflight"):
+            settings = run_preflight(settings)
+        if not settings["new_entries"]:
+            print("Nothing new to download.")
+            return
+    with stage("prepare command"):
+        if settings.get("peer_cache"):
+            cmd = prepare_peer_command(settings)
+        elif settings.get("admission"):
+            cmd = prepare_admission_command(settings)
+        elif settings.get("autotune"):
+            cmd = prepare_autotune_command(settings)
+        else:
+            cmd = prepare_download_command(settings)
+        if get_config_value("append_to_playlist"):
+            cmd += f"; {prepare_append_command(settings, time.time())}"
+    with stage("tmux start"):
+        start_tmux_session(cmd)
 
 
 if __name__ == "__main__":
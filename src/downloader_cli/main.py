@@ -14,6 +14,8 @@
 
 import typer
 from typing import Optional
+import os
+import re
 from pathlib import Path
 from datetime import datetime
 from rich.traceback import install as install_rich_traceback
@@ -21,10 +23,20 @@ from prompt_toolkit import prompt
 from prompt_toolkit.completion import PathCompleter
 from .commands import ytdlp
 from .utils.config import get_playlist_file
+from .utils.profiling import enable_profiling, finish_profiling
 from .commands.generate_playlist import main as generate_playlist_main
 from .commands.podman_run import podman_run
 from .commands.mpv import mpv
 from .commands.serve_watch_playlist import serve_watch_playlist
+from .commands.benchmark import benchmark_probe
+from .commands.aggregate_playlist import aggregate_playlist
+from .commands.run_jobs import run_jobs
+from .commands.checksum import checksum
+from .commands.admit_download import admit_download
+from .commands.load_test import load_test
+from .commands.autotune_download import autotune_download
+from .commands.peer_download import peer_download
+from .commands.append_playlist import append_playlist
 from typing import List
 
 install_rich_traceback()
@@ -32,6 +44,30 @@ install_rich_traceback()
 app = typer.Typer()
 
 
+@app.callback()
+def main_callback(
+    ctx: typer.Context,
+    profile: Optional[Path] = typer.Option(
+        None,
+        "--profile",
+        help="Write cProfile output and per-stage timings to this file",
+    ),
+):
+    if profile is None:
+        return
+    enable_profiling(profile.expanduser().resolve())
+
+    def write_profile():
+        profiler = finish_profiling()
+        if profiler is not None:
+            typer.echo(
+                f"Profile written to {profiler.output} "
+                f"(raw stats in {profiler.stats_path})"
+            )
+
+    ctx.call_on_close(write_profile)
+
+
 def path_callback(value: Optional[str] = None) -> Path:
     if value is None:
         value = prompt("Enter the download directory: ", completer=PathCompleter())
@@ -52,6 +88,26 @@ def version():
     typer.echo(get_config_value("version"))
 
 
+def create_session_dir(path: Path, prefix: str) -> Path:
+    """
+    Create `<prefix>_<N>` after the highest existing N, with a single scan.
+    A concurrent run that takes the same name makes us try the next one.
+    """
+    pattern = re.compile(rf"^{re.escape(prefix)}_(\d+)$")
+    index = max(
+        (int(m.group(1)) for m in map(pattern.match, os.listdir(path)) if m),
+        default=0,
+    )
+    while True:
+        index += 1
+        new_path = path / f"{prefix}_{index}"
+        try:
+            new_path.mkdir(exist_ok=False)
+            return new_path
+        except FileExistsError:
+            continue
+
+
 @app.command()
 def download(
     path: Optional[Path] = typer.Option(
@@ -70,15 +126,8 @@ def download(
 ):
     """Start the download process."""
     if create_new_dir:
-        index = 1
-        while True:
-            new_dir_name = f"downloads_{datetime.now().strftime('%d_%m_%Y')}_{index}"
-            new_path = path / new_dir_name
-            if not new_path.exists():
-                new_path.mkdir()
-                path = new_path
-                break
-            index += 1
+        prefix = f"downloads_{datetime.now().strftime('%d_%m_%Y')}"
+        path = create_session_dir(path, prefix)
 
     typer.echo(f"Download directory: {path}")
 
@@ -102,6 +151,14 @@ def generate_playlist(
     use_localhost: bool = typer.Option(
         False, "--localhost", help="Use localhost instead of host IP"
     ),
+    cluster_nodes: Optional[List[str]] = typer.Option(
+        None,
+        "--cluster-node",
+        help="URL of another node to shard the library with (can be repeated)",
+    ),
+    node_url: Optional[str] = typer.Option(
+        None, "--node-url", help="URL other cluster nodes reach this one at"
+    ),
 ):
     """Generate an M3U8 playlist from multiple directories and serve the files via HTTP."""
     if directories is None:
@@ -112,7 +169,9 @@ def generate_playlist(
             typer.echo(f"Error: {directory} is not a valid directory.")
             raise typer.Exit(code=1)
 
-    generate_playlist_main(directories, ip, port, use_localhost)
+    generate_playlist_main(
+        directories, ip, port, use_localhost, cluster_nodes, node_url
+    )
 
 
 def get_directory() -> Path:
@@ -131,6 +190,15 @@ def serve_and_watch():
 
 app.command()(podman_run)
 app.command()(mpv)
+app.command()(benchmark_probe)
+app.command()(aggregate_playlist)
+app.command("run")(run_jobs)
+app.command()(checksum)
+app.command()(admit_download)
+app.command()(load_test)
+app.command()(autotune_download)
+app.command()(peer_download)
+app.command()(append_playlist)
 
 if __name__ == "__main__":
     app()
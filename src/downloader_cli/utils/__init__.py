@@ -14,3 +14,25 @@
 
 from . import config  # noqa: F401
 from . import network  # noqa: F401
+from . import playlist_registry  # noqa: F401
+from . import media_probe  # noqa: F401
+from . import profiling  # noqa: F401
+from . import metrics  # noqa: F401
+from . import file_index  # noqa: F401
+from . import search_index  # noqa: F401
+from . import federation  # noqa: F401
+from . import mpv_ipc  # noqa: F401
+from . import checksums  # noqa: F401
+from . import url_expansion  # noqa: F401
+from . import admission  # noqa: F401
+from . import playlist_render  # noqa: F401
+from . import io_executor  # noqa: F401
+from . import device_io  # noqa: F401
+from . import aria2_tuning  # noqa: F401
+from . import partial_downloads  # noqa: F401
+from . import ignore_rules  # noqa: F401
+from . import cluster  # noqa: F401
+from . import peer_cache  # noqa: F401
+from . import bandwidth  # noqa: F401
+from . import memory_cache  # noqa: F401
+from . import media_index  # noqa: F401
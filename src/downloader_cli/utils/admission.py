@@ -0,0 +1,147 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import requests
+
+from .federation import create_session
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RESERVE = 1024**3
+DEFAULT_UNKNOWN_SIZE = 1024**3
+
+Entry = Dict[str, Any]
+
+
+def parse_aria2_input(path: Path) -> List[Entry]:
+    """
+    Read an aria2c input file. Indented lines are options of the URI above
+    them and travel with it.
+    """
+    entries: List[Entry] = []
+    with open(path, "r") as f:
+        for line in f:
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+            if line[0].isspace() and entries:
+                entries[-1]["options"].append(line.rstrip("\n"))
+            else:
+                entries.append({"url": line.strip(), "options": [], "size": None})
+    return entries
+
+
+def write_aria2_input(path: Path, entries: List[Entry]) -> None:
+    with open(path, "w") as f:
+        for entry in entries:
+            f.write(f"{entry['url']}\n")
+            for option in entry["options"]:
+                f.write(f"{option}\n")
+
+
+def _head_size(session: requests.Session, url: str, timeout: float) -> Optional[int]:
+    # aria2c input lines may list mirrors separated by tabs; any one will do.
+    url = url.split("\t")[0]
+    try:
+        response = session.head(url, allow_redirects=True, timeout=timeout)
+    except requests.RequestException as e:
+        logger.warning(f"HEAD {url} failed: {e}")
+        return None
+    length = response.headers.get("Content-Length")
+    if response.status_code >= 400 or length is None or not length.isdigit():
+        return None
+    return int(length)
+
+
+def fetch_sizes(
+    entries: List[Entry],
+    session: Optional[requests.Session] = None,
+    workers: int = 8,
+    timeout: float = 15.0,
+) -> None:
+    """Fill entry["size"] from concurrent HEAD requests over one pooled session."""
+    session = session or create_session(workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        sizes = executor.map(
+            lambda entry: _head_size(session, entry["url"], timeout), entries
+        )
+        for entry, size in zip(entries, sizes):
+            entry["size"] = size
+
+
+def admit(
+    entries: List[Entry], free_bytes: int, unknown_size: int
+) -> Tuple[List[Entry], List[Entry]]:
+    """
+    Admit entries in order while they fit. aria2c preallocates every file of a
+    batch up front, so each admitted entry costs its full size immediately.
+    """
+    admitted = []
+    budget = free_bytes
+    for position, entry in enumerate(entries):
+        size = entry["size"] if entry["size"] is not None else unknown_size
+        if size > budget:
+            return admitted, entries[position:]
+        budget -= size
+        admitted.append(entry)
+    return admitted, []
+
+
+def run_with_admission(
+    entries: List[Entry],
+    target_dir: Path,
+    run_batch: Callable[[List[Entry]], int],
+    reserve: int = DEFAULT_RESERVE,
+    unknown_size: int = DEFAULT_UNKNOWN_SIZE,
+    poll_interval: float = 60.0,
+    max_wait: Optional[float] = None,
+    free_space: Callable[[Path], int] = lambda path: shutil.disk_usage(path).free,
+) -> Tuple[List[Entry], List[Entry]]:
+    """
+    Download in waves: admit what fits, run it, then recheck free space for the
+    deferred rest. Returns the entries that never fit within `max_wait` and
+    those of batches that exited with an error.
+    """
+    pending = entries
+    failed: List[Entry] = []
+    waited = 0.0
+    while pending:
+        free_bytes = free_space(target_dir) - reserve
+        admitted, deferred = admit(pending, free_bytes, unknown_size)
+        if not admitted:
+            if max_wait is not None and waited >= max_wait:
+                break
+            logger.info(
+                f"{len(pending)} download(s) deferred, "
+                f"{max(free_bytes, 0) / 1024**3:.2f} GB usable, "
+                f"next needs {(pending[0]['size'] or unknown_size) / 1024**3:.2f} GB"
+            )
+            time.sleep(poll_interval)
+            waited += poll_interval
+            continue
+
+        waited = 0.0
+        logger.info(f"Admitted {len(admitted)} download(s), {len(deferred)} deferred")
+        returncode = run_batch(admitted)
+        if returncode != 0:
+            logger.warning(f"Download batch exited with {returncode}")
+            failed.extend(admitted)
+        pending = deferred
+    return pending, failed
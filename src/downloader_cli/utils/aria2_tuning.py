@@ -0,0 +1,356 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import fcntl
+import json
+import logging
+import os
+import re
+import secrets
+import shlex
+import socket
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO, Any, Dict, Iterator, List, Optional
+from urllib.parse import urlsplit
+
+import requests
+
+from .config import CONFIG_DIR
+from .playlist_registry import atomic_write_text
+
+logger = logging.getLogger(__name__)
+
+TUNING_FILE = os.path.join(CONFIG_DIR, "aria2c_tuning.json")
+MIN_CONNECTIONS = 1
+MAX_CONNECTIONS = 16  # aria2c's upper bound for max-connection-per-server
+ERROR_RATE_LIMIT = 0.2
+IMPROVEMENT = 1.05
+REPROBE_RUNS = 5
+TUNED_OPTIONS = ("split", "max-connection-per-server")
+# aria2c exit codes that point at an overloaded or throttling host: timeout,
+# network problem, unexpected HTTP response (429 and friends), 503.
+THROTTLE_ERRORS = {"2", "6", "22", "29"}
+
+Entry = Dict[str, Any]
+
+
+def entry_host(url: str) -> str:
+    # aria2c input lines may list mirrors separated by tabs; tune for the first.
+    return urlsplit(url.split("\t")[0]).netloc.lower()
+
+
+def parse_connections(options: str) -> int:
+    """max-connection-per-server from an aria2c option string, 1 if unset."""
+    match = re.search(r"(?:-x\s*|--max-connection-per-server[=\s])(\d+)", options)
+    return int(match.group(1)) if match else 1
+
+
+class HostTuning:
+    """
+    Learned connection counts per host, persisted between runs.
+
+    Each run is one step of a hill climb over 1, 2, 4, 8 and 16 connections
+    around the best measured setting. Neighbours that were not faster are
+    remembered and skipped until the host is re-probed, and a host that
+    starts failing requests is backed off right away.
+
+    Measurements are recorded under `locked`, so concurrent downloads do not
+    overwrite each other's.
+    """
+
+    def __init__(self, path: str = TUNING_FILE):
+        self.path = Path(path)
+        self.lock_path = self.path.with_name(self.path.name + ".lock")
+        self.hosts: Dict[str, Dict[str, Any]] = self._load()
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        """Hold the file lock, work on its current content and save it."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self.hosts = self._load()
+                yield
+                self.save()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def save(self) -> None:
+        # Callers hold the lock from loading the file until this write.
+        atomic_write_text(self.path, json.dumps(self.hosts, indent=2))
+
+    def connections_for(self, host: str) -> Optional[int]:
+        state = self.hosts.get(host)
+        return state["connections"] if state else None
+
+    def apply(self, entries: List[Entry]) -> List[Entry]:
+        """Per-URI options for hosts with learned settings; explicit ones win."""
+        tuned = []
+        for entry in entries:
+            connections = self.connections_for(entry_host(entry["url"]))
+            explicit = {o.strip().split("=")[0] for o in entry["options"]}
+            options = list(entry["options"])
+            if connections is not None:
+                options.extend(
+                    f"  {name}={connections}"
+                    for name in TUNED_OPTIONS
+                    if name not in explicit
+                )
+            tuned.append({**entry, "options": options})
+        return tuned
+
+    def record(
+        self, host: str, connections: int, throughput: float, error_rate: float
+    ) -> int:
+        """Feed one run's measurement back; returns the connections to try next."""
+        state = self.hosts.setdefault(
+            host,
+            {
+                "connections": connections,
+                "direction": 1,
+                "best": None,
+                "worse": [],
+                "ceiling": MAX_CONNECTIONS + 1,
+                "runs_at_best": 0,
+            },
+        )
+        best = state["best"]
+        if error_rate > ERROR_RATE_LIMIT:
+            # Throttled or refused: back off and search below this setting.
+            state.update(
+                direction=-1, best=None, worse=[], ceiling=connections, runs_at_best=0
+            )
+            next_connections = max(connections // 2, MIN_CONNECTIONS)
+        else:
+            if best is None or throughput > best["throughput"] * IMPROVEMENT:
+                if best is not None:
+                    state["direction"] = 1 if connections > best["connections"] else -1
+                state["best"] = {"connections": connections, "throughput": throughput}
+                state["worse"] = [best["connections"]] if best else []
+                state["runs_at_best"] = 0
+            elif connections == best["connections"]:
+                # Follow changing conditions on the host we settled on.
+                best["throughput"] = throughput
+                state["runs_at_best"] += 1
+            else:
+                state["worse"].append(connections)
+            next_connections = self._next(state)
+
+        state.update(
+            {
+                "connections": next_connections,
+                "last": {
+                    "connections": connections,
+                    "throughput": throughput,
+                    "error_rate": error_rate,
+                },
+                "updated_at": time.time(),
+            }
+        )
+        return next_connections
+
+    @staticmethod
+    def _next(state: Dict[str, Any]) -> int:
+        base = state["best"]["connections"]
+        for direction in (state["direction"], -state["direction"]):
+            candidate = base * 2 if direction > 0 else base // 2
+            if (
+                MIN_CONNECTIONS <= candidate <= MAX_CONNECTIONS
+                and candidate < state["ceiling"]
+                and candidate not in state["worse"]
+            ):
+                return candidate
+        # Settled. Re-probe the neighbours now and then, hosts change.
+        if state["runs_at_best"] >= REPROBE_RUNS:
+            state.update(worse=[], ceiling=MAX_CONNECTIONS + 1, runs_at_best=0)
+        return base
+
+
+class Aria2Rpc:
+    def __init__(self, port: int, secret: str, timeout: float = 10.0):
+        self.url = f"http://127.0.0.1:{port}/jsonrpc"
+        self.secret = secret
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def call(self, method: str, *params: Any) -> Any:
+        payload = {
+            "jsonrpc": "2.0",
+            "id": "downloader",
+            "method": f"aria2.{method}",
+            "params": [f"token:{self.secret}", *params],
+        }
+        response = self.session.post(self.url, json=payload, timeout=self.timeout)
+        body = response.json()
+        if "error" in body:
+            raise RuntimeError(f"aria2 RPC {method}: {body['error'].get('message')}")
+        return body["result"]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _default_conf() -> Optional[Path]:
+    """The configuration file aria2c reads when not given --conf-path."""
+    xdg = os.environ.get("XDG_CONFIG_HOME") or os.path.expanduser("~/.config")
+    for path in (
+        Path(xdg) / "aria2" / "aria2.conf",
+        Path.home() / ".aria2" / "aria2.conf",
+    ):
+        if path.is_file():
+            return path
+    return None
+
+
+def write_rpc_conf(port: int, secret: str) -> Path:
+    """
+    A private (0600) aria2c configuration with RPC enabled on `port`, so the
+    secret is not on the command line for `ps` to show. The user's own
+    configuration is copied in first, since --conf-path replaces it.
+    """
+    default = _default_conf()
+    base = default.read_text() if default is not None else ""
+    fd, name = tempfile.mkstemp(prefix="downloader-aria2-", suffix=".conf")
+    with os.fdopen(fd, "w") as f:
+        f.write(
+            f"{base}\nenable-rpc=true\nrpc-listen-port={port}\nrpc-secret={secret}\n"
+        )
+    return Path(name)
+
+
+def _download_host(status: Dict[str, Any]) -> Optional[str]:
+    for file in status.get("files", []):
+        for uri in file.get("uris", []):
+            return entry_host(uri["uri"])
+    return None
+
+
+def run_measured(
+    command: str,
+    default_connections: int,
+    tuning: HostTuning,
+    output: Optional[IO] = None,
+    poll_interval: float = 2.0,
+    startup_timeout: float = 30.0,
+) -> int:
+    """
+    Run an aria2c command with RPC enabled, sample per-host progress while it
+    runs and feed the per-host throughput and error rate into `tuning`.
+    """
+    port, secret = _free_port(), secrets.token_hex(16)
+    conf = write_rpc_conf(port, secret)
+    try:
+        process = subprocess.Popen(
+            f"{command} --conf-path={shlex.quote(str(conf))}",
+            shell=True,
+            stdout=output,
+            stderr=subprocess.STDOUT if output else None,
+        )
+        return _measure(
+            process,
+            port,
+            secret,
+            default_connections,
+            tuning,
+            poll_interval,
+            startup_timeout,
+        )
+    finally:
+        conf.unlink(missing_ok=True)
+
+
+def _measure(
+    process: subprocess.Popen,
+    port: int,
+    secret: str,
+    default_connections: int,
+    tuning: HostTuning,
+    poll_interval: float,
+    startup_timeout: float,
+) -> int:
+    rpc = Aria2Rpc(port, secret)
+    keys = ["gid", "status", "errorCode", "completedLength", "files"]
+    active_seconds: Dict[str, float] = {}
+    started = time.monotonic()
+
+    try:
+        while process.poll() is None:
+            time.sleep(poll_interval)
+            try:
+                active = rpc.call("tellActive", ["gid", "files"])
+                stats = rpc.call("getGlobalStat")
+            except (requests.RequestException, ValueError):
+                if time.monotonic() - started > startup_timeout:
+                    logger.warning("aria2c RPC did not come up, not tuning this run")
+                    return process.wait()
+                continue
+            for host in {_download_host(status) for status in active}:
+                if host:
+                    active_seconds[host] = active_seconds.get(host, 0.0) + poll_interval
+            if int(stats["numActive"]) == 0 and int(stats["numWaiting"]) == 0:
+                break
+
+        if process.poll() is not None:
+            return process.returncode
+        stopped = rpc.call("tellStopped", 0, int(stats["numStoppedTotal"]), keys)
+        rpc.call("shutdown")
+        process.wait()
+    except (requests.RequestException, RuntimeError, ValueError) as e:
+        logger.warning(f"Lost aria2c RPC connection: {e}")
+        return process.wait()
+
+    per_host: Dict[str, Dict[str, int]] = {}
+    for status in stopped:
+        host = _download_host(status)
+        if not host:
+            continue
+        counts = per_host.setdefault(
+            host, {"bytes": 0, "done": 0, "errors": 0, "throttled": 0}
+        )
+        counts["bytes"] += int(status["completedLength"])
+        counts["done"] += 1
+        if status["status"] == "error":
+            counts["errors"] += 1
+            # A missing file says nothing about the connection count.
+            if status["errorCode"] in THROTTLE_ERRORS:
+                counts["throttled"] += 1
+
+    with tuning.locked():
+        for host, counts in per_host.items():
+            connections = tuning.connections_for(host) or default_connections
+            active = max(active_seconds.get(host, 0.0), poll_interval)
+            throughput = counts["bytes"] / active
+            error_rate = counts["throttled"] / counts["done"]
+            next_connections = tuning.record(host, connections, throughput, error_rate)
+            logger.info(
+                f"{host}: {throughput / 1024**2:.2f} MB/s with {connections} "
+                f"connections, {error_rate:.0%} errors, next run uses "
+                f"{next_connections}"
+            )
+    return 1 if any(counts["errors"] for counts in per_host.values()) else 0
@@ -0,0 +1,223 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import time
+from typing import Any, Dict, List, Optional
+
+from .config import parse_size
+
+# Like the metrics, all state here is touched from the event loop thread only.
+
+DEFAULT_BURST = 4 * 1024**2
+DEFAULT_PRIORITY_BYTES = 4 * 1024**2
+# Key in the ASGI scope under which a file response carries its ticket.
+TICKET_KEY = "downloader.stream_ticket"
+
+
+class TokenBucket:
+    """
+    `rate` bytes per second with up to `burst` bytes saved up. Consumers take
+    their bytes right away and sleep off any debt, so waiting streams are
+    served in the order they asked.
+    """
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, amount: int) -> float:
+        """Take `amount` bytes; returns the seconds to wait before sending them."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= amount
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def full(self, now: float) -> bool:
+        """Whether it has refilled to the burst, debt included, by `now`."""
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+class StreamTicket:
+    __slots__ = ("client", "priority_left")
+
+    def __init__(self, client: str, priority_left: int):
+        self.client = client
+        self.priority_left = priority_left
+
+
+class ClientState:
+    __slots__ = ("bucket", "streams")
+
+    def __init__(self, bucket: Optional[TokenBucket]):
+        self.bucket = bucket
+        self.streams = 0
+
+
+class BandwidthShaper:
+    """
+    Token buckets for the whole server and for each client IP, plus a cap on
+    concurrent file streams per client.
+
+    The first `priority_bytes` of a Range response (a player seeking) are
+    charged to the global bucket without waiting for it. Bulk transfers then
+    pay that debt, so seeks stay responsive while the uplink is saturated.
+    Each client's own bucket still applies to everything it receives.
+    """
+
+    def __init__(
+        self,
+        global_rate: int = 0,
+        client_rate: int = 0,
+        burst: int = DEFAULT_BURST,
+        max_streams_per_client: int = 0,
+        priority_bytes: int = DEFAULT_PRIORITY_BYTES,
+    ):
+        self.client_rate = client_rate
+        self.burst = burst
+        self.max_streams_per_client = max_streams_per_client
+        self.priority_bytes = priority_bytes
+        self.global_bucket = TokenBucket(global_rate, burst) if global_rate else None
+        self.clients: Dict[str, ClientState] = {}
+        # Idle clients are dropped once their bucket is full; checked this often.
+        self.sweep_interval = burst / client_rate if client_rate else 0.0
+        self._next_sweep = 0.0
+        self.delayed_seconds = 0.0
+        self.rejected = 0
+
+    @classmethod
+    def from_config(cls, limits: Optional[Dict[str, Any]]) -> "BandwidthShaper":
+        """Read a `bandwidth_limits` mapping; sizes accept K/M/G suffixes."""
+        limits = limits or {}
+
+        def size(key: str, default: int) -> int:
+            value = limits.get(key)
+            return parse_size(value) if value not in (None, "") else default
+
+        return cls(
+            global_rate=size("global_rate", 0),
+            client_rate=size("client_rate", 0),
+            burst=size("burst", DEFAULT_BURST),
+            max_streams_per_client=int(limits.get("max_streams_per_client") or 0),
+            priority_bytes=size("priority_bytes", DEFAULT_PRIORITY_BYTES),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(
+            self.global_bucket or self.client_rate or self.max_streams_per_client
+        )
+
+    def open_stream(self, client: str, ranged: bool) -> Optional[StreamTicket]:
+        """A ticket for one file response, None if the client is at its cap."""
+        now = time.monotonic()
+        if now >= self._next_sweep:
+            self._evict_idle(now)
+            self._next_sweep = now + self.sweep_interval
+        state = self.clients.get(client)
+        if state is None:
+            bucket = (
+                TokenBucket(self.client_rate, self.burst) if self.client_rate else None
+            )
+            state = self.clients[client] = ClientState(bucket)
+        if self.max_streams_per_client and state.streams >= self.max_streams_per_client:
+            self.rejected += 1
+            return None
+        state.streams += 1
+        return StreamTicket(client, self.priority_bytes if ranged else 0)
+
+    def close_stream(self, ticket: StreamTicket) -> None:
+        state = self.clients.get(ticket.client)
+        if state is None:
+            return
+        state.streams -= 1
+        if state.streams <= 0 and state.bucket is None:
+            del self.clients[ticket.client]
+
+    def _evict_idle(self, now: float) -> None:
+        """
+        Forget clients without streams whose bucket has refilled to the burst:
+        a new bucket would start out the same. Until then the bucket is kept,
+        so closing and reopening streams does not buy a fresh burst.
+        """
+        idle = [
+            client
+            for client, state in self.clients.items()
+            if state.streams <= 0 and (state.bucket is None or state.bucket.full(now))
+        ]
+        for client in idle:
+            del self.clients[client]
+
+    async def throttle(self, ticket: StreamTicket, nbytes: int) -> None:
+        wait = 0.0
+        state = self.clients.get(ticket.client)
+        if state is not None and state.bucket is not None:
+            wait = state.bucket.take(nbytes)
+        if self.global_bucket is not None:
+            global_wait = self.global_bucket.take(nbytes)
+            if ticket.priority_left > 0:
+                ticket.priority_left -= nbytes
+            else:
+                wait = max(wait, global_wait)
+        if wait > 0:
+            self.delayed_seconds += wait
+            await asyncio.sleep(wait)
+
+    def render_metrics(self) -> List[str]:
+        return [
+            "# TYPE downloader_shaping_delay_seconds_total counter",
+            f"downloader_shaping_delay_seconds_total {self.delayed_seconds}",
+            "# TYPE downloader_shaping_rejected_streams_total counter",
+            f"downloader_shaping_rejected_streams_total {self.rejected}",
+            "# TYPE downloader_shaping_clients gauge",
+            f"downloader_shaping_clients {len(self.clients)}",
+        ]
+
+
+class ShapingMiddleware:
+    """
+    Pure ASGI middleware that paces the body of every response holding a
+    stream ticket and gives the ticket back when the response is done.
+    """
+
+    def __init__(self, app, shaper: BandwidthShaper):
+        self.app = app
+        self.shaper = shaper
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        shaper = self.shaper
+
+        async def send_wrapper(message):
+            ticket = scope.get(TICKET_KEY)
+            if ticket is not None and message["type"] == "http.response.body":
+                body = message.get("body", b"")
+                if body:
+                    await shaper.throttle(ticket, len(body))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            ticket = scope.get(TICKET_KEY)
+            if ticket is not None:
+                shaper.close_stream(ticket)
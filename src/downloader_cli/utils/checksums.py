@@ -0,0 +1,238 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+
+from .config import get_state_dir
+from .device_io import DeviceScheduler
+from .ignore_rules import ScanStats, walk
+from .playlist_registry import atomic_write_text
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "checksums.json"
+CHUNK_SIZE = 16 * 1024 * 1024
+SAVE_INTERVAL = 30.0
+
+
+def hash_file(path: Path) -> str:
+    """SHA-256 of a file, fed to hashlib in large slices of a memory map."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return digest.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mmap, "MADV_SEQUENTIAL"):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            view = memoryview(mapped)
+            try:
+                # hashlib drops the GIL for large buffers, so worker threads
+                # hash different files in parallel.
+                for offset in range(0, size, CHUNK_SIZE):
+                    digest.update(view[offset : offset + CHUNK_SIZE])
+            finally:
+                view.release()
+    return digest.hexdigest()
+
+
+class ChecksumManifest:
+    """
+    Sidecar manifest of content hashes for the files under `root`.
+
+    Entries are keyed by relative path and remember the size and mtime they
+    were computed for, so a changed file is re-hashed and an interrupted run
+    resumes where it stopped.
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        # Created by the first save; a missing manifest reads as empty.
+        self.path = get_state_dir(self.root, create=False) / MANIFEST_NAME
+        self.entries: Dict[str, Dict] = {}
+        self.loaded_mtime = 0.0
+        self._lock = threading.Lock()
+        self._by_digest: Optional[Dict[str, str]] = None
+        self.load()
+
+    def load(self) -> None:
+        self._by_digest = None
+        try:
+            self.loaded_mtime = self.path.stat().st_mtime
+            with open(self.path, "r") as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            self.entries = {}
+        except (OSError, ValueError):
+            logger.warning(f"Ignoring unreadable checksum manifest {self.path}")
+            self.entries = {}
+
+    def save(self) -> None:
+        with self._lock:
+            content = json.dumps(self.entries, separators=(",", ":"))
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write_text(self.path, content)
+        self.loaded_mtime = self.path.stat().st_mtime
+
+    def lookup(self, relative_path: str, stat: os.stat_result) -> Optional[str]:
+        entry = self.entries.get(relative_path)
+        if (
+            entry
+            and entry["size"] == stat.st_size
+            and entry["mtime_ns"] == stat.st_mtime_ns
+        ):
+            return entry["sha256"]
+        return None
+
+    def find(self, digest: str) -> Optional[Path]:
+        """A file under the root whose current content has this hash."""
+        by_digest = self._by_digest
+        if by_digest is None:
+            with self._lock:
+                by_digest = {e["sha256"]: rel for rel, e in self.entries.items()}
+            self._by_digest = by_digest
+        relative_path = by_digest.get(digest)
+        if relative_path is None:
+            return None
+        path = self.root / relative_path
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+        return path if self.lookup(relative_path, stat) == digest else None
+
+    def is_current(self, path: Path) -> bool:
+        stat = path.stat()
+        return self.lookup(path.relative_to(self.root).as_posix(), stat) is not None
+
+    def record(self, path: Path, stat: os.stat_result, digest: str) -> None:
+        with self._lock:
+            self.entries[path.relative_to(self.root).as_posix()] = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "sha256": digest,
+            }
+            self._by_digest = None
+
+    def build(
+        self,
+        files: Iterable[Path],
+        workers: int = 4,
+        on_progress: Optional[Callable[[Path, int, int], None]] = None,
+        scheduler: Optional[DeviceScheduler] = None,
+    ) -> int:
+        """
+        Hash every file that is missing or stale; returns the number hashed.
+        With a device scheduler the files are read through their disk's queue
+        instead of a pool of `workers` threads.
+        """
+        todo: List[Path] = [path for path in files if not self.is_current(path)]
+        if not todo:
+            return 0
+
+        def work(path: Path):
+            stat = path.stat()
+            digest = hash_file(path)
+            # Skip the result if the file changed while it was being read.
+            if path.stat().st_mtime_ns != stat.st_mtime_ns:
+                return None
+            self.record(path, stat, digest)
+            return path
+
+        hashed = 0
+        last_save = time.monotonic()
+        executor = None if scheduler else ThreadPoolExecutor(max_workers=workers)
+        try:
+            futures = [
+                (
+                    executor.submit(work, path)
+                    if executor
+                    else scheduler.submit(path, work, path, nbytes=path.stat().st_size)
+                )
+                for path in todo
+            ]
+            for done, future in enumerate(as_completed(futures), start=1):
+                try:
+                    path = future.result()
+                except OSError as e:
+                    logger.warning(f"Could not hash file: {e}")
+                    continue
+                if path is not None:
+                    hashed += 1
+                    if on_progress:
+                        on_progress(path, done, len(todo))
+                if time.monotonic() - last_save > SAVE_INTERVAL:
+                    self.save()
+                    last_save = time.monotonic()
+        finally:
+            if executor:
+                executor.shutdown()
+        self.save()
+        return hashed
+
+
+class ChecksumStore:
+    """Read side used by the server: one manifest per served root."""
+
+    def __init__(self, roots: List[Path], reload_interval: float = 10.0):
+        self.manifests = [ChecksumManifest(root) for root in roots]
+        self.reload_interval = reload_interval
+        self._checked_at = time.monotonic()
+
+    def _maybe_reload(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+        for manifest in self.manifests:
+            try:
+                if manifest.path.stat().st_mtime != manifest.loaded_mtime:
+                    manifest.load()
+            except FileNotFoundError:
+                pass
+
+    def lookup(self, path: Path, stat: os.stat_result) -> Optional[str]:
+        self._maybe_reload()
+        for manifest in self.manifests:
+            if path.is_relative_to(manifest.root):
+                relative_path = path.relative_to(manifest.root).as_posix()
+                return manifest.lookup(relative_path, stat)
+        return None
+
+    def find(self, digest: str) -> Optional[Path]:
+        self._maybe_reload()
+        for manifest in self.manifests:
+            path = manifest.find(digest)
+            if path is not None:
+                return path
+        return None
+
+
+def iter_media_files(
+    root: Path, extensions: Iterable[str], stats: Optional[ScanStats] = None
+) -> Iterable[Path]:
+    extensions = tuple(extensions)
+    for dirpath, filenames in walk(root, stats):
+        for name in filenames:
+            if name.lower().endswith(extensions):
+                yield dirpath / name
@@ -0,0 +1,188 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import bisect
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+import requests
+
+from .federation import create_session
+from .io_executor import IOExecutor
+
+logger = logging.getLogger(__name__)
+
+CLUSTER_PATH = "/api/cluster"
+NODE_HEADER = "X-Downloader-Node"
+# Added to redirect targets; a node receiving it serves the file whatever its
+# own view of the ring, so nodes that briefly disagree cannot bounce clients.
+REDIRECTED_PARAM = "cluster_redirect"
+DEFAULT_VNODES = 64
+DEFAULT_CHECK_INTERVAL = 5.0
+
+
+def normalize_node(url: str) -> str:
+    return url.strip().rstrip("/")
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest())
+
+
+class HashRing:
+    """
+    Consistent hash ring with virtual nodes. When a node joins or leaves, only
+    the keys on its own arcs change owner, about 1/N of the library.
+    """
+
+    def __init__(self, nodes: Iterable[str], vnodes: int = DEFAULT_VNODES):
+        points = sorted(
+            (_hash(f"{node}#{replica}"), node)
+            for node in set(nodes)
+            for replica in range(vnodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def owner(self, key: str) -> Optional[str]:
+        if not self._nodes:
+            return None
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._nodes[index]
+
+
+class Cluster:
+    """
+    Membership of the serving nodes and the ring that assigns files to them.
+
+    Every node probes the others' /api/cluster endpoint, adopts members they
+    know about and announces itself with a header, so a new node only needs
+    one existing member to join. Only nodes that answered the last probe are
+    on the ring.
+    """
+
+    def __init__(
+        self,
+        self_url: str,
+        members: Iterable[str],
+        vnodes: int = DEFAULT_VNODES,
+        timeout: float = 2.0,
+        session: Optional[requests.Session] = None,
+    ):
+        self.self_url = normalize_node(self_url)
+        self.vnodes = vnodes
+        self.timeout = timeout
+        self.members: Set[str] = {self.self_url}
+        self.members.update(normalize_node(member) for member in members)
+        self.alive: Set[str] = {self.self_url}
+        self.ring = HashRing(self.alive, vnodes)
+        self.version = 0
+        self.redirects = 0
+        self.session = session or create_session(8)
+        # Seed URLs that turned out to be another spelling of a known node.
+        self._aliases: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def owner(self, key: str) -> str:
+        return self.ring.owner(key) or self.self_url
+
+    def redirect_base(self, key: str) -> Optional[str]:
+        """The owning node's URL if another node serves `key`, else None."""
+        owner = self.owner(key)
+        return None if owner == self.self_url else owner
+
+    def announce(self, node: str) -> None:
+        """Record a node that contacted us; it goes on the ring once probed."""
+        node = normalize_node(node)
+        with self._lock:
+            if node not in self._aliases:
+                self.members.add(node)
+
+    def _probe(self, node: str) -> Optional[Dict[str, Any]]:
+        try:
+            response = self.session.get(
+                f"{node}{CLUSTER_PATH}",
+                headers={NODE_HEADER: self.self_url},
+                timeout=self.timeout,
+            )
+            if response.status_code == 200:
+                return response.json()
+            logger.debug(f"Cluster member {node} answered {response.status_code}")
+        except (requests.RequestException, ValueError) as e:
+            logger.debug(f"Cluster member {node} is unreachable: {e}")
+        return None
+
+    def check(self) -> bool:
+        """Probe the other members once; True if the ring changed."""
+        with self._lock:
+            peers = sorted(self.members - {self.self_url})
+        if not peers:
+            return False
+        with ThreadPoolExecutor(max_workers=min(len(peers), 16)) as executor:
+            answers = list(executor.map(self._probe, peers))
+
+        alive = {self.self_url}
+        learned: Set[str] = set()
+        with self._lock:
+            for peer, answer in zip(peers, answers):
+                if answer is None:
+                    continue
+                node = normalize_node(answer.get("node") or peer)
+                if node != peer:
+                    self.members.discard(peer)
+                    self._aliases.add(peer)
+                alive.add(node)
+                learned.update(normalize_node(m) for m in answer.get("members", []))
+            self.members.update(learned - self._aliases)
+            self.members.update(alive)
+            if alive == self.alive:
+                return False
+            joined, left = alive - self.alive, self.alive - alive
+            self.alive = alive
+            self.ring = HashRing(alive, self.vnodes)
+            self.version += 1
+        logger.info(
+            f"Cluster now has {len(alive)} nodes"
+            + (f", joined: {', '.join(sorted(joined))}" if joined else "")
+            + (f", left: {', '.join(sorted(left))}" if left else "")
+        )
+        return True
+
+    async def monitor(
+        self, io: IOExecutor, interval: float = DEFAULT_CHECK_INTERVAL
+    ) -> None:
+        while True:
+            await io.run(self.check)
+            await asyncio.sleep(interval)
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "node": self.self_url,
+                "members": sorted(self.members),
+                "alive": sorted(self.alive),
+                "version": self.version,
+            }
+
+    def render_metrics(self) -> List[str]:
+        return [
+            "# TYPE downloader_cluster_nodes gauge",
+            f"downloader_cluster_nodes {len(self.alive)}",
+            "# TYPE downloader_cluster_redirects_total counter",
+            f"downloader_cluster_redirects_total {self.redirects}",
+        ]
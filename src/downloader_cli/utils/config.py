@@ -13,7 +13,9 @@
 # limitations under the License.
 
 import os
+import re
 import yaml
+from pathlib import Path
 from typing import Dict, Any
 import toml
 from prompt_toolkit import prompt
@@ -21,6 +23,8 @@ from prompt_toolkit.completion import PathCompleter
 
 CONFIG_DIR = os.path.expanduser("~/.config/downloader_cli")
 CONFIG_FILE = os.path.join(CONFIG_DIR, "config.yml")
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+STATE_DIR_NAME = ".downloader_cli"
 
 
 def load_config() -> Dict[str, Any]:
@@ -42,6 +46,27 @@ def create_default_config() -> Dict[str, Any]:
         "playlist_file": "",
         "version": get_version_from_pyproject(),
         "ip_whitelist": ["193.86.152.148"],  # Add this line
+        "playlist_retention": {"max_count": 20, "max_age_days": 30},
+        "expansion_cache_ttl": 21600,
+        "disk_reserve": "1G",
+        "unknown_size_estimate": "1G",
+        "server_io_workers": 8,
+        "loop_stall_threshold": 0.1,
+        "device_io_workers": 2,
+        "ignore_patterns": [".git/", ".Trash-*/", "@eaDir/"],
+        "cluster_nodes": [],
+        "cluster_check_interval": 5,
+        "peer_caches": [],
+        "bandwidth_limits": {
+            "global_rate": 0,
+            "client_rate": 0,
+            "burst": "4M",
+            "max_streams_per_client": 0,
+            "priority_bytes": "4M",
+        },
+        "memory_cache": {"max_bytes": 0, "max_file_size": "4M"},
+        "append_to_playlist": True,
+        "media_index_interval": 2,
     }
 
     os.makedirs(CONFIG_DIR, exist_ok=True)
@@ -91,3 +116,22 @@ def update_config(key: str, value: Any) -> None:
     config[key] = value
     with open(CONFIG_FILE, "w") as f:
         yaml.dump(config, f)
+
+
+def get_state_dir(root: Path, create: bool = True) -> Path:
+    """
+    Directory next to the served media where manifests and indexes are kept.
+    Readers pass `create=False` so serving a root never writes to it.
+    """
+    state_dir = Path(root) / STATE_DIR_NAME
+    if create:
+        state_dir.mkdir(parents=True, exist_ok=True)
+    return state_dir
+
+
+def parse_size(value: Any) -> int:
+    """Parse sizes such as 500K, 10M or 1.5G into bytes."""
+    match = re.fullmatch(r"\s*([\d.]+)\s*([KMGT]?)i?B?\s*", str(value), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Invalid size: {value}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
@@ -0,0 +1,170 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, TypeVar
+
+from .config import get_config_value
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+DEFAULT_PER_DEVICE = 2
+
+
+class DeviceQueue:
+    """Bounded worker pool and throughput counters for one block device."""
+
+    def __init__(self, device: int, workers: int):
+        self.device = device
+        self.workers = workers
+        self.roots: List[Path] = []
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix=f"dev-{device:x}"
+        )
+        self.queued = 0
+        self.active = 0
+        self.operations = 0
+        self.errors = 0
+        self.bytes = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def submit(
+        self, fn: Callable[..., T], *args: Any, nbytes: int = 0, **kwargs: Any
+    ) -> "Future[T]":
+        with self._lock:
+            self.queued += 1
+
+        def timed() -> T:
+            with self._lock:
+                self.queued -= 1
+                self.active += 1
+            start = time.perf_counter()
+            failed = False
+            try:
+                return fn(*args, **kwargs)
+            except BaseException:
+                failed = True
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    self.active -= 1
+                    self.operations += 1
+                    self.busy_seconds += elapsed
+                    if failed:
+                        self.errors += 1
+                    else:
+                        self.bytes += nbytes
+
+        return self.executor.submit(timed)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            busy = self.busy_seconds
+            return {
+                "device": f"{os.major(self.device)}:{os.minor(self.device)}",
+                "roots": [str(root) for root in self.roots],
+                "workers": self.workers,
+                "queued": self.queued,
+                "active": self.active,
+                "operations": self.operations,
+                "errors": self.errors,
+                "bytes": self.bytes,
+                "busy_seconds": round(busy, 3),
+                # Per busy worker-second: what one worker gets out of the disk.
+                "throughput_mb_s": (
+                    round(self.bytes / 1024**2 / busy, 2) if busy else 0.0
+                ),
+            }
+
+
+class DeviceScheduler:
+    """
+    Routes filesystem work to one queue per physical device (`st_dev`).
+
+    Roots on the same disk share a queue, so a spinning disk sees at most
+    `per_device` concurrent scans, probes or reads, while roots on other disks
+    are worked on in parallel.
+    """
+
+    def __init__(self, roots: Iterable[Path], per_device: Optional[int] = None):
+        if per_device is None:
+            per_device = get_config_value("device_io_workers") or DEFAULT_PER_DEVICE
+        self.per_device = max(int(per_device), 1)
+        self.queues: Dict[int, DeviceQueue] = {}
+        self._roots: List[tuple] = []
+        self._lock = threading.Lock()
+        for root in roots:
+            root = Path(root)
+            queue = self._queue(os.stat(root).st_dev)
+            queue.roots.append(root)
+            self._roots.append((root, queue))
+        # Most specific root first, for nested roots on different mounts.
+        self._roots.sort(key=lambda item: len(item[0].parts), reverse=True)
+
+    def _queue(self, device: int) -> DeviceQueue:
+        with self._lock:
+            queue = self.queues.get(device)
+            if queue is None:
+                queue = self.queues[device] = DeviceQueue(device, self.per_device)
+            return queue
+
+    def queue_for(self, path: Path) -> DeviceQueue:
+        path = Path(path)
+        for root, queue in self._roots:
+            if path.is_relative_to(root):
+                return queue
+        try:
+            return self._queue(os.stat(path).st_dev)
+        except OSError:
+            return self._queue(os.stat(path.parent).st_dev)
+
+    def submit(
+        self, path: Path, fn: Callable[..., T], *args: Any, nbytes: int = 0, **kwargs
+    ) -> "Future[T]":
+        """Run `fn` on the queue of the device that holds `path`."""
+        return self.queue_for(path).submit(fn, *args, nbytes=nbytes, **kwargs)
+
+    async def run(self, path: Path, fn: Callable[..., T], *args: Any, **kwargs) -> T:
+        return await asyncio.wrap_future(self.submit(path, fn, *args, **kwargs))
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [queue.stats() for queue in self.queues.values()]
+
+    def render_metrics(self) -> List[str]:
+        all_stats = self.stats()
+        lines = []
+        for name, key, kind in (
+            ("downloader_device_operations_total", "operations", "counter"),
+            ("downloader_device_bytes_total", "bytes", "counter"),
+            ("downloader_device_busy_seconds_total", "busy_seconds", "counter"),
+            ("downloader_device_queued", "queued", "gauge"),
+        ):
+            lines.append(f"# TYPE {name} {kind}")
+            for stats in all_stats:
+                lines.append(f'{name}{{device="{stats["device"]}"}} {stats[key]}')
+        return lines
+
+    def shutdown(self, wait: bool = True) -> None:
+        for queue in self.queues.values():
+            queue.executor.shutdown(wait=wait, cancel_futures=not wait)
@@ -0,0 +1,167 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+LISTING_PATH = "/api/files"
+
+
+def create_session(pool_size: int) -> requests.Session:
+    """Session whose connection pool keeps one keep-alive connection per peer."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class PeerListing:
+    __slots__ = ("url", "etag", "fetched_at", "files", "error")
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.etag: Optional[str] = None
+        self.fetched_at = 0.0
+        self.files: List[Dict[str, Any]] = []
+        self.error: Optional[str] = None
+
+
+class PeerListingCache:
+    """
+    Listings of several downloader-cli servers, refreshed concurrently.
+
+    A listing younger than `ttl` is used as is. Older ones are revalidated with
+    If-None-Match, so an unchanged peer answers with an empty 304. If a peer is
+    unreachable, its last good listing is kept.
+    """
+
+    def __init__(
+        self,
+        peers: List[str],
+        ttl: float = 60.0,
+        timeout: float = 10.0,
+        session: Optional[requests.Session] = None,
+    ):
+        self.peers = [PeerListing(url) for url in peers]
+        self.ttl = ttl
+        self.timeout = timeout
+        self.session = session or create_session(max(len(peers), 1))
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._merged_generation = -1
+        self._merged: List[Dict[str, Any]] = []
+
+    @staticmethod
+    def _parse_listing(peer: PeerListing, listing: Any) -> List[Dict[str, Any]]:
+        files = []
+        for entry in listing.get("files", []):
+            # The peers' own playlists are not media and would nest playlists.
+            if entry["name"].endswith(".m3u8"):
+                continue
+            # Entries point back at the peer that actually has the file.
+            entry["url"] = urljoin(f"{peer.url}/", entry["url"])
+            entry["origin"] = peer.url
+            files.append(entry)
+        return files
+
+    def _fetch(self, peer: PeerListing) -> bool:
+        headers = {"If-None-Match": peer.etag} if peer.etag else {}
+        try:
+            response = self.session.get(
+                f"{peer.url}{LISTING_PATH}", headers=headers, timeout=self.timeout
+            )
+        except requests.RequestException as e:
+            # Counts as an attempt, so a dead peer is retried once per TTL.
+            peer.fetched_at = time.monotonic()
+            peer.error = str(e)
+            logger.warning(f"Failed to fetch listing from {peer.url}: {e}")
+            return False
+
+        peer.fetched_at = time.monotonic()
+        if response.status_code == 304:
+            peer.error = None
+            return False
+        if response.status_code != 200:
+            peer.error = f"HTTP {response.status_code}"
+            logger.warning(f"Peer {peer.url} answered {response.status_code}")
+            return False
+
+        try:
+            files = self._parse_listing(peer, response.json())
+        except (ValueError, AttributeError, KeyError, TypeError) as e:
+            # Not a downloader-cli listing; keep the last good one.
+            peer.error = f"Invalid listing: {e}"
+            logger.warning(f"Peer {peer.url} sent an invalid listing: {e}")
+            return False
+        peer.files = files
+        peer.etag = response.headers.get("ETag")
+        peer.error = None
+        return True
+
+    def refresh(self, force: bool = False) -> None:
+        with self._lock:
+            now = time.monotonic()
+            stale = [
+                peer
+                for peer in self.peers
+                if force or now - peer.fetched_at >= self.ttl
+            ]
+            if not stale:
+                return
+            with ThreadPoolExecutor(max_workers=len(stale)) as executor:
+                changed = list(executor.map(self._fetch, stale))
+            if any(changed):
+                self.generation += 1
+
+    def merged_entries(self) -> List[Dict[str, Any]]:
+        """Entries of all peers, newest first, one per (name, size)."""
+        if self._merged_generation == self.generation:
+            return self._merged
+        generation = self.generation
+        seen = set()
+        merged = []
+        for peer in self.peers:
+            for entry in peer.files:
+                key = (entry["name"], entry["size"])
+                if key not in seen:
+                    seen.add(key)
+                    merged.append(entry)
+        merged.sort(key=lambda entry: entry.get("created_at", ""), reverse=True)
+        self._merged, self._merged_generation = merged, generation
+        return merged
+
+    def status(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        return [
+            {
+                "peer": peer.url,
+                "files": len(peer.files),
+                "etag": peer.etag,
+                "age_seconds": (
+                    round(now - peer.fetched_at, 1) if peer.fetched_at else None
+                ),
+                "error": peer.error,
+            }
+            for peer in self.peers
+        ]
@@ -0,0 +1,162 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import threading
+from concurrent.futures import as_completed
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from .device_io import DeviceScheduler
+from .profiling import mark, stage
+
+logger = logging.getLogger(__name__)
+
+FileInfo = Dict[str, Any]
+
+
+class FileIndex:
+    """
+    In-memory list of served files, filled progressively in the background.
+
+    Entries are appended from a worker thread while request handlers read them,
+    so readers only ever take snapshots (`sorted_entries`) and never iterate the
+    live list. Listeners registered with `subscribe` see every added entry.
+    A file is indexed once, whoever adds it first; only an entry for a running
+    download is replaced, by the finished file.
+    """
+
+    def __init__(self):
+        self.entries: List[FileInfo] = []
+        self.total = 0
+        self.indexed = 0
+        self.ready = False
+        # Set when the warm-up failed; the index then never becomes ready.
+        self.error: Optional[str] = None
+        self.version = 0
+        self._sorted_version = -1
+        self._sorted: List[FileInfo] = []
+        self._listeners: List[Callable[[FileInfo], None]] = []
+        self._positions: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def subscribe(self, listener: Callable[[FileInfo], None]) -> None:
+        self._listeners.append(listener)
+        for info in list(self.entries):
+            listener(info)
+
+    def add(self, info: FileInfo) -> bool:
+        """Index a file; False if it is already indexed."""
+        key = (str(info["directory"]), info.get("relative_path", info["name"]))
+        with self._lock:
+            position = self._positions.get(key)
+            if position is None:
+                self._positions[key] = len(self.entries)
+                self.entries.append(info)
+                self.indexed += 1
+            elif self.entries[position].get("downloading") and not info.get(
+                "downloading"
+            ):
+                self.entries[position] = info
+            else:
+                return False
+            self.version += 1
+        for listener in self._listeners:
+            listener(info)
+        return True
+
+    def sorted_entries(self) -> List[FileInfo]:
+        if self._sorted_version != self.version:
+            version = self.version
+            self._sorted = sorted(
+                list(self.entries), key=lambda x: x["created_at"], reverse=True
+            )
+            self._sorted_version = version
+        return self._sorted
+
+    def progress(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "indexed": self.indexed,
+            "total": self.total,
+            "error": self.error,
+        }
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def _add_result(self, file_path: Path, result: Callable[[], FileInfo]) -> None:
+        try:
+            if not self.add(result()):
+                self.total -= 1
+        except OSError as e:
+            # The file vanished or became unreadable since it was listed.
+            logger.debug(f"Skipping {file_path}: {e}")
+            self.total -= 1
+
+    def warm_up(
+        self,
+        collect: Callable[[], Iterable[Tuple[Path, Path]]],
+        describe: Callable[[Path, Path], FileInfo],
+        scheduler: Optional[DeviceScheduler] = None,
+    ) -> None:
+        """
+        Enumerate (file, directory) pairs with `collect`, then describe them one
+        by one, or in parallel across disks when a device scheduler is given.
+        Meant to run in a thread so the server can answer meanwhile. A failure
+        is logged and kept in `error` rather than raised.
+        """
+        try:
+            self._build(collect, describe, scheduler)
+        except Exception as e:
+            logger.exception("Building the file index failed")
+            self.error = f"{type(e).__name__}: {e}"
+
+    def _build(
+        self,
+        collect: Callable[[], Iterable[Tuple[Path, Path]]],
+        describe: Callable[[Path, Path], FileInfo],
+        scheduler: Optional[DeviceScheduler],
+    ) -> None:
+        with stage("scan"):
+            pending = list(collect())
+        self.total += len(pending)
+
+        with stage("probe"):
+            if scheduler is None:
+                for file_path, directory in pending:
+                    if self._stopped.is_set():
+                        return
+                    self._add_result(file_path, partial(describe, file_path, directory))
+            else:
+                futures = {
+                    scheduler.submit(file_path, describe, file_path, directory): (
+                        file_path
+                    )
+                    for file_path, directory in pending
+                }
+                # Results are added from this thread only, whichever disk
+                # queue probed them.
+                for future in as_completed(futures):
+                    if self._stopped.is_set():
+                        for queued in futures:
+                            queued.cancel()
+                        return
+                    self._add_result(futures[future], future.result)
+
+        self.ready = True
+        mark("index ready")
+        logger.info(f"Indexed {self.indexed} files")
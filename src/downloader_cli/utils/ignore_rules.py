@@ -0,0 +1,256 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from .config import STATE_DIR_NAME, get_config_value
+
+logger = logging.getLogger(__name__)
+
+IGNORE_FILE = ".downloaderignore"
+DEFAULT_IGNORE_PATTERNS = [".git/", ".Trash-*/", "@eaDir/"]
+
+
+def _translate_glob(pattern: str) -> str:
+    parts = []
+    i, n = 0, len(pattern)
+    while i < n:
+        char = pattern[i]
+        if pattern.startswith("**", i):
+            at_start = i == 0 or pattern[i - 1] == "/"
+            if at_start and pattern.startswith("**/", i):
+                parts.append("(?:.*/)?")
+                i += 3
+                continue
+            if at_start and i + 2 == n:
+                parts.append(".+")
+                i += 2
+                continue
+            # Any other run of asterisks is an ordinary "*".
+            while i < n and pattern[i] == "*":
+                i += 1
+            parts.append("[^/]*")
+            continue
+        if char == "*":
+            parts.append("[^/]*")
+        elif char == "?":
+            parts.append("[^/]")
+        elif char == "\\" and i + 1 < n:
+            i += 1
+            parts.append(re.escape(pattern[i]))
+        elif char == "[":
+            # Like fnmatch: a "]" right after the opening bracket is literal.
+            end = i + 1
+            if pattern[end : end + 1] in ("!", "^"):
+                end += 1
+            if pattern[end : end + 1] == "]":
+                end += 1
+            end = pattern.find("]", end)
+            if end == -1:
+                parts.append(re.escape(char))
+            else:
+                body = pattern[i + 1 : end].replace("\\", "\\\\")
+                if body[0] in "!^":
+                    body = "^" + body[1:]
+                body = body[0] + body[1:].replace("[", "\\[")
+                parts.append(f"(?!/)[{body}]")
+                i = end
+        else:
+            parts.append(re.escape(char))
+        i += 1
+    return "".join(parts)
+
+
+def translate(line: str, base: str = "") -> Optional[Tuple[str, bool]]:
+    """
+    (regex, negated) for one gitignore line whose file lives in `base`
+    ("" or "sub/dir/"), None for blank lines and comments. Directories are
+    matched with a trailing slash, so "dir/" rules never match files.
+    """
+    line = line.rstrip("\n")
+    # Trailing spaces are dropped unless escaped.
+    stripped = line.rstrip(" ")
+    if stripped.endswith("\\") and len(stripped) < len(line):
+        stripped += " "
+    line = stripped
+    if not line or line.startswith("#"):
+        return None
+    negated = line.startswith("!")
+    if negated:
+        line = line[1:]
+    elif line.startswith(("\\#", "\\!")):
+        line = line[1:]
+    dir_only = line.endswith("/")
+    line = line.rstrip("/")
+    if not line:
+        return None
+    # A slash anywhere but the end ties the pattern to the ignore file's
+    # directory; otherwise it matches a name at any depth below it.
+    anchored = "/" in line
+    body = _translate_glob(line.lstrip("/"))
+    prefix = re.escape(base) + ("" if anchored else "(?:.*/)?")
+    return prefix + body + ("/" if dir_only else "/?"), negated
+
+
+def read_ignore_file(path: Path) -> List[str]:
+    try:
+        return path.read_text(errors="replace").splitlines()
+    except OSError:
+        return []
+
+
+class IgnoreMatcher:
+    """
+    gitignore-style rules compiled into a single regular expression.
+
+    The rules become alternatives of one pattern in reverse order, so a single
+    `fullmatch` finds the last matching rule, which decides like in git.
+    """
+
+    def __init__(self, rules: Sequence[Tuple[str, str]] = ()):
+        self.rules = list(rules)
+        compiled = [translate(line, base) for base, line in self.rules]
+        compiled = [rule for rule in compiled if rule is not None]
+        self._regex = None
+        if compiled:
+            self._regex = re.compile(
+                "|".join(
+                    f"(?P<{'n' if negated else 'i'}{index}>{regex})"
+                    for index, (regex, negated) in enumerate(reversed(compiled))
+                ),
+                re.DOTALL,
+            )
+
+    @classmethod
+    def for_root(
+        cls, root: Path, patterns: Optional[List[str]] = None
+    ) -> "IgnoreMatcher":
+        """Config patterns followed by the root's own ignore file."""
+        if patterns is None:
+            patterns = get_config_value("ignore_patterns")
+            if patterns is None:
+                patterns = DEFAULT_IGNORE_PATTERNS
+        rules = [("", pattern) for pattern in patterns]
+        rules.extend(("", line) for line in read_ignore_file(root / IGNORE_FILE))
+        return cls(rules)
+
+    def extend(self, base: str, lines: List[str]) -> "IgnoreMatcher":
+        """Rules of a nested ignore file, which take precedence over these."""
+        return IgnoreMatcher(self.rules + [(base, line) for line in lines])
+
+    def ignored(self, path: str, is_dir: bool) -> bool:
+        """Whether a slash-separated path relative to the root is ignored."""
+        if self._regex is None:
+            return False
+        match = self._regex.fullmatch(path + "/" if is_dir else path)
+        return match is not None and match.lastgroup[0] == "i"
+
+
+class ScanStats:
+    """Entries seen and skipped by `walk`, shared by concurrent scans."""
+
+    def __init__(self):
+        self.directories = 0
+        self.files = 0
+        self.skipped_directories = 0
+        self.skipped_files = 0
+        self._lock = threading.Lock()
+
+    def add(
+        self,
+        directories: int = 0,
+        files: int = 0,
+        skipped_directories: int = 0,
+        skipped_files: int = 0,
+    ) -> None:
+        with self._lock:
+            self.directories += directories
+            self.files += files
+            self.skipped_directories += skipped_directories
+            self.skipped_files += skipped_files
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "directories": self.directories,
+                "files": self.files,
+                "skipped_directories": self.skipped_directories,
+                "skipped_files": self.skipped_files,
+            }
+
+    def summary(self) -> str:
+        stats = self.as_dict()
+        return (
+            f"scanned {stats['files']} files in {stats['directories']} directories, "
+            f"skipped {stats['skipped_files']} files and "
+            f"{stats['skipped_directories']} directories"
+        )
+
+    def render_metrics(self) -> List[str]:
+        stats = self.as_dict()
+        return [
+            "# TYPE downloader_scan_entries_total counter",
+            f'downloader_scan_entries_total{{kind="file"}} {stats["files"]}',
+            f'downloader_scan_entries_total{{kind="directory"}} {stats["directories"]}',
+            "# TYPE downloader_scan_skipped_total counter",
+            f'downloader_scan_skipped_total{{kind="file"}} {stats["skipped_files"]}',
+            'downloader_scan_skipped_total{kind="directory"} '
+            f'{stats["skipped_directories"]}',
+        ]
+
+
+def walk(
+    root: Path,
+    stats: Optional[ScanStats] = None,
+    patterns: Optional[List[str]] = None,
+    recursive: bool = True,
+) -> Iterator[Tuple[Path, List[str]]]:
+    """
+    Like os.walk, but yields (directory, file names) with ignored entries
+    left out. Ignored directories are pruned before os.walk descends into
+    them, and nested ignore files apply to their own subtree. The root's
+    state directory is always skipped.
+    """
+    root_path = os.fspath(root)
+    matchers = {root_path: IgnoreMatcher.for_root(Path(root_path), patterns)}
+    for dirpath, dirnames, filenames in os.walk(root_path):
+        matcher = matchers.pop(dirpath)
+        relative = os.path.relpath(dirpath, root_path)
+        prefix = "" if relative == os.curdir else relative.replace(os.sep, "/") + "/"
+        if prefix and IGNORE_FILE in filenames:
+            lines = read_ignore_file(Path(dirpath) / IGNORE_FILE)
+            matcher = matcher.extend(prefix, lines)
+
+        kept_dirs = [
+            d
+            for d in dirnames
+            if not matcher.ignored(prefix + d, True) and (prefix or d != STATE_DIR_NAME)
+        ]
+        files = [f for f in filenames if not matcher.ignored(prefix + f, False)]
+        if stats is not None:
+            stats.add(
+                directories=1,
+                files=len(files),
+                skipped_directories=len(dirnames) - len(kept_dirs),
+                skipped_files=len(filenames) - len(files),
+            )
+        dirnames[:] = kept_dirs if recursive else []
+        for name in dirnames:
+            matchers[os.path.join(dirpath, name)] = matcher
+        yield Path(dirpath), files
@@ -0,0 +1,106 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Set, Tuple
+
+from .config import get_state_dir
+from .playlist_registry import atomic_append_text
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = "media_index.jsonl"
+
+FileInfo = Dict[str, Any]
+
+
+class MediaIndex:
+    """
+    Append-only JSON-lines log of probed file info for one root, kept in its
+    state directory. Downloads append to it; servers follow it without
+    creating anything in the root, a missing index reading as empty.
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.path = get_state_dir(self.root, create=False) / INDEX_NAME
+
+    def read(self, offset: int = 0) -> Tuple[List[FileInfo], int]:
+        """Entries from `offset` on and the offset after the last whole line."""
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return [], 0
+        # A line without its newline is still being written.
+        end = data.rfind(b"\n") + 1
+        entries = []
+        for line in data[:end].splitlines():
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                logger.warning(f"Skipping a corrupt line in {self.path}")
+        return entries, offset + end
+
+    def paths(self) -> Set[str]:
+        return {entry["relative_path"] for entry in self.read()[0]}
+
+    def append(self, infos: List[FileInfo]) -> None:
+        if not infos:
+            return
+        lines = []
+        for info in infos:
+            record = {k: v for k, v in info.items() if k != "directory"}
+            lines.append(json.dumps(record, ensure_ascii=False) + "\n")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_append_text(self.path, "".join(lines))
+
+
+class MediaIndexFollower:
+    """
+    Reads what was appended to the media indexes of the served roots since
+    the last poll, starting from their size when the follower was created.
+    """
+
+    def __init__(self, directories: List[Path]):
+        self.indexes = [(Path(d), MediaIndex(d)) for d in directories]
+        self.offsets = {index.path: self._size(index.path) for _, index in self.indexes}
+
+    @staticmethod
+    def _size(path: Path) -> int:
+        try:
+            return os.stat(path).st_size
+        except FileNotFoundError:
+            return 0
+
+    def poll(self) -> List[FileInfo]:
+        """Blocking; new entries with their `directory` filled in."""
+        new = []
+        for directory, index in self.indexes:
+            offset = self.offsets[index.path]
+            size = self._size(index.path)
+            if size == offset:
+                continue
+            if size < offset:
+                # Rewritten from scratch; read it again.
+                offset = 0
+            entries, self.offsets[index.path] = index.read(offset)
+            for entry in entries:
+                entry["directory"] = directory
+                new.append(entry)
+        return new
@@ -0,0 +1,278 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mmap
+import struct
+import subprocess
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+# Top-level box types that may start an ISO base media (MP4/MOV) file.
+MP4_LEADING_BOXES = {b"ftyp", b"moov", b"mdat", b"free", b"skip", b"wide", b"pnot"}
+EBML_MAGIC = b"\x1a\x45\xdf\xa3"
+
+# Matroska / WebM element IDs (with their length marker bits).
+MKV_SEGMENT = 0x18538067
+MKV_INFO = 0x1549A966
+MKV_TIMECODE_SCALE = 0x2AD7B1
+MKV_DURATION = 0x4489
+MKV_TRACKS = 0x1654AE6B
+MKV_TRACK_ENTRY = 0xAE
+MKV_TRACK_TYPE = 0x83
+MKV_CODEC_ID = 0x86
+MKV_VIDEO = 0xE0
+MKV_PIXEL_WIDTH = 0xB0
+MKV_PIXEL_HEIGHT = 0xBA
+MKV_CLUSTER = 0x1F43B675
+MKV_TRACK_TYPES = {1: "video", 2: "audio", 17: "subtitle"}
+
+MP4_HANDLER_TYPES = {b"vide": "video", b"soun": "audio", b"sbtl": "subtitle"}
+
+
+class MediaParseError(Exception):
+    pass
+
+
+def _iter_boxes(buf, start: int, end: int):
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", buf, pos)
+        header = 8
+        if size == 1:
+            if pos + 16 > end:
+                raise MediaParseError("Truncated box header")
+            size = struct.unpack_from(">Q", buf, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            raise MediaParseError(f"Invalid size for box {box_type!r}")
+        yield box_type, pos + header, pos + size
+        pos += size
+
+
+def _find_box(buf, start: int, end: int, box_type: bytes) -> Optional[Tuple[int, int]]:
+    for found_type, body_start, body_end in _iter_boxes(buf, start, end):
+        if found_type == box_type:
+            return body_start, body_end
+    return None
+
+
+def _parse_mp4_track(buf, start: int, end: int) -> Dict[str, Any]:
+    track: Dict[str, Any] = {}
+    tkhd = _find_box(buf, start, end, b"tkhd")
+    if tkhd:
+        version = buf[tkhd[0]]
+        # Width and height are 16.16 fixed point at the end of the box.
+        offset = tkhd[0] + (88 if version == 1 else 76)
+        if offset + 8 <= tkhd[1]:
+            width, height = struct.unpack_from(">II", buf, offset)
+            if width and height:
+                track["width"] = width >> 16
+                track["height"] = height >> 16
+
+    mdia = _find_box(buf, start, end, b"mdia")
+    if mdia:
+        hdlr = _find_box(buf, mdia[0], mdia[1], b"hdlr")
+        if hdlr and hdlr[0] + 12 <= hdlr[1]:
+            handler = bytes(buf[hdlr[0] + 8 : hdlr[0] + 12])
+            track["type"] = MP4_HANDLER_TYPES.get(handler, handler.decode("latin-1"))
+        minf = _find_box(buf, mdia[0], mdia[1], b"minf")
+        stbl = minf and _find_box(buf, minf[0], minf[1], b"stbl")
+        stsd = stbl and _find_box(buf, stbl[0], stbl[1], b"stsd")
+        if stsd and stsd[0] + 16 <= stsd[1]:
+            track["codec"] = bytes(buf[stsd[0] + 12 : stsd[0] + 16]).decode("latin-1")
+    return track
+
+
+def _parse_mp4(buf) -> Dict[str, Any]:
+    moov = _find_box(buf, 0, len(buf), b"moov")
+    if moov is None:
+        raise MediaParseError("No moov box")
+    mvhd = _find_box(buf, moov[0], moov[1], b"mvhd")
+    if mvhd is None:
+        raise MediaParseError("No mvhd box")
+
+    if buf[mvhd[0]] == 1:
+        timescale, duration = struct.unpack_from(">IQ", buf, mvhd[0] + 20)
+    else:
+        timescale, duration = struct.unpack_from(">II", buf, mvhd[0] + 12)
+    if not timescale:
+        raise MediaParseError("Zero timescale")
+    # Fragmented files leave the duration to their fragments; all ones means
+    # unknown. Either way ffprobe has to work it out.
+    if duration in (0, 0xFFFFFFFF, 0xFFFFFFFFFFFFFFFF):
+        raise MediaParseError("No duration in mvhd")
+
+    streams = [
+        _parse_mp4_track(buf, body_start, body_end)
+        for box_type, body_start, body_end in _iter_boxes(buf, moov[0], moov[1])
+        if box_type == b"trak"
+    ]
+    return {"container": "mp4", "duration": duration / timescale, "streams": streams}
+
+
+def _read_vint(buf, pos: int, keep_marker: bool) -> Tuple[int, int]:
+    first = buf[pos]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not first & mask:
+        mask >>= 1
+        length += 1
+    if length > 8 or pos + length > len(buf):
+        raise MediaParseError("Invalid EBML variable-length integer")
+    value = first if keep_marker else first & (mask - 1)
+    for i in range(1, length):
+        value = (value << 8) | buf[pos + i]
+    return value, length
+
+
+def _iter_elements(buf, start: int, end: int):
+    pos = start
+    while pos < end:
+        element_id, id_len = _read_vint(buf, pos, keep_marker=True)
+        size, size_len = _read_vint(buf, pos + id_len, keep_marker=False)
+        body_start = pos + id_len + size_len
+        # All ones means "unknown size", which only makes sense for master
+        # elements running to the end of their parent.
+        if size == (1 << (7 * size_len)) - 1:
+            body_end = end
+        else:
+            body_end = min(body_start + size, end)
+        yield element_id, body_start, body_end
+        pos = body_end
+
+
+def _read_uint(buf, start: int, end: int) -> int:
+    return int.from_bytes(buf[start:end], "big")
+
+
+def _parse_mkv_tracks(buf, start: int, end: int) -> List[Dict[str, Any]]:
+    streams = []
+    for element_id, body_start, body_end in _iter_elements(buf, start, end):
+        if element_id != MKV_TRACK_ENTRY:
+            continue
+        track: Dict[str, Any] = {}
+        for child_id, child_start, child_end in _iter_elements(
+            buf, body_start, body_end
+        ):
+            if child_id == MKV_TRACK_TYPE:
+                track_type = _read_uint(buf, child_start, child_end)
+                track["type"] = MKV_TRACK_TYPES.get(track_type, str(track_type))
+            elif child_id == MKV_CODEC_ID:
+                track["codec"] = bytes(buf[child_start:child_end]).decode(
+                    "ascii", "replace"
+                )
+            elif child_id == MKV_VIDEO:
+                for video_id, video_start, video_end in _iter_elements(
+                    buf, child_start, child_end
+                ):
+                    if video_id == MKV_PIXEL_WIDTH:
+                        track["width"] = _read_uint(buf, video_start, video_end)
+                    elif video_id == MKV_PIXEL_HEIGHT:
+                        track["height"] = _read_uint(buf, video_start, video_end)
+        streams.append(track)
+    return streams
+
+
+def _parse_mkv(buf) -> Dict[str, Any]:
+    segment = None
+    for element_id, body_start, body_end in _iter_elements(buf, 0, len(buf)):
+        if element_id == MKV_SEGMENT:
+            segment = (body_start, body_end)
+            break
+    if segment is None:
+        raise MediaParseError("No Segment element")
+
+    timecode_scale = 1_000_000
+    duration = None
+    streams: List[Dict[str, Any]] = []
+    for element_id, body_start, body_end in _iter_elements(buf, *segment):
+        if element_id == MKV_INFO:
+            for child_id, child_start, child_end in _iter_elements(
+                buf, body_start, body_end
+            ):
+                if child_id == MKV_TIMECODE_SCALE:
+                    timecode_scale = _read_uint(buf, child_start, child_end)
+                elif child_id == MKV_DURATION:
+                    fmt = ">f" if child_end - child_start == 4 else ">d"
+                    duration = struct.unpack_from(fmt, buf, child_start)[0]
+        elif element_id == MKV_TRACKS:
+            streams = _parse_mkv_tracks(buf, body_start, body_end)
+        elif element_id == MKV_CLUSTER:
+            # Metadata precedes the media data in practically every muxer.
+            break
+        if duration is not None and streams:
+            break
+
+    if duration is None:
+        raise MediaParseError("No Duration element")
+    return {
+        "container": "matroska",
+        "duration": duration * timecode_scale / 1_000_000_000,
+        "streams": streams,
+    }
+
+
+def probe_media(file_path: Path) -> Optional[Dict[str, Any]]:
+    """
+    Read duration and basic stream info from MP4/MOV and Matroska/WebM headers.
+
+    The file is memory-mapped, so only the pages holding the headers are read.
+    Returns None for other containers or files that fail to parse.
+    """
+    try:
+        with open(file_path, "rb") as f:
+            magic = f.read(8)
+            if len(magic) < 8:
+                return None
+            if magic[:4] == EBML_MAGIC:
+                parser = _parse_mkv
+            elif magic[4:8] in MP4_LEADING_BOXES:
+                parser = _parse_mp4
+            else:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                return parser(buf)
+    except (OSError, ValueError, IndexError, struct.error, MediaParseError):
+        return None
+
+
+def ffprobe_duration(file_path: Path) -> Optional[float]:
+    try:
+        result = subprocess.run(
+            [
+                "ffprobe",
+                "-v",
+                "error",
+                "-show_entries",
+                "format=duration",
+                "-of",
+                "default=noprint_wrappers=1:nokey=1",
+                str(file_path),
+            ],
+            capture_output=True,
+            text=True,
+        )
+        return float(result.stdout)
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return None
+
+
+def get_duration(file_path: Path) -> Optional[float]:
+    """Duration in seconds, falling back to ffprobe for unknown containers."""
+    info = probe_media(file_path)
+    if info is not None:
+        return info["duration"]
+    return ffprobe_duration(file_path)
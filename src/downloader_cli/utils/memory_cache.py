@@ -0,0 +1,129 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from .config import parse_size
+
+logger = logging.getLogger(__name__)
+
+# Off unless `memory_cache.max_bytes` is configured.
+DEFAULT_MAX_BYTES = 0
+DEFAULT_MAX_FILE_SIZE = 4 * 1024**2
+
+
+def _validator(stat: os.stat_result) -> Tuple[int, int]:
+    return stat.st_size, stat.st_mtime_ns
+
+
+class MemoryFileCache:
+    """
+    Contents of small files kept in memory, least recently used evicted first
+    once they take more than `max_bytes`. An entry is only served while the
+    file's size and mtime are what they were when it was read.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        max_file_size: int = DEFAULT_MAX_FILE_SIZE,
+    ):
+        self.max_bytes = max_bytes
+        self.max_file_size = min(max_file_size, max_bytes)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Tuple[Tuple[int, int], bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, settings: Optional[Dict[str, Any]]) -> "MemoryFileCache":
+        """Read a `memory_cache` mapping; sizes accept K/M/G suffixes."""
+        settings = settings or {}
+
+        def size(key: str, default: int) -> int:
+            value = settings.get(key)
+            return parse_size(value) if value not in (None, "") else default
+
+        return cls(
+            max_bytes=size("max_bytes", DEFAULT_MAX_BYTES),
+            max_file_size=size("max_file_size", DEFAULT_MAX_FILE_SIZE),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 and self.max_file_size > 0
+
+    def eligible(self, stat: os.stat_result) -> bool:
+        return 0 < stat.st_size <= self.max_file_size
+
+    def get(self, path: Path, stat: os.stat_result) -> Optional[memoryview]:
+        """The cached contents if they still match `stat`; counts the miss."""
+        key = str(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == _validator(stat):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return memoryview(entry[1])
+            self.misses += 1
+        return None
+
+    def load(self, path: Path) -> Optional[Tuple[memoryview, os.stat_result]]:
+        """
+        Blocking; run it in the I/O executor. Reads the file and caches it
+        unless it changed while being read. Returns the contents and the stat
+        they belong to, or None if the file is gone or no longer small.
+        """
+        try:
+            with open(path, "rb") as f:
+                before = os.fstat(f.fileno())
+                if not self.eligible(before):
+                    return None
+                data = f.read(before.st_size + 1)
+                after = os.fstat(f.fileno())
+        except OSError as e:
+            logger.debug(f"Not caching {path}: {e}")
+            return None
+        if len(data) != before.st_size or _validator(after) != _validator(before):
+            return None
+
+        key = str(path)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous[1])
+            self._entries[key] = (_validator(before), data)
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+        return memoryview(data), before
+
+    def render_metrics(self) -> List[str]:
+        return [
+            "# TYPE downloader_memory_cache_bytes gauge",
+            f"downloader_memory_cache_bytes {self.size}",
+            "# TYPE downloader_memory_cache_entries gauge",
+            f"downloader_memory_cache_entries {len(self._entries)}",
+            "# TYPE downloader_memory_cache_evictions_total counter",
+            f"downloader_memory_cache_evictions_total {self.evictions}",
+        ]
@@ -0,0 +1,219 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import logging
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# All collectors are updated from the event loop thread only, so plain
+# attribute updates are enough and no locking is needed.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, labels: str = "") -> List[str]:
+        prefix = f"{labels}," if labels else ""
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {self.count}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.sum}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+        return lines
+
+
+class ServerMetrics:
+    def __init__(self):
+        self.started_at = time.time()
+        self.request_latency: Dict[str, Histogram] = {}
+        self.responses: Dict[Tuple[str, int], int] = {}
+        self.bytes_served = 0
+        self.active_streams = 0
+        self.range_requests = 0
+        self.full_requests = 0
+        self.loop_lag = Histogram(LOOP_LAG_BUCKETS)
+        self.loop_lag_max = 0.0
+        self.loop_stalls = 0
+        self.caches: Dict[str, Callable[[], Tuple[int, int]]] = {}
+        self.collectors: List[Callable[[], List[str]]] = []
+
+    def observe_request(self, route: str, status: int, elapsed: float) -> None:
+        histogram = self.request_latency.get(route)
+        if histogram is None:
+            histogram = self.request_latency[route] = Histogram(LATENCY_BUCKETS)
+        histogram.observe(elapsed)
+        key = (route, status)
+        self.responses[key] = self.responses.get(key, 0) + 1
+
+    def register_cache(self, name: str, stats: Callable[[], Tuple[int, int]]) -> None:
+        """Register a callable returning (hits, misses), read only when rendering."""
+        self.caches[name] = stats
+
+    def register_collector(self, render: Callable[[], List[str]]) -> None:
+        """Register a callable returning extra exposition lines for /metrics."""
+        self.collectors.append(render)
+
+    async def monitor_loop_lag(
+        self, interval: float = 0.1, stall_threshold: float = 0.1
+    ) -> None:
+        """Sample how late the loop wakes up; log every lag above the threshold."""
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + interval
+            await asyncio.sleep(interval)
+            lag = max(0.0, loop.time() - expected)
+            self.loop_lag.observe(lag)
+            self.loop_lag_max = max(self.loop_lag_max, lag)
+            if lag > stall_threshold:
+                self.loop_stalls += 1
+                logger.warning(
+                    f"Event loop stalled for {lag * 1000:.0f} ms "
+                    f"({self.active_streams} active streams), "
+                    "something is blocking the loop"
+                )
+
+    def render(self) -> str:
+        lines = [
+            "# HELP downloader_uptime_seconds Seconds since the server started.",
+            "# TYPE downloader_uptime_seconds gauge",
+            f"downloader_uptime_seconds {time.time() - self.started_at:.3f}",
+            "# HELP downloader_request_duration_seconds Request latency per route.",
+            "# TYPE downloader_request_duration_seconds histogram",
+        ]
+        for route, histogram in sorted(self.request_latency.items()):
+            lines.extend(
+                histogram.render(
+                    "downloader_request_duration_seconds", f'route="{route}"'
+                )
+            )
+
+        lines.append("# TYPE downloader_responses_total counter")
+        for (route, status), count in sorted(self.responses.items()):
+            lines.append(
+                f'downloader_responses_total{{route="{route}",status="{status}"}} {count}'
+            )
+
+        lines.extend(
+            [
+                "# TYPE downloader_bytes_served_total counter",
+                f"downloader_bytes_served_total {self.bytes_served}",
+                "# TYPE downloader_active_streams gauge",
+                f"downloader_active_streams {self.active_streams}",
+                "# TYPE downloader_file_requests_total counter",
+                f'downloader_file_requests_total{{kind="range"}} {self.range_requests}',
+                f'downloader_file_requests_total{{kind="full"}} {self.full_requests}',
+                "# TYPE downloader_cache_requests_total counter",
+            ]
+        )
+
+        ratios = []
+        for name, stats in sorted(self.caches.items()):
+            hits, misses = stats()
+            lines.append(
+                f'downloader_cache_requests_total{{cache="{name}",result="hit"}} {hits}'
+            )
+            lines.append(
+                f'downloader_cache_requests_total{{cache="{name}",result="miss"}} {misses}'
+            )
+            total = hits + misses
+            ratios.append(
+                f'downloader_cache_hit_ratio{{cache="{name}"}} {hits / total if total else 0.0}'
+            )
+        lines.append("# TYPE downloader_cache_hit_ratio gauge")
+        lines.extend(ratios)
+
+        lines.append("# TYPE downloader_event_loop_lag_seconds histogram")
+        lines.extend(self.loop_lag.render("downloader_event_loop_lag_seconds"))
+        lines.append("# TYPE downloader_event_loop_lag_max_seconds gauge")
+        lines.append(f"downloader_event_loop_lag_max_seconds {self.loop_lag_max}")
+        lines.append("# TYPE downloader_event_loop_stalls_total counter")
+        lines.append(f"downloader_event_loop_stalls_total {self.loop_stalls}")
+        for render in self.collectors:
+            lines.extend(render())
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware feeding ServerMetrics.
+
+    The route label is the endpoint name Starlette's router leaves in the scope,
+    which keeps the label set small regardless of how many files are served.
+    """
+
+    def __init__(self, app, metrics: ServerMetrics, stream_endpoints=()):
+        self.app = app
+        self.metrics = metrics
+        self.stream_endpoints = set(stream_endpoints)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        metrics = self.metrics
+        start = time.perf_counter()
+        status = 500
+        streaming = False
+
+        async def send_wrapper(message):
+            nonlocal status, streaming
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                endpoint = scope.get("endpoint")
+                if (
+                    status in (200, 206)
+                    and endpoint is not None
+                    and endpoint.__name__ in self.stream_endpoints
+                ):
+                    streaming = True
+                    metrics.active_streams += 1
+                    if status == 206:
+                        metrics.range_requests += 1
+                    else:
+                        metrics.full_requests += 1
+            elif message["type"] == "http.response.body":
+                metrics.bytes_served += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if streaming:
+                metrics.active_streams -= 1
+            endpoint = scope.get("endpoint")
+            route = endpoint.__name__ if endpoint is not None else "unmatched"
+            metrics.observe_request(route, status, time.perf_counter() - start)
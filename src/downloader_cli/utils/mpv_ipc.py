@@ -0,0 +1,178 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import os
+import socket
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+PLAYLIST_POS = 1
+PLAYLIST_COUNT = 2
+GET_PLAYLIST = 100
+
+
+def prefetch_local(path: Path, head_bytes: int) -> None:
+    """Ask the kernel to start reading the head of a local file."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, 0, head_bytes, os.POSIX_FADV_WILLNEED)
+        else:
+            # No fadvise (macOS): a plain read still spins the disk up.
+            os.read(fd, min(head_bytes, 1024 * 1024))
+    finally:
+        os.close(fd)
+
+
+def prefetch_http(session: requests.Session, url: str, head_bytes: int) -> None:
+    """Fetch the head of a remote entry so the server has it in cache."""
+    with session.get(
+        url, headers={"Range": f"bytes=0-{head_bytes - 1}"}, stream=True, timeout=30
+    ) as response:
+        for _ in response.iter_content(chunk_size=256 * 1024):
+            pass
+
+
+class MpvSupervisor:
+    """
+    Follows mpv's playlist position over its JSON IPC socket and warms up the
+    next entries, while measuring how long each track switch takes.
+    """
+
+    def __init__(self, socket_path: Path, prefetch: int, head_bytes: int):
+        self.socket_path = socket_path
+        self.prefetch = prefetch
+        self.head_bytes = head_bytes
+        self.playlist: List[str] = []
+        self.position: Optional[int] = None
+        # Entries warmed for the current playlist; reset when it changes.
+        self.prefetched = set()
+        self.prefetch_count = 0
+        self.switch_latencies: List[float] = []
+        self._file_started: Optional[float] = None
+        self._session = requests.Session()
+        self._executor = ThreadPoolExecutor(max_workers=max(prefetch, 1))
+        self._sock: Optional[socket.socket] = None
+
+    def connect(self, timeout: float = 10.0) -> None:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.connect(str(self.socket_path))
+                self._sock = sock
+                return
+            except (FileNotFoundError, ConnectionRefusedError):
+                sock.close()
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+
+    def send(self, *command: Any, request_id: Optional[int] = None) -> None:
+        message: Dict[str, Any] = {"command": list(command)}
+        if request_id is not None:
+            message["request_id"] = request_id
+        self._sock.sendall(json.dumps(message).encode("utf-8") + b"\n")
+
+    def _warm(self, entry: str) -> None:
+        try:
+            if entry.startswith(("http://", "https://")):
+                prefetch_http(self._session, entry, self.head_bytes)
+            else:
+                prefetch_local(Path(entry), self.head_bytes)
+            logger.debug(f"Prefetched {entry}")
+        except (OSError, requests.RequestException) as e:
+            logger.debug(f"Prefetch of {entry} failed: {e}")
+
+    def on_position(self, position: Optional[int]) -> None:
+        self.position = position
+        if position is None or position < 0:
+            return
+        for entry in self.playlist[position + 1 : position + 1 + self.prefetch]:
+            if entry not in self.prefetched:
+                self.prefetched.add(entry)
+                self.prefetch_count += 1
+                self._executor.submit(self._warm, entry)
+
+    def on_playlist(self, playlist: List[str]) -> None:
+        if playlist != self.playlist:
+            self.prefetched.clear()
+        self.playlist = playlist
+        # The position event usually arrives before the playlist does.
+        self.on_position(self.position)
+
+    def handle(self, message: Dict[str, Any]) -> None:
+        event = message.get("event")
+        if event == "property-change":
+            if message.get("id") == PLAYLIST_POS:
+                self.on_position(message.get("data"))
+            elif message.get("id") == PLAYLIST_COUNT:
+                self.send("get_property", "playlist", request_id=GET_PLAYLIST)
+        elif event == "start-file":
+            self._file_started = time.monotonic()
+        elif event == "playback-restart" and self._file_started is not None:
+            latency = time.monotonic() - self._file_started
+            self._file_started = None
+            self.switch_latencies.append(latency)
+            logger.info(f"Track switch took {latency * 1000:.0f} ms")
+        elif message.get("request_id") == GET_PLAYLIST and message.get("data"):
+            self.on_playlist([item["filename"] for item in message["data"]])
+
+    def run(self) -> None:
+        """Process events until mpv exits and closes the socket."""
+        self.send("observe_property", PLAYLIST_COUNT, "playlist-count")
+        self.send("observe_property", PLAYLIST_POS, "playlist-pos")
+        buffer = b""
+        try:
+            while True:
+                chunk = self._sock.recv(65536)
+                if not chunk:
+                    break
+                buffer += chunk
+                *lines, buffer = buffer.split(b"\n")
+                for line in lines:
+                    if not line.strip():
+                        continue
+                    try:
+                        message = json.loads(line)
+                    except ValueError:
+                        message = None
+                    if not isinstance(message, dict):
+                        logger.warning(f"Skipping an invalid IPC line: {line[:200]!r}")
+                        continue
+                    self.handle(message)
+        finally:
+            self._sock.close()
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def report(self) -> Dict[str, Any]:
+        latencies = self.switch_latencies
+        if not latencies:
+            return {"switches": 0}
+        return {
+            "switches": len(latencies),
+            "mean_ms": statistics.fmean(latencies) * 1000,
+            "median_ms": statistics.median(latencies) * 1000,
+            "max_ms": max(latencies) * 1000,
+            "prefetched": self.prefetch_count,
+        }
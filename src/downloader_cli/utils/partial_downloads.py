@@ -0,0 +1,200 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import logging
+import struct
+import sys
+from concurrent.futures import Executor
+from pathlib import Path
+from typing import AsyncIterator, Optional, Tuple
+
+import aiofiles
+
+logger = logging.getLogger(__name__)
+
+PART_SUFFIX = ".part"
+CONTROL_SUFFIX = ".aria2"
+# Sidecar files of running downloads that are never worth listing.
+SIDECAR_SUFFIXES = (CONTROL_SUFFIX, ".ytdl")
+ARIA2_BLOCK_LENGTH = 16 * 1024
+CHUNK_SIZE = 256 * 1024
+
+
+def _leading_ones(bitfield: bytes) -> int:
+    count = 0
+    for byte in bitfield:
+        if byte == 0xFF:
+            count += 8
+            continue
+        while byte & 0x80:
+            count += 1
+            byte = (byte << 1) & 0xFF
+        break
+    return count
+
+
+def read_aria2_control(path: Path) -> Optional[Tuple[int, int]]:
+    """
+    (total length, contiguous bytes from the start) from an aria2c control
+    file. aria2c downloads pieces out of order into a preallocated file, so
+    only the unbroken run of finished pieces at the front is playable.
+    """
+    try:
+        data = path.read_bytes()
+        version = struct.unpack_from(">H", data, 0)[0]
+        # Version 1 is big-endian, version 0 used the host byte order.
+        order = ">" if version == 1 else "<" if sys.byteorder == "little" else ">"
+        offset = 6
+        (hash_length,) = struct.unpack_from(f"{order}I", data, offset)
+        offset += 4 + hash_length
+        piece_length, total = struct.unpack_from(f"{order}IQ", data, offset)
+        offset += 4 + 8 + 8
+        (bitfield_length,) = struct.unpack_from(f"{order}I", data, offset)
+        offset += 4
+        bitfield = data[offset : offset + bitfield_length]
+        offset += bitfield_length
+
+        pieces = _leading_ones(bitfield)
+        available = pieces * piece_length
+        (in_flight,) = struct.unpack_from(f"{order}I", data, offset)
+        offset += 4
+        for _ in range(in_flight):
+            index, _length, blocks_length = struct.unpack_from(
+                f"{order}III", data, offset
+            )
+            offset += 12
+            if index == pieces:
+                blocks = _leading_ones(data[offset : offset + blocks_length])
+                available += min(blocks * ARIA2_BLOCK_LENGTH, piece_length)
+            offset += blocks_length
+    except (OSError, struct.error):
+        return None
+    return total, min(available, total)
+
+
+class PartialDownload:
+    """
+    A file that aria2c or yt-dlp is still writing.
+
+    `final_path` is where the finished file will be. yt-dlp writes to
+    `<final>.part` and renames it at the end; aria2c writes `<final>` directly
+    next to a `<final>.aria2` control file that disappears once it's done.
+    yt-dlp running aria2c as external downloader produces `<final>.part.aria2`.
+    """
+
+    def __init__(self, final_path: Path, data_path: Path):
+        self.final_path = final_path
+        self.data_path = data_path
+        self.control_path = data_path.with_name(data_path.name + CONTROL_SUFFIX)
+
+    @classmethod
+    def find(cls, path: Path, exists: bool) -> Optional["PartialDownload"]:
+        """The running download behind a requested path, if there is one."""
+        if path.name.endswith(PART_SUFFIX):
+            final_path = path.with_name(path.name[: -len(PART_SUFFIX)])
+            return cls(final_path, path) if exists else None
+        if exists and path.with_name(path.name + CONTROL_SUFFIX).exists():
+            return cls(path, path)
+        part = path.with_name(path.name + PART_SUFFIX)
+        if not exists and part.exists():
+            return cls(path, part)
+        return None
+
+    def progress(self) -> Tuple[int, Optional[int], bool]:
+        """(bytes playable from the start, total if known, finished)."""
+        try:
+            # Checked before the data file: once it is gone, the data is final.
+            if self.control_path.exists():
+                control = read_aria2_control(self.control_path)
+                if control is not None:
+                    total, available = control
+                    return available, total, False
+            size = self.data_path.stat().st_size
+            if self.data_path != self.final_path:
+                return size, None, False
+            if not self.control_path.exists():
+                return size, size, True
+            return 0, None, False
+        except FileNotFoundError:
+            # yt-dlp renamed the .part file into place.
+            try:
+                size = self.final_path.stat().st_size
+            except FileNotFoundError:
+                return 0, None, True
+            return size, size, True
+
+
+def parse_range(
+    header: str, total: Optional[int]
+) -> Optional[Tuple[int, Optional[int]]]:
+    """First range of a Range header as (start, end or None); None if unusable."""
+    unit, _, ranges = header.partition("=")
+    if unit.strip() != "bytes":
+        return None
+    first, _, last = ranges.split(",")[0].strip().partition("-")
+    try:
+        if first:
+            return int(first), int(last) if last else None
+        if total is not None and last:
+            return max(total - int(last), 0), None
+    except ValueError:
+        pass
+    return None
+
+
+async def follow(
+    download: PartialDownload,
+    start: int,
+    end: Optional[int],
+    executor: Executor,
+    poll_interval: float = 0.5,
+    idle_timeout: float = 300.0,
+) -> AsyncIterator[bytes]:
+    """
+    Yield bytes `start`..`end` (inclusive, None for "until the download ends"),
+    waiting for the writer whenever the reader catches up with it.
+    """
+    loop = asyncio.get_running_loop()
+    position = start
+    available, finished = 0, False
+    idle = 0.0
+    # The open descriptor survives yt-dlp's final rename of the .part file.
+    async with aiofiles.open(download.data_path, "rb", executor=executor) as f:
+        await f.seek(start)
+        while end is None or position <= end:
+            limit = available if end is None else min(available, end + 1)
+            # Only look at the writer again once everything known is sent.
+            if position >= limit and not finished:
+                available, _total, finished = await loop.run_in_executor(
+                    executor, download.progress
+                )
+                limit = available if end is None else min(available, end + 1)
+            if position < limit:
+                data = await f.read(min(CHUNK_SIZE, limit - position))
+                if data:
+                    position += len(data)
+                    idle = 0.0
+                    yield data
+                    continue
+            if finished:
+                return
+            if idle >= idle_timeout:
+                logger.warning(
+                    f"{download.final_path.name} made no progress for "
+                    f"{idle_timeout:.0f}s, ending the stream at {position} bytes"
+                )
+                return
+            await asyncio.sleep(poll_interval)
+            idle += poll_interval
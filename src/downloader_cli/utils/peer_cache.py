@@ -0,0 +1,309 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import logging
+import os
+import re
+import shlex
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+from urllib.parse import quote, unquote, urlsplit
+
+import requests
+
+from .checksums import ChecksumStore, hash_file
+from .config import CONFIG_DIR
+from .device_io import DeviceScheduler
+from .federation import create_session
+from .partial_downloads import CONTROL_SUFFIX, PART_SUFFIX
+from .url_expansion import normalize_url
+
+logger = logging.getLogger(__name__)
+
+# Which URL ended up in which file, for every download on this machine.
+JOURNAL_FILE = os.path.join(CONFIG_DIR, "url_journal.tsv")
+LOOKUP_PATH = "/api/peer-lookup"
+CHUNK_SIZE = 1024 * 1024
+CHECKSUM_OPTION = re.compile(r"^\s*checksum=sha-256=([0-9A-Fa-f]{64})\s*$")
+# Files hashed at once for lookups that missed the checksum manifests.
+MAX_PENDING_HASHES = 16
+
+Entry = Dict[str, Any]
+Match = Dict[str, Any]
+
+
+def journal_key(url: str) -> str:
+    """
+    How a URL is looked up in the journal: normalized, and the first mirror
+    of an aria2c line that lists several.
+    """
+    return normalize_url(url.split("\t")[0])
+
+
+def ytdlp_journal_option(journal: str = JOURNAL_FILE) -> str:
+    """
+    yt-dlp option that appends "<url>\\t<file>" once a file is in place. The
+    URL is the video's own page, not the playlist or channel it came from.
+    """
+    template = "after_move:%(webpage_url)s\t%(filepath)s"
+    return f"--print-to-file {shlex.quote(template)} {shlex.quote(journal)}"
+
+
+def append_journal(
+    records: List[Tuple[str, Path]], journal: str = JOURNAL_FILE
+) -> None:
+    if not records:
+        return
+    os.makedirs(os.path.dirname(journal), exist_ok=True)
+    with open(journal, "a") as f:
+        for url, path in records:
+            f.write(f"{journal_key(url)}\t{Path(path).resolve()}\n")
+
+
+def entry_output_name(entry: Entry) -> str:
+    """The file name aria2c gives an entry: its out= option or the URL's name."""
+    for option in entry["options"]:
+        name, _, value = option.strip().partition("=")
+        if name == "out" and value:
+            return value
+    return unquote(os.path.basename(urlsplit(entry["url"].split("\t")[0]).path))
+
+
+def entry_sha256(entry: Entry) -> Optional[str]:
+    for option in entry["options"]:
+        match = CHECKSUM_OPTION.match(option)
+        if match:
+            return match.group(1).lower()
+    return None
+
+
+def record_aria2_entries(download_dir: Path, entries: List[Entry]) -> int:
+    """Journal the entries of an aria2c run that finished; returns how many."""
+    records = []
+    for entry in entries:
+        name = entry_output_name(entry)
+        if not name:
+            continue
+        path = download_dir / name
+        if path.is_file() and not path.with_name(name + CONTROL_SUFFIX).exists():
+            records.append((entry["url"], path))
+    append_journal(records)
+    return len(records)
+
+
+class PeerIndex:
+    """
+    Server side: answers whether this node has a finished copy of a URL (from
+    the journal) or of a content hash (from the checksum manifests).
+
+    A journaled file missing from the manifests is hashed on its device's
+    queue in `devices`, at most MAX_PENDING_HASHES at a time, and left out of
+    the answers until its hash is known.
+    """
+
+    def __init__(
+        self,
+        directories: List[Path],
+        checksums: ChecksumStore,
+        devices: DeviceScheduler,
+        journal: str = JOURNAL_FILE,
+    ):
+        self.directories = [Path(d) for d in directories]
+        self.checksums = checksums
+        self.devices = devices
+        self.journal = journal
+        self._journal_mtime = None
+        self._urls: Dict[str, Path] = {}
+        self._digests: Dict[Tuple[str, int, int], str] = {}
+        self._hashing: Set[Tuple[str, int, int]] = set()
+        self._lock = threading.Lock()
+
+    def _load_journal(self) -> None:
+        try:
+            mtime = os.stat(self.journal).st_mtime_ns
+        except FileNotFoundError:
+            self._urls = {}
+            return
+        if mtime == self._journal_mtime:
+            return
+        urls = {}
+        with open(self.journal, "r", errors="replace") as f:
+            for line in f:
+                url, _, path = line.rstrip("\n").partition("\t")
+                if url and path:
+                    urls[journal_key(url)] = Path(path)
+        self._urls, self._journal_mtime = urls, mtime
+
+    def _served_path(self, path: Path) -> Optional[str]:
+        for directory in self.directories:
+            if path.is_relative_to(directory):
+                return f"{directory.name}/{path.relative_to(directory).as_posix()}"
+        return None
+
+    def _match(self, path: Path, digest: Optional[str] = None) -> Optional[Match]:
+        served = self._served_path(path)
+        if served is None:
+            return None
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+        if path.with_name(path.name + CONTROL_SUFFIX).exists():
+            return None
+        key = (str(path), stat.st_size, stat.st_mtime_ns)
+        digest = digest or self.checksums.lookup(path, stat)
+        if digest is None:
+            with self._lock:
+                digest = self._digests.get(key)
+            if digest is None:
+                self._hash_later(path, key, stat.st_size)
+                return None
+        return {"path": served, "size": stat.st_size, "sha256": digest}
+
+    def _hash_later(self, path: Path, key: Tuple[str, int, int], size: int) -> None:
+        with self._lock:
+            if key in self._hashing or len(self._hashing) >= MAX_PENDING_HASHES:
+                return
+            self._hashing.add(key)
+
+        def work() -> None:
+            try:
+                digest = hash_file(path)
+            except OSError as e:
+                logger.debug(f"Not hashing {path} for peers: {e}")
+                return
+            finally:
+                with self._lock:
+                    self._hashing.discard(key)
+            with self._lock:
+                self._digests[key] = digest
+
+        try:
+            self.devices.submit(path, work, nbytes=size)
+        except RuntimeError:
+            # The scheduler is shutting down.
+            with self._lock:
+                self._hashing.discard(key)
+
+    def lookup(self, urls: List[str], digests: List[str]) -> Dict[str, Dict]:
+        """Blocking but cheap (stats only); run it in the I/O executor."""
+        with self._lock:
+            self._load_journal()
+            journal = self._urls
+        by_url = {}
+        for url in urls:
+            path = journal.get(journal_key(url))
+            match = self._match(path) if path is not None else None
+            if match is not None:
+                by_url[url] = match
+        by_digest = {}
+        for digest in digests:
+            path = self.checksums.find(digest.lower())
+            if path is not None:
+                match = self._match(path, digest.lower())
+                if match is not None:
+                    by_digest[digest] = match
+        return {"urls": by_url, "sha256": by_digest}
+
+
+class PeerCache:
+    """
+    Client side: asks other downloader-cli servers for finished copies of the
+    entries of a URL list and pulls hits over the LAN, verifying the SHA-256.
+    """
+
+    def __init__(
+        self,
+        peers: List[str],
+        timeout: float = 10.0,
+        session: Optional[requests.Session] = None,
+    ):
+        self.peers = [peer.rstrip("/") for peer in peers]
+        self.timeout = timeout
+        self.session = session or create_session(max(len(self.peers), 4))
+
+    def _ask(self, peer: str, urls: List[str], digests: List[str]) -> Dict:
+        try:
+            response = self.session.post(
+                f"{peer}{LOOKUP_PATH}",
+                json={"urls": urls, "sha256": digests},
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+            return response.json()
+        except (requests.RequestException, ValueError) as e:
+            logger.warning(f"Peer {peer} lookup failed: {e}")
+            return {}
+
+    def lookup(self, entries: List[Entry]) -> Dict[int, Tuple[str, Match]]:
+        """
+        Index of each entry a peer has -> (peer, match). Earlier peers win.
+        Every entry must be a single file: the journal maps a URL to one file,
+        so playlist and channel URLs are expanded before they are looked up.
+        """
+        if not self.peers or not entries:
+            return {}
+        urls = [entry["url"] for entry in entries]
+        digests = [d for d in (entry_sha256(entry) for entry in entries) if d]
+        with ThreadPoolExecutor(max_workers=len(self.peers)) as executor:
+            answers = list(
+                executor.map(lambda peer: self._ask(peer, urls, digests), self.peers)
+            )
+
+        hits = {}
+        for index, entry in enumerate(entries):
+            digest = entry_sha256(entry)
+            for peer, answer in zip(self.peers, answers):
+                match = answer.get("urls", {}).get(entry["url"])
+                if match is None and digest:
+                    match = answer.get("sha256", {}).get(digest)
+                # A peer's copy that differs from the expected content is no hit.
+                if match is not None and (not digest or match["sha256"] == digest):
+                    hits[index] = (peer, match)
+                    break
+        return hits
+
+    def fetch(self, peer: str, match: Match, destination: Path) -> bool:
+        """Download a peer's copy next to `destination`, rename it if it verifies."""
+        # Shows up as an in-progress download while it is being pulled.
+        temporary = destination.with_name(destination.name + PART_SUFFIX)
+        digest = hashlib.sha256()
+        received = 0
+        try:
+            with self.session.get(
+                f"{peer}/{quote(match['path'])}", stream=True, timeout=self.timeout
+            ) as response:
+                response.raise_for_status()
+                with open(temporary, "wb") as f:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        f.write(chunk)
+                        digest.update(chunk)
+                        received += len(chunk)
+        except (requests.RequestException, OSError) as e:
+            logger.warning(f"Fetching {match['path']} from {peer} failed: {e}")
+            temporary.unlink(missing_ok=True)
+            return False
+
+        if received != match["size"] or digest.hexdigest() != match["sha256"]:
+            logger.warning(
+                f"{match['path']} from {peer} failed verification "
+                f"({received} of {match['size']} bytes), discarding it"
+            )
+            temporary.unlink(missing_ok=True)
+            return False
+        os.replace(temporary, destination)
+        return True
@@ -0,0 +1,263 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .config import get_config_value, get_state_dir
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "playlists.json"
+DEFAULT_RETENTION = {"max_count": 20, "max_age_days": 30}
+
+
+def atomic_write_text(path: Path, content: str) -> None:
+    """Write a file via a temporary sibling and rename it into place."""
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        os.replace(tmp_name, path)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+        raise
+
+
+def atomic_append_text(path: Path, content: str) -> None:
+    """
+    Append with a single O_APPEND write, so concurrent appenders never
+    interleave and readers see whole lines once they see the trailing newline.
+    """
+    data = content.encode("utf-8")
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view) :]
+    finally:
+        os.close(fd)
+
+
+def get_retention_settings() -> Dict[str, Any]:
+    retention = get_config_value("playlist_retention")
+    if not isinstance(retention, dict):
+        return dict(DEFAULT_RETENTION)
+    return {**DEFAULT_RETENTION, **retention}
+
+
+class PlaylistRegistry:
+    """
+    Manifest of generated playlists stored in the state directory of `root`.
+
+    IDs come from per-prefix counters kept in the manifest, so allocating a new
+    name never has to probe the filesystem. Each entry records the source roots,
+    host and a content digest so identical regenerations reuse the existing file.
+    Changes reload the manifest under an exclusive lock, so processes writing
+    to the same root do not lose each other's updates.
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.manifest_path = get_state_dir(self.root) / MANIFEST_NAME
+        self.lock_path = self.manifest_path.with_name(MANIFEST_NAME + ".lock")
+        self._manifest = self._load()
+        self._lock_depth = 0
+
+    def _load(self) -> Dict[str, Any]:
+        if self.manifest_path.exists():
+            try:
+                with open(self.manifest_path, "r") as f:
+                    manifest = json.load(f)
+                manifest.setdefault("counters", {})
+                manifest.setdefault("playlists", {})
+                return manifest
+            except (OSError, ValueError):
+                logger.warning(f"Ignoring unreadable manifest {self.manifest_path}")
+        return {"counters": {}, "playlists": {}}
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """Hold the manifest lock and work on its current content; reentrant."""
+        if self._lock_depth:
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+            return
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self._lock_depth = 1
+            try:
+                self._manifest = self._load()
+                yield
+            finally:
+                self._lock_depth = 0
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _save(self) -> None:
+        # Callers hold the lock from loading the manifest until this write.
+        atomic_write_text(self.manifest_path, json.dumps(self._manifest, indent=2))
+
+    def _seed_counter(self, prefix: str, suffix: str) -> int:
+        # Only runs the first time a prefix is seen, to stay clear of names
+        # created before the manifest existed.
+        pattern = re.compile(rf"^{re.escape(prefix)}_(\d+){re.escape(suffix)}$")
+        highest = 0
+        for entry in os.scandir(self.root):
+            match = pattern.match(entry.name)
+            if match:
+                highest = max(highest, int(match.group(1)))
+        return highest
+
+    def next_index(self, prefix: str, suffix: str = "") -> int:
+        with self._locked():
+            counters = self._manifest["counters"]
+            if prefix not in counters:
+                counters[prefix] = self._seed_counter(prefix, suffix)
+            counters[prefix] += 1
+            self._save()
+            return counters[prefix]
+
+    def entries(self) -> List[Dict[str, Any]]:
+        return sorted(
+            self._manifest["playlists"].values(),
+            key=lambda entry: entry["created_at"],
+            reverse=True,
+        )
+
+    def paths(self) -> List[Path]:
+        return [self.root / entry["file"] for entry in self.entries()]
+
+    def register(
+        self,
+        content: str,
+        roots: List[Path],
+        host: str,
+        prefix: str = "playlist",
+    ) -> Path:
+        """Store a playlist, reusing an identical one when it still exists."""
+        digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        source_roots = [str(Path(r)) for r in roots]
+
+        with self._locked():
+            for entry in self._manifest["playlists"].values():
+                if (
+                    entry["digest"] == digest
+                    and entry["roots"] == source_roots
+                    and entry["host"] == host
+                    and (self.root / entry["file"]).is_file()
+                ):
+                    entry["created_at"] = time.time()
+                    self._save()
+                    logger.info(f"Reusing identical playlist {entry['file']}")
+                    return self.root / entry["file"]
+
+            index = self.next_index(prefix, ".m3u8")
+            file_name = f"{prefix}_{index}.m3u8"
+            atomic_write_text(self.root / file_name, content)
+            self._manifest["playlists"][file_name] = {
+                "file": file_name,
+                "roots": source_roots,
+                "host": host,
+                "digest": digest,
+                "created_at": time.time(),
+            }
+            self.prune()
+            return self.root / file_name
+
+    def latest_for(self, root: Path) -> Optional[Dict[str, Any]]:
+        """The newest playlist that includes `root`, if it still exists."""
+        root = str(Path(root))
+        for entry in self.entries():
+            if root in entry["roots"] and (self.root / entry["file"]).is_file():
+                return entry
+        return None
+
+    def append_missing(self, file_name: str, entries: List[Tuple[str, str]]) -> int:
+        """
+        Append the (url, lines) entries whose URL a registered playlist does
+        not list yet, in place; returns how many were appended. The check and
+        the write happen under the lock, so concurrent appenders add a file
+        once.
+        """
+        path = self.root / file_name
+        with self._locked():
+            existing = path.read_text()
+            listed = set(existing.splitlines())
+            blocks = []
+            for url, lines in entries:
+                if url not in listed:
+                    listed.add(url)
+                    blocks.append(lines)
+            if not blocks:
+                return 0
+            separator = "" if not existing or existing.endswith("\n") else "\n"
+            atomic_append_text(path, separator + "".join(blocks))
+            # Keep the digest honest, or an identical regeneration of the old
+            # content would reuse this longer file.
+            digest = hashlib.sha256(path.read_bytes()).hexdigest()
+            entry = self._manifest["playlists"].get(file_name)
+            if entry is not None:
+                entry["digest"] = digest
+                self._save()
+        return len(blocks)
+
+    def prune(
+        self,
+        max_count: Optional[int] = None,
+        max_age_days: Optional[float] = None,
+    ) -> List[str]:
+        """Delete playlists beyond the retention limits, newest are kept."""
+        if max_count is None or max_age_days is None:
+            retention = get_retention_settings()
+            max_count = retention["max_count"] if max_count is None else max_count
+            max_age_days = (
+                retention["max_age_days"] if max_age_days is None else max_age_days
+            )
+
+        with self._locked():
+            now = time.time()
+            removed = []
+            for position, entry in enumerate(self.entries()):
+                too_many = max_count and position >= max_count
+                too_old = (
+                    max_age_days and now - entry["created_at"] > max_age_days * 86400
+                )
+                # The newest playlist is always kept, it is the one being served.
+                if position > 0 and (too_many or too_old):
+                    removed.append(entry["file"])
+
+            for file_name in removed:
+                del self._manifest["playlists"][file_name]
+                try:
+                    (self.root / file_name).unlink()
+                except FileNotFoundError:
+                    pass
+
+            self._save()
+        if removed:
+            logger.info(f"Removed {len(removed)} old playlist(s) from {self.root}")
+        return removed
@@ -0,0 +1,127 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+import threading
+from collections import OrderedDict
+from typing import Iterable, Iterator, List, Mapping, Optional, Tuple
+from urllib.parse import quote
+
+from .cluster import Cluster
+from .file_index import FileIndex
+
+HOST_PATTERN = re.compile(r"^(\[[0-9A-Fa-f:.]+\]|[A-Za-z0-9.\-]+)(:\d{1,5})?$")
+PREFIX_PATTERN = re.compile(r"^(/[A-Za-z0-9._~\-%]+)*$")
+ENTRIES_PER_CHUNK = 256
+
+
+def _first(value: str) -> str:
+    # Chained proxies append their own values: "a, b" -> the client-facing "a".
+    return value.split(",")[0].strip()
+
+
+def base_url_from_headers(
+    headers: Mapping[str, str], default_scheme: str, default_host: str
+) -> str:
+    """
+    Base URL as seen by the client, honouring Host and the X-Forwarded-* headers
+    set by reverse proxies. Malformed values fall back to the defaults.
+    """
+    scheme = _first(headers.get("x-forwarded-proto", "")) or default_scheme
+    if scheme not in ("http", "https"):
+        scheme = default_scheme
+
+    host = _first(headers.get("x-forwarded-host", "")) or headers.get("host", "")
+    if not HOST_PATTERN.match(host):
+        host = default_host
+    port = _first(headers.get("x-forwarded-port", ""))
+    if port.isdigit() and not HOST_PATTERN.match(host).group(2):
+        if (scheme, port) not in (("http", "80"), ("https", "443")):
+            host = f"{host}:{port}"
+
+    prefix = _first(headers.get("x-forwarded-prefix", "")).rstrip("/")
+    if not PREFIX_PATTERN.match(prefix):
+        prefix = ""
+    return f"{scheme}://{host}{prefix}"
+
+
+class PlaylistRenderer:
+    """
+    M3U8 playlists rendered from the file index for whatever base URL a client
+    used. Rendered output is kept per base URL and dropped once the index
+    version moves on. In cluster mode, entries point at the node that owns
+    them.
+    """
+
+    def __init__(
+        self,
+        file_index: FileIndex,
+        extensions: Iterable[str],
+        max_bases: int = 32,
+        cluster: Optional[Cluster] = None,
+    ):
+        self.file_index = file_index
+        self.cluster = cluster
+        self.extensions = frozenset(extensions)
+        self.max_bases = max_bases
+        self.hits = 0
+        self.misses = 0
+        self._cache: "OrderedDict[str, Tuple[Tuple[int, int], List[str]]]" = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def _version(self) -> Tuple[int, int]:
+        cluster_version = self.cluster.version if self.cluster else 0
+        return self.file_index.version, cluster_version
+
+    def render(self, base_url: str) -> Iterator[str]:
+        version = self._version()
+        with self._lock:
+            cached = self._cache.get(base_url)
+            if cached and cached[0] == version:
+                self._cache.move_to_end(base_url)
+                self.hits += 1
+                return iter(cached[1])
+            self.misses += 1
+        return self._generate(base_url, version)
+
+    def _generate(self, base_url: str, version: Tuple[int, int]) -> Iterator[str]:
+        chunks: List[str] = []
+        lines = ["#EXTM3U\n"]
+        for info in self.file_index.sorted_entries():
+            if info["extension"] not in self.extensions:
+                continue
+            path = f"{info['directory'].name}/{info.get('relative_path', info['name'])}"
+            node = self.cluster.redirect_base(path) if self.cluster else None
+            lines.append(
+                f"#EXTINF:-1,{info['name']}\n{node or base_url}/{quote(path)}\n"
+            )
+            if len(lines) >= ENTRIES_PER_CHUNK:
+                chunks.append("".join(lines))
+                lines = []
+                yield chunks[-1]
+        if lines:
+            chunks.append("".join(lines))
+            yield chunks[-1]
+
+        # Entries added while rendering belong to a newer version; don't keep
+        # a playlist that may already be missing them.
+        if self._version() != version:
+            return
+        with self._lock:
+            self._cache[base_url] = (version, chunks)
+            self._cache.move_to_end(base_url)
+            while len(self._cache) > self.max_bases:
+                self._cache.popitem(last=False)
@@ -0,0 +1,117 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import cProfile
+import io
+import pstats
+import time
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# Returned by stage() while profiling is off; reusing one instance keeps the
+# disabled path down to a global lookup and a function call.
+_NULL_STAGE = nullcontext()
+
+
+class Profiler:
+    def __init__(self, output: Path):
+        self.output = output
+        # Next to the report under its own name, also when the report is *.prof.
+        self.stats_path = output.with_name(output.name + ".prof")
+        self.started_at = time.perf_counter()
+        self.stages: Dict[str, List[float]] = {}
+        self.marks: List[Tuple[str, float]] = []
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def record(self, name: str, elapsed: float) -> None:
+        self.stages.setdefault(name, []).append(elapsed)
+
+    def mark(self, name: str) -> None:
+        self.marks.append((name, time.perf_counter() - self.started_at))
+
+    def report(self) -> str:
+        lines = [f"Total wall time: {time.perf_counter() - self.started_at:.3f}s", ""]
+        lines.append("Stages (wall time):")
+        for name, timings in self.stages.items():
+            lines.append(
+                f"  {name:<24} {sum(timings):10.3f}s  calls={len(timings)}"
+                f"  max={max(timings):.3f}s"
+            )
+        if self.marks:
+            lines.append("")
+            lines.append("Milestones (since start):")
+            for name, offset in self.marks:
+                lines.append(f"  {name:<24} {offset:10.3f}s")
+
+        stream = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=stream)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(40)
+        lines.append("")
+        lines.append(stream.getvalue())
+        return "\n".join(lines)
+
+    def finish(self) -> None:
+        self.profile.disable()
+        self.output.parent.mkdir(parents=True, exist_ok=True)
+        self.profile.dump_stats(str(self.stats_path))
+        self.output.write_text(self.report())
+
+
+class _Stage:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler: Profiler, name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+_profiler: Optional[Profiler] = None
+
+
+def enable_profiling(output: Path) -> Profiler:
+    global _profiler
+    _profiler = Profiler(output)
+    return _profiler
+
+
+def finish_profiling() -> Optional[Profiler]:
+    global _profiler
+    if _profiler is None:
+        return None
+    profiler, _profiler = _profiler, None
+    profiler.finish()
+    return profiler
+
+
+def stage(name: str):
+    """Time a named block when profiling is enabled, a shared no-op otherwise."""
+    if _profiler is None:
+        return _NULL_STAGE
+    return _Stage(_profiler, name)
+
+
+def mark(name: str) -> None:
+    """Record a point in time, such as the server becoming ready."""
+    if _profiler is not None:
+        _profiler.mark(name)
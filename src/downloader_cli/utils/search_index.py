@@ -0,0 +1,161 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+
+# Names are indexed as "\x02name\x03", so trigrams starting with the
+# marker only occur at the beginning of a name and answer prefix queries.
+START = "\x02"
+END = "\x03"
+
+
+def _trigrams(text: str) -> Set[str]:
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+def _unique(id_sets: Iterable[Set[int]]) -> Iterator[int]:
+    seen: Set[int] = set()
+    for ids in id_sets:
+        for doc_id in ids:
+            if doc_id not in seen:
+                seen.add(doc_id)
+                yield doc_id
+
+
+class SearchIndex:
+    """
+    Trigram inverted index over file names and relative paths.
+
+    Each document is a served file. A query is answered by intersecting the
+    posting sets of its trigrams, smallest first, and verifying the few
+    remaining candidates against the real string.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._docs: List[Optional[Dict[str, Any]]] = []
+        self._keys: Dict[str, int] = {}
+        self._postings: Dict[str, Set[int]] = {}
+        self._extensions: Dict[str, Set[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def _doc_text(self, doc: Dict[str, Any]) -> str:
+        return f"{START}{doc['name_lower']}{END}{START}{doc['path_lower']}{END}"
+
+    def add(self, path: str, name: str, info: Dict[str, Any]) -> None:
+        with self._lock:
+            if path in self._keys:
+                self._remove_locked(path)
+            doc_id = len(self._docs)
+            doc = {
+                "path": path,
+                "name": name,
+                "path_lower": path.lower(),
+                "name_lower": name.lower(),
+                "extension": info.get("extension", ""),
+                "info": info,
+            }
+            self._docs.append(doc)
+            self._keys[path] = doc_id
+            for trigram in _trigrams(self._doc_text(doc)):
+                self._postings.setdefault(trigram, set()).add(doc_id)
+            self._extensions.setdefault(doc["extension"], set()).add(doc_id)
+
+    def add_file_info(self, info: Dict[str, Any]) -> None:
+        path = f"{info['directory'].name}/{info.get('relative_path', info['name'])}"
+        self.add(path, info["name"], info)
+
+    def remove(self, path: str) -> None:
+        with self._lock:
+            self._remove_locked(path)
+
+    def _remove_locked(self, path: str) -> None:
+        doc_id = self._keys.pop(path, None)
+        if doc_id is None:
+            return
+        doc = self._docs[doc_id]
+        for trigram in _trigrams(self._doc_text(doc)):
+            postings = self._postings.get(trigram)
+            if postings is not None:
+                postings.discard(doc_id)
+                if not postings:
+                    del self._postings[trigram]
+        self._extensions.get(doc["extension"], set()).discard(doc_id)
+        self._docs[doc_id] = None
+
+    def _matches(self, doc: Dict[str, Any], query: str, prefix: bool) -> bool:
+        if prefix:
+            return doc["name_lower"].startswith(query) or doc["path_lower"].startswith(
+                query
+            )
+        return query in doc["path_lower"]
+
+    def search(
+        self,
+        query: str = "",
+        prefix: bool = False,
+        extensions: Optional[List[str]] = None,
+        limit: int = 100,
+    ) -> List[Dict[str, Any]]:
+        query = query.lower()
+        with self._lock:
+            candidate_sets = []
+            ext_sets = []
+            for extension in extensions or []:
+                extension = extension.lower()
+                if not extension.startswith("."):
+                    extension = f".{extension}"
+                ext_sets.append(self._extensions.get(extension, set()))
+
+            pattern = f"{START}{query}" if prefix else query
+            if len(pattern) >= 3:
+                for gram in _trigrams(pattern):
+                    postings = self._postings.get(gram)
+                    if not postings:
+                        return []
+                    candidate_sets.append(postings)
+                candidate_sets.sort(key=len)
+                ids = candidate_sets.pop(0)
+            elif pattern:
+                # Too short for a trigram: walk the postings of every trigram
+                # containing it. There are far fewer trigrams than files.
+                grams = [gram for gram in self._postings if pattern in gram]
+                if not grams:
+                    return []
+                ids = _unique(self._postings[gram] for gram in grams)
+            elif ext_sets:
+                ids = _unique(ext_sets)
+            else:
+                ids = (doc_id for doc_id, doc in enumerate(self._docs) if doc)
+
+            # Check membership lazily instead of materialising the whole
+            # intersection, so common queries stop as soon as `limit` is hit.
+            docs = (
+                self._docs[doc_id]
+                for doc_id in ids
+                if all(doc_id in other for other in candidate_sets)
+                and (not ext_sets or any(doc_id in ext for ext in ext_sets))
+            )
+
+            results = []
+            for doc in docs:
+                if query and not self._matches(doc, query, prefix):
+                    continue
+                results.append(doc)
+                if len(results) >= limit:
+                    break
+            return results
@@ -0,0 +1,197 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from .config import CONFIG_DIR, get_config_value
+from .playlist_registry import atomic_write_text
+
+logger = logging.getLogger(__name__)
+
+CACHE_FILE = os.path.join(CONFIG_DIR, "expansion_cache.json")
+DEFAULT_TTL = 6 * 3600
+
+Entry = Dict[str, Optional[str]]
+
+
+def normalize_url(url: str) -> str:
+    """Canonical form used as cache key: no fragment, no tracking parameters."""
+    parts = urlsplit(url.strip())
+    query = [
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith("utm_")
+    ]
+    path = parts.path.rstrip("/") or parts.path
+    return urlunsplit(
+        (parts.scheme.lower(), parts.netloc.lower(), path, urlencode(query), "")
+    )
+
+
+def read_url_list(playlist_file: str) -> List[str]:
+    urls = []
+    with open(playlist_file, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith(("#", ";", "]")):
+                urls.append(normalize_url(line))
+    # Keep the first occurrence of every URL, in file order.
+    return list(dict.fromkeys(urls))
+
+
+def ytdlp_flat_extractor(url: str) -> Dict[str, Any]:
+    """Run yt-dlp once in flat-playlist mode and return its JSON."""
+    result = subprocess.run(
+        ["yt-dlp", "--flat-playlist", "-J", "--no-warnings", url],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout)
+
+
+def entries_from_info(url: str, info: Dict[str, Any]) -> List[Entry]:
+    if info.get("entries") is None:
+        return [
+            {
+                "url": info.get("webpage_url") or url,
+                "id": info.get("id"),
+                "ie_key": info.get("extractor_key") or info.get("ie_key"),
+            }
+        ]
+    entries = []
+    for item in info["entries"]:
+        if not item:
+            continue
+        if item.get("entries") is not None:
+            # Channels expand into tabs/playlists, flatten them as well.
+            entries.extend(entries_from_info(url, item))
+            continue
+        entries.append(
+            {
+                "url": item.get("url") or item.get("webpage_url"),
+                "id": item.get("id"),
+                "ie_key": item.get("ie_key") or item.get("extractor_key"),
+            }
+        )
+    return [entry for entry in entries if entry["url"]]
+
+
+class UrlExpansionCache:
+    """
+    Flat expansion of playlist and channel URLs, cached with a TTL.
+
+    The extractor is injectable, so a fake callable or fixture data can stand in
+    for yt-dlp.
+    """
+
+    def __init__(
+        self,
+        cache_file: str = CACHE_FILE,
+        ttl: Optional[float] = None,
+        extractor: Callable[[str], Dict[str, Any]] = ytdlp_flat_extractor,
+        workers: int = 4,
+    ):
+        self.cache_file = Path(cache_file)
+        if ttl is None:
+            ttl = get_config_value("expansion_cache_ttl") or DEFAULT_TTL
+        self.ttl = ttl
+        self.extractor = extractor
+        self.workers = workers
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        try:
+            with open(self.cache_file, "r") as f:
+                self._cache: Dict[str, Any] = json.load(f)
+        except (OSError, ValueError):
+            self._cache = {}
+
+    def save(self) -> None:
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        now = time.time()
+        fresh = {
+            url: item
+            for url, item in self._cache.items()
+            if now - item["expanded_at"] < self.ttl
+        }
+        atomic_write_text(self.cache_file, json.dumps(fresh))
+
+    def _expand_one(self, url: str) -> List[Entry]:
+        cached = self._cache.get(url)
+        if cached and time.time() - cached["expanded_at"] < self.ttl:
+            with self._lock:
+                self.hits += 1
+            return cached["entries"]
+
+        with self._lock:
+            self.misses += 1
+        try:
+            entries = entries_from_info(url, self.extractor(url))
+        except (OSError, ValueError, subprocess.CalledProcessError) as e:
+            # Let the downloader deal with it, just without the cache.
+            logger.warning(f"Could not expand {url}: {e}")
+            return [{"url": url, "id": None, "ie_key": None}]
+
+        with self._lock:
+            self._cache[url] = {"expanded_at": time.time(), "entries": entries}
+        return entries
+
+    def expand(self, urls: List[str]) -> Dict[str, List[Entry]]:
+        """Expanded entries per host, hosts in order of first appearance."""
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            expanded = list(executor.map(self._expand_one, urls))
+        self.save()
+
+        by_host: Dict[str, List[Entry]] = {}
+        seen = set()
+        for entries in expanded:
+            for entry in entries:
+                url = normalize_url(entry["url"])
+                if url in seen:
+                    continue
+                seen.add(url)
+                host = urlsplit(url).netloc or "local"
+                by_host.setdefault(host, []).append({**entry, "url": url})
+        return by_host
+
+
+def read_download_archive(archive_path: Path) -> set:
+    try:
+        with open(archive_path, "r") as f:
+            return {line.strip() for line in f if line.strip()}
+    except FileNotFoundError:
+        return set()
+
+
+def filter_new_entries(entries: List[Entry], archive: set) -> List[Entry]:
+    """Drop entries yt-dlp already recorded in its --download-archive file."""
+    return [
+        entry
+        for entry in entries
+        if not (
+            entry["id"]
+            and entry["ie_key"]
+            and f"{entry['ie_key'].lower()} {entry['id']}" in archive
+        )
+    ]
@@ -0,0 +1,74 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest import mock
+
+from downloader_cli.commands.append_playlist import append_new_downloads
+from downloader_cli.utils.media_index import MediaIndex
+from downloader_cli.utils.playlist_registry import PlaylistRegistry
+
+HOST = "http://192.168.1.2:8000"
+
+
+class AppendNewDownloadsTest(unittest.TestCase):
+    def setUp(self):
+        temporary = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary.cleanup)
+        parent = Path(temporary.name).resolve()
+        self.root = parent / "lib"
+        self.root.mkdir()
+        # Defaults for retention and ignore rules, whatever the user's config.
+        patcher = mock.patch("downloader_cli.utils.config.load_config", return_value={})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.registry = PlaylistRegistry(parent)
+        self.playlist = self.registry.register("#EXTM3U\n", [self.root], HOST)
+
+    def test_session_directory_is_appended_through_its_served_root(self):
+        session = self.root / "session_3"
+        session.mkdir()
+        (session / "cover.jpg").write_bytes(b"jpeg")
+
+        infos = append_new_downloads(session)
+
+        self.assertEqual(
+            [info["relative_path"] for info in infos], ["session_3/cover.jpg"]
+        )
+        self.assertEqual(MediaIndex(self.root).paths(), {"session_3/cover.jpg"})
+        self.assertIn(f"{HOST}/lib/session_3/cover.jpg\n", self.playlist.read_text())
+
+    def test_concurrent_appends_list_a_file_once(self):
+        (self.root / "cover.jpg").write_bytes(b"jpeg")
+        url = f"{HOST}/lib/./cover.jpg"
+        entries = [(url, f"#EXTINF:-1,cover.jpg\n{url}\n")]
+
+        def append(_):
+            return PlaylistRegistry(self.registry.root).append_missing(
+                self.playlist.name, entries
+            )
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            appended = list(executor.map(append, range(8)))
+
+        self.assertEqual(sum(appended), 1)
+        self.assertEqual(self.playlist.read_text().count(f"{url}\n"), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import time
+import unittest
+
+from downloader_cli.utils.bandwidth import BandwidthShaper
+
+
+class BandwidthShaperTest(unittest.TestCase):
+    def test_sequential_streams_share_one_burst(self):
+        shaper = BandwidthShaper(client_rate=1000, burst=1000)
+
+        ticket = shaper.open_stream("10.0.0.2", ranged=False)
+        bucket = shaper.clients["10.0.0.2"].bucket
+        bucket.take(1000)
+        shaper.close_stream(ticket)
+        shaper.open_stream("10.0.0.2", ranged=False)
+
+        self.assertIs(shaper.clients["10.0.0.2"].bucket, bucket)
+        self.assertGreater(bucket.take(500), 0)
+
+    def test_idle_client_is_dropped_once_refilled(self):
+        shaper = BandwidthShaper(client_rate=1000, burst=10)
+
+        ticket = shaper.open_stream("10.0.0.2", ranged=False)
+        shaper.clients["10.0.0.2"].bucket.take(10)
+        shaper.close_stream(ticket)
+        time.sleep(0.02)
+        shaper.open_stream("10.0.0.3", ranged=False)
+
+        self.assertEqual(list(shaper.clients), ["10.0.0.3"])
+
+    def test_client_without_a_rate_is_dropped_on_close(self):
+        shaper = BandwidthShaper(max_streams_per_client=2)
+
+        shaper.close_stream(shaper.open_stream("10.0.0.2", ranged=False))
+
+        self.assertEqual(shaper.clients, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from downloader_cli.utils.checksums import ChecksumManifest, ChecksumStore, hash_file
+from downloader_cli.utils.config import STATE_DIR_NAME
+
+
+class ChecksumStoreTest(unittest.TestCase):
+    def setUp(self):
+        temporary = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary.cleanup)
+        self.root = Path(temporary.name)
+        self.media = self.root / "a.mp4"
+        self.media.write_bytes(b"video")
+
+    def test_reading_leaves_the_root_untouched(self):
+        store = ChecksumStore([self.root])
+
+        self.assertIsNone(store.lookup(self.media, self.media.stat()))
+        self.assertFalse((self.root / STATE_DIR_NAME).exists())
+
+    def test_saved_manifest_is_found(self):
+        manifest = ChecksumManifest(self.root)
+        manifest.record(self.media, self.media.stat(), hash_file(self.media))
+        manifest.save()
+
+        store = ChecksumStore([self.root])
+
+        digest = store.lookup(self.media, self.media.stat())
+        self.assertEqual(digest, hash_file(self.media))
+        self.assertEqual(store.find(digest), self.media)
+
+    @unittest.skipIf(os.geteuid() == 0, "root ignores directory permissions")
+    def test_read_only_root(self):
+        self.root.chmod(0o555)
+        self.addCleanup(self.root.chmod, 0o755)
+
+        store = ChecksumStore([self.root])
+
+        self.assertIsNone(store.lookup(self.media, self.media.stat()))
+
+
+if __name__ == "__main__":
+    unittest.main()
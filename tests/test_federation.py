@@ -0,0 +1,83 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import unittest
+
+from downloader_cli.utils.federation import PeerListingCache
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, body="", headers=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class FakeSession:
+    """Answers each peer URL with the next response queued for it."""
+
+    def __init__(self, responses):
+        self.responses = responses
+
+    def get(self, url, headers=None, timeout=None):
+        peer = url.split("/api/")[0]
+        return self.responses[peer].pop(0)
+
+
+def listing(*names):
+    files = [{"name": name, "size": 1, "url": f"/lib/{name}"} for name in names]
+    return json.dumps({"files": files})
+
+
+class PeerListingCacheTest(unittest.TestCase):
+    def test_bad_peer_keeps_its_last_listing(self):
+        session = FakeSession(
+            {
+                "http://good": [
+                    FakeResponse(body=listing("a.mp4")),
+                    FakeResponse(body=listing("a.mp4", "b.mp4")),
+                ],
+                "http://bad": [
+                    FakeResponse(body=listing("c.mp4")),
+                    FakeResponse(body="<html>502 Bad Gateway</html>"),
+                ],
+            }
+        )
+        cache = PeerListingCache(["http://good", "http://bad"], session=session)
+
+        cache.refresh()
+        cache.refresh(force=True)
+
+        names = sorted(entry["name"] for entry in cache.merged_entries())
+        self.assertEqual(names, ["a.mp4", "b.mp4", "c.mp4"])
+        errors = {status["peer"]: status["error"] for status in cache.status()}
+        self.assertIsNone(errors["http://good"])
+        self.assertTrue(errors["http://bad"].startswith("Invalid listing"))
+
+    def test_listing_that_is_not_an_object_is_rejected(self):
+        session = FakeSession({"http://odd": [FakeResponse(body="[1, 2]")]})
+        cache = PeerListingCache(["http://odd"], session=session)
+
+        cache.refresh()
+
+        self.assertEqual(cache.merged_entries(), [])
+        self.assertIsNotNone(cache.status()[0]["error"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+from pathlib import Path
+
+from downloader_cli.utils.file_index import FileIndex
+
+
+class FileIndexWarmUpTest(unittest.TestCase):
+    def test_failed_build_is_reported(self):
+        def collect():
+            raise PermissionError("denied")
+
+        index = FileIndex()
+        with self.assertLogs("downloader_cli.utils.file_index", "ERROR"):
+            index.warm_up(collect, lambda path, directory: {})
+
+        progress = index.progress()
+        self.assertFalse(progress["ready"])
+        self.assertEqual(progress["error"], "PermissionError: denied")
+
+    def test_successful_build_is_ready(self):
+        def describe(path, directory):
+            return {"name": path.name, "directory": directory, "created_at": 0}
+
+        index = FileIndex()
+        index.warm_up(lambda: [(Path("/lib/a.mp4"), Path("/lib"))], describe)
+
+        self.assertEqual(index.progress()["indexed"], 1)
+        self.assertTrue(index.ready)
+        self.assertIsNone(index.error)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import tempfile
+import unittest
+from pathlib import Path
+
+from downloader_cli.utils.config import STATE_DIR_NAME
+from downloader_cli.utils.media_index import MediaIndex, MediaIndexFollower
+
+
+class MediaIndexFollowerTest(unittest.TestCase):
+    def setUp(self):
+        temporary = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary.cleanup)
+        self.root = Path(temporary.name)
+
+    def test_following_leaves_the_root_untouched(self):
+        follower = MediaIndexFollower([self.root])
+
+        self.assertEqual(follower.poll(), [])
+        self.assertFalse((self.root / STATE_DIR_NAME).exists())
+
+    def test_appended_entries_are_followed(self):
+        follower = MediaIndexFollower([self.root])
+
+        MediaIndex(self.root).append([{"name": "a.mp4", "relative_path": "a.mp4"}])
+
+        entries = follower.poll()
+        self.assertEqual([entry["name"] for entry in entries], ["a.mp4"])
+        self.assertEqual(entries[0]["directory"], self.root)
+        self.assertEqual(follower.poll(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
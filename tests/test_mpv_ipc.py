@@ -0,0 +1,42 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import json
+import socket
+import unittest
+from pathlib import Path
+
+from downloader_cli.utils.mpv_ipc import PLAYLIST_POS, MpvSupervisor
+
+
+class MpvSupervisorTest(unittest.TestCase):
+    def test_garbage_lines_are_skipped(self):
+        supervisor = MpvSupervisor(Path("unused.sock"), prefetch=0, head_bytes=1)
+        supervisor._sock, mpv = socket.socketpair()
+        event = {"event": "property-change", "id": PLAYLIST_POS, "data": 3}
+        mpv.sendall(b'{"event": "proper\n[1, 2]\n' + json.dumps(event).encode() + b"\n")
+        # mpv stops talking but still reads the commands the supervisor sends.
+        mpv.shutdown(socket.SHUT_WR)
+
+        with self.assertLogs("downloader_cli.utils.mpv_ipc", "WARNING") as logs:
+            supervisor.run()
+
+        self.assertEqual(len(logs.output), 2)
+        self.assertEqual(supervisor.position, 3)
+        mpv.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+# Copyright 2024 tadeasfort
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import tempfile
+import unittest
+from pathlib import Path
+
+from downloader_cli.commands.peer_download import ytdlp_entries
+from downloader_cli.utils.checksums import ChecksumManifest, ChecksumStore, hash_file
+from downloader_cli.utils.device_io import DeviceScheduler
+from downloader_cli.utils.peer_cache import PeerCache, PeerIndex, append_journal
+from downloader_cli.utils.url_expansion import UrlExpansionCache
+
+DIGEST = "ab" * 32
+VIDEO_A = "https://www.youtube.com/watch?v=aaaaaaaaaaa"
+VIDEO_B = "https://www.youtube.com/watch?v=bbbbbbbbbbb"
+PLAYLIST = "https://www.youtube.com/playlist?list=PL123"
+
+
+class FakeResponse:
+    def __init__(self, body):
+        self.body = body
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.body
+
+
+class FakeSession:
+    """Answers every lookup with the same body and keeps what was asked."""
+
+    def __init__(self, body):
+        self.body = body
+        self.asked = []
+
+    def post(self, url, json=None, timeout=None):
+        self.asked.append(json)
+        return FakeResponse(self.body)
+
+
+def match(path):
+    return {"path": path, "size": 1, "sha256": DIGEST}
+
+
+class PeerCacheLookupTest(unittest.TestCase):
+    def test_url_and_checksum_hits(self):
+        entries = [
+            {"url": "https://example.com/a.mp4", "options": []},
+            {
+                "url": "https://example.com/b.mp4",
+                "options": [f"checksum=sha-256={DIGEST}"],
+            },
+            {"url": "https://example.com/c.mp4", "options": []},
+        ]
+        session = FakeSession(
+            {
+                "urls": {"https://example.com/a.mp4": match("lib/a.mp4")},
+                "sha256": {DIGEST: match("lib/b.mp4")},
+            }
+        )
+        cache = PeerCache(["http://peer"], session=session)
+
+        hits = cache.lookup(entries)
+
+        self.assertEqual(sorted(hits), [0, 1])
+        self.assertEqual(hits[1][1]["path"], "lib/b.mp4")
+
+    def test_ytdlp_playlist_is_looked_up_per_video(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        url_list = Path(directory.name) / "urls.txt"
+        url_list.write_text(f"{PLAYLIST}\n")
+        expansion = UrlExpansionCache(
+            cache_file=str(Path(directory.name) / "expansion.json"),
+            ttl=60,
+            extractor=lambda url: {"entries": [{"url": VIDEO_A}, {"url": VIDEO_B}]},
+        )
+        session = FakeSession({"urls": {VIDEO_B: match("lib/b.mp4")}, "sha256": {}})
+        cache = PeerCache(["http://peer"], session=session)
+
+        entries = ytdlp_entries(url_list, expansion)
+        hits = cache.lookup(entries)
+
+        self.assertEqual([entry["url"] for entry in entries], [VIDEO_A, VIDEO_B])
+        self.assertEqual(list(hits), [1])
+        self.assertNotIn(PLAYLIST, session.asked[0]["urls"])
+
+
+class PeerIndexTest(unittest.TestCase):
+    def setUp(self):
+        temporary = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary.cleanup)
+        self.root = Path(temporary.name) / "lib"
+        self.root.mkdir()
+        self.video = self.root / "Video A.mp4"
+        self.video.write_bytes(b"video")
+        manifest = ChecksumManifest(self.root)
+        manifest.record(self.video, self.video.stat(), hash_file(self.video))
+        manifest.save()
+        self.journal = str(Path(temporary.name) / "url_journal.tsv")
+        devices = DeviceScheduler([self.root], per_device=1)
+        self.addCleanup(devices.shutdown)
+        self.index = PeerIndex(
+            [self.root], ChecksumStore([self.root]), devices, journal=self.journal
+        )
+
+    def test_ytdlp_video_url_is_found(self):
+        # What yt-dlp's after_move hook writes: the video's own page URL.
+        with open(self.journal, "w") as f:
+            f.write(f"{VIDEO_A}\t{self.video}\n")
+        asked = f"{VIDEO_A}&utm_source=share"
+
+        answer = self.index.lookup([asked, VIDEO_B], [])
+
+        self.assertEqual(list(answer["urls"]), [asked])
+        self.assertEqual(answer["urls"][asked]["path"], "lib/Video A.mp4")
+        self.assertEqual(answer["urls"][asked]["sha256"], hash_file(self.video))
+
+    def test_aria2c_mirrors_are_journaled_by_their_first_uri(self):
+        mirrors = "https://a.example.com/x.mp4\thttps://b.example.com/x.mp4"
+        append_journal([(mirrors, self.video)], self.journal)
+
+        answer = self.index.lookup([mirrors], [])
+
+        self.assertEqual(answer["urls"][mirrors]["path"], "lib/Video A.mp4")
+
+
+if __name__ == "__main__":
+    unittest.main()